@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 import pymysql
 pymysql.install_as_MySQLdb()
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'main.routers.ReplicaRoutingMiddleware',
+    'main.middleware.QueryStatsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,7 +58,8 @@ ROOT_URLCONF = 'DjangoBooking.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендеринга для main.querystats
+        'BACKEND': 'main.templating.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -75,16 +79,64 @@ WSGI_APPLICATION = 'DjangoBooking.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Соединения: без пула - постоянные (CONN_MAX_AGE секунд) с проверкой перед запросом;
+# DB_POOL_SIZE > 0 включает пул процесса main.db.pool для многопоточного сервера: соединение возвращается
+# в пул после каждого запроса. Метрики пула - main.db.pool.stats() и pool_wait_ms в логе main.querystats
+DB_ENGINE = os.environ.get('DB_ENGINE', 'mysql')
+DB_ENGINES = {
+    'mysql': 'django.db.backends.mysql',
+    'sqlite3': 'django.db.backends.sqlite3',
+}
+POOLED_DB_ENGINES = {
+    'mysql': 'main.db.mysql',
+    'sqlite3': 'main.db.sqlite3',
+}
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'booking',
-        'USER':'root',
-        'PASSWORD':'root',
-        'HOST':'localhost',
-        'PORT':'3306'
+        'ENGINE': (POOLED_DB_ENGINES if DB_POOL_SIZE else DB_ENGINES)[DB_ENGINE],
+        'NAME': os.environ.get('DB_NAME', 'booking' if DB_ENGINE == 'mysql' else str(BASE_DIR / 'db.sqlite3')),
+        'USER': os.environ.get('DB_USER', 'root'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', 'root'),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '3306'),
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'POOL': {
+            'SIZE': DB_POOL_SIZE,
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+            'RECYCLE': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'CHECK_AFTER': int(os.environ.get('DB_POOL_CHECK_AFTER', 30)),
+        },
+    }
+}
+
+# Реплики для чтения: DB_REPLICAS=host1,host2 (для sqlite3 - пути к файлам) -> алиасы replica1, replica2
+# с остальными параметрами default. Страницы REPLICA_VIEWS читают из реплики (main.routers), после записи
+# пользователь REPLICA_STICKY_SECONDS читает из основной БД и видит свои изменения сразу
+DB_REPLICAS = [replica for replica in os.environ.get('DB_REPLICAS', '').split(',') if replica]
+for number, replica in enumerate(DB_REPLICAS, 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST' if DB_ENGINE == 'mysql' else 'NAME': replica,
+        # В тестах реплика - та же тестовая БД
+        'TEST': {'MIRROR': 'default'},
     }
+DATABASE_REPLICAS = [f'replica{number}' for number in range(1, len(DB_REPLICAS) + 1)]
+DATABASE_ROUTERS = ['main.routers.ReplicaRouter']
+REPLICA_VIEWS = {
+    'home',
+    'hotels',
+    'hotel',
+    'rooms',
+    'room_detail',
+    'api_hotels',
+    'api_hotel',
+    'api_hotel_rooms',
+    'api_room',
 }
+REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 15))
 
 
 # Password validation
@@ -105,6 +157,30 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Вход по email (main.backends.EmailBackend); ModelBackend остается для входа в админку по username
+AUTHENTICATION_BACKENDS = [
+    'main.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Стоимость хэширования паролей PBKDF2: профиль или явное число итераций.
+# Сколько входов в секунду дает каждый профиль - manage.py benchmark_hashers
+PASSWORD_HASHER_PROFILES = {
+    'fast': 600_000,
+    'default': 1_000_000,
+    'strong': 1_500_000,
+}
+PASSWORD_HASHER_PROFILE = os.environ.get('PASSWORD_HASHER_PROFILE', 'default')
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS')
+                               or PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE])
+PASSWORD_HASHERS = [
+    'main.hashers.ProfilePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -129,3 +205,135 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Письма отправляет фоновый воркер (manage.py run_jobs); без SMTP-сервера пишем их в консоль
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'booking@localhost')
+
+# Загрузки сразу пишутся во временные файлы на диске: пачка из 50+ фото не держится в памяти
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+DATA_UPLOAD_MAX_NUMBER_FILES = 200
+
+# Кэш выдачи поиска /hotels/: locmem (по умолчанию), file или db (нужен manage.py createcachetable)
+SEARCH_CACHE = os.environ.get('SEARCH_CACHE', 'locmem')
+SEARCH_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SEARCH_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'search')),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'search_cache',
+    },
+}
+# Кэш HTML-фрагментов карточек отелей и номеров: те же варианты, что и у кэша поиска
+FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE', 'locmem')
+FRAGMENT_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'fragments')),
+    },
+    'db': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'fragment_cache',
+    },
+}
+# Кэш сессий общий для воркеров: file (в пределах одной машины) или redis. locmem - только явно и только
+# для одного процесса: выход из аккаунта в одном процессе не виден кэшу другого, сессия там остается живой
+SESSION_CACHE = os.environ.get('SESSION_CACHE', 'file')
+SESSION_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'sessions')),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('SESSION_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': SEARCH_CACHE_BACKENDS[SEARCH_CACHE],
+    'fragments': FRAGMENT_CACHE_BACKENDS[FRAGMENT_CACHE],
+    'sessions': SESSION_CACHE_BACKENDS[SESSION_CACHE],
+}
+
+# Хранилище сессий: db (чтение и запись в БД на каждом запросе), cache (только кэш, сессии теряются
+# при его сбросе), cached_db (чтение из кэша, запись сразу в кэш и БД) или write_behind (main.sessions:
+# запись в кэш, в БД - задачей persist_session). Сравнение по запросам к БД - manage.py benchmark_sessions.
+# По умолчанию db: хранилища на кэше включаются явно вместе с общим SESSION_CACHE
+SESSION_STORE = os.environ.get('SESSION_STORE', 'db')
+SESSION_STORES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'write_behind': 'main.sessions',
+}
+SESSION_ENGINE = SESSION_STORES[SESSION_STORE]
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_WRITE_BEHIND_DELAY = int(os.environ.get('SESSION_WRITE_BEHIND_DELAY', 30))
+
+# Flash-сообщения: в подписанной cookie (по умолчанию) не трогают сессию; session/fallback - для
+# сообщений, не помещающихся в cookie
+MESSAGE_STORE = os.environ.get('MESSAGE_STORE', 'cookie')
+MESSAGE_STORES = {
+    'cookie': 'django.contrib.messages.storage.cookie.CookieStorage',
+    'session': 'django.contrib.messages.storage.session.SessionStorage',
+    'fallback': 'django.contrib.messages.storage.fallback.FallbackStorage',
+}
+MESSAGE_STORAGE = MESSAGE_STORES[MESSAGE_STORE]
+
+# Бюджет SQL-запросов на страницу (по имени url, отдельно для метода - 'имя:POST'). При превышении -
+# предупреждение в лог, а с QUERY_BUDGET_STRICT=1 - исключение; в manage.py test бюджеты строгие по умолчанию
+QUERY_BUDGETS = {
+    'hotels': 8,
+    'hotel': 10,
+    'rooms': 10,
+    'room_detail': 8,
+    'bookroom_detail': 8,
+    # Бронь - транзакция записи, ее стоимость не зависит от числа ночей: сессия и пользователь, блокировки
+    # номера и ночей, ключ идемпотентности, бронь, ночи (INSERT IGNORE + UPDATE), история, две сводки
+    # (по INSERT IGNORE + UPDATE) и задача письма - 14, плюс SAVEPOINT/RELEASE внутри внешней транзакции
+    'bookroom_detail:POST': 16,
+    'profile': 8,
+    'client': 6,
+    'api_hotels': 4,
+    'api_hotel': 4,
+    'api_hotel_rooms': 3,
+    'api_room': 3,
+}
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', '1' if sys.argv[1:2] == ['test'] else '0') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # JSON-строка статистики на каждый запрос - на уровне DEBUG (QUERYSTATS_LOG_LEVEL=DEBUG),
+        # превышения бюджета - WARNING
+        'main.querystats': {
+            'handlers': ['console'],
+            'level': os.environ.get('QUERYSTATS_LOG_LEVEL', 'INFO'),
+        },
+        'main.dbpool': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
@@ -0,0 +1,39 @@
+import re
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+USERNAME_MAX_LENGTH = User._meta.get_field('username').max_length
+# Запас под числовой суффикс
+BASE_MAX_LENGTH = USERNAME_MAX_LENGTH - 10
+CREATE_ATTEMPTS = 5
+
+
+def allocate_username(email):
+    # Свободное имя из части email до @: все занятые варианты base, base1, base2... - одним запросом
+    # Уникальный индекс username в MySQL не различает регистр ('Ivan' занимает 'ivan'), поэтому и
+    # выборка (LIKE без BINARY), и сравнение - без учета регистра
+    base = re.sub(r'[^\w.@+-]', '', email.split('@')[0])[:BASE_MAX_LENGTH] or 'user'
+    folded = base.casefold()
+    taken = {name.casefold() for name in
+             User.objects.filter(username__istartswith=base).values_list('username', flat=True)}
+    if folded not in taken:
+        return base
+    suffixes = {name[len(folded):] for name in taken if name.startswith(folded)}
+    counter = 1
+    while str(counter) in suffixes:
+        counter += 1
+    return f'{base}{counter}'
+
+
+def create_account(email, password, **fields):
+    # Два одновременных запроса могут выбрать одно имя: уникальный индекс username не даст вставить
+    # второе, тогда имя выбирается заново
+    for attempt in range(CREATE_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(username=allocate_username(email), email=email,
+                                                password=password, **fields)
+        except IntegrityError:
+            if attempt == CREATE_ATTEMPTS - 1:
+                raise
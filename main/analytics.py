@@ -0,0 +1,118 @@
+from collections import defaultdict
+from datetime import date
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+
+from main.availability import nights
+from main.models import BookingHistory, HotelDailyStats, RoomDailyStats
+
+
+def month_bounds(day):
+    # [первое число месяца, первое число следующего)
+    start = day.replace(day=1)
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def occupancy(nights_sold, capacity, days):
+    # Процент проданных ночей от всех номеров этого типа за период
+    if not capacity or not days:
+        return 0
+    return round(100 * nights_sold / (capacity * days))
+
+
+def apply_booking(room_id, hotel_id, datefrom, dateto, price, sign=1):
+    # Выручка делится по ночам поровну, остаток и сама бронь относятся к дню заезда
+    days = nights(datefrom, dateto)
+    if not days:
+        return
+    per_night, remainder = divmod(price, len(days))
+    # Внутри брони - в ее транзакции, без отдельной точки сохранения
+    with transaction.atomic(savepoint=False):
+        targets = (
+            (RoomDailyStats, {'room_id': room_id}, {'hotel_id': hotel_id}),
+            (HotelDailyStats, {'hotel_id': hotel_id}, {}),
+        )
+        arrival = Q(date=datefrom)
+        for model, key, extra in targets:
+            # Как и с RoomNight: создать недостающие дни, затем один UPDATE на любую длину брони
+            model.objects.bulk_create(
+                [model(date=day, **key, **extra) for day in days],
+                ignore_conflicts=True,
+            )
+            model.objects.filter(date__gte=datefrom, date__lt=dateto, **key).update(
+                nights_sold=F('nights_sold') + sign,
+                bookings=F('bookings') + Case(When(arrival, then=sign), default=0),
+                revenue=F('revenue') + sign * per_night + Case(When(arrival, then=sign * remainder), default=0),
+            )
+
+
+def rebuild_stats(batch_size=1000):
+    # Полный пересчет обеих сводок; история идет по отелям, в памяти держим дни одного отеля
+    RoomDailyStats.objects.all().delete()
+    HotelDailyStats.objects.all().delete()
+
+    history = (BookingHistory.objects
+               .filter(is_cancelled=False)
+               .order_by('hotel_id')
+               .values_list('hotel_id', 'room_id', 'datefrom', 'dateto', 'price'))
+    room_rows = hotel_rows = 0
+    for hotel_id, rows in groupby(history.iterator(chunk_size=batch_size), key=itemgetter(0)):
+        rooms, hotel = defaultdict(lambda: [0, 0, 0]), defaultdict(lambda: [0, 0, 0])
+        for _, room_id, datefrom, dateto, price in rows:
+            days = nights(datefrom, dateto)
+            if not days:
+                continue
+            per_night, remainder = divmod(price, len(days))
+            for totals in (rooms[room_id, datefrom], hotel[datefrom]):
+                totals[0] += 1
+                totals[2] += remainder
+            for day in days:
+                for totals in (rooms[room_id, day], hotel[day]):
+                    totals[1] += 1
+                    totals[2] += per_night
+        save_stats(hotel_id, rooms, hotel, batch_size)
+        room_rows += len(rooms)
+        hotel_rows += len(hotel)
+    return room_rows, hotel_rows
+
+
+def save_stats(hotel_id, rooms, hotel, batch_size):
+    RoomDailyStats.objects.bulk_create(
+        [RoomDailyStats(room_id=room_id, hotel_id=hotel_id, date=day, bookings=bookings, nights_sold=sold,
+                        revenue=revenue)
+         for (room_id, day), (bookings, sold, revenue) in rooms.items()],
+        batch_size=batch_size,
+    )
+    HotelDailyStats.objects.bulk_create(
+        [HotelDailyStats(hotel_id=hotel_id, date=day, bookings=bookings, nights_sold=sold, revenue=revenue)
+         for day, (bookings, sold, revenue) in hotel.items()],
+        batch_size=batch_size,
+    )
+
+
+def with_room_stats(rooms, datefrom, dateto):
+    # Бронирования за все время и продажи за период - подзапросами по сводке номера
+    stats = RoomDailyStats.objects.filter(room=OuterRef('pk')).order_by().values('room')
+    period = stats.filter(date__gte=datefrom, date__lt=dateto)
+    return rooms.annotate(
+        bookings_count=Coalesce(Subquery(stats.annotate(total=Sum('bookings')).values('total')), 0),
+        nights_sold=Coalesce(Subquery(period.annotate(total=Sum('nights_sold')).values('total')), 0),
+        monthly_revenue=Coalesce(Subquery(period.annotate(total=Sum('revenue')).values('total')), 0),
+    )
+
+
+def hotel_summary(hotel_ids, datefrom, dateto, today):
+    # Одним запросом по дневной сводке отелей: итоги периода и занятость на сегодня
+    in_period = Q(date__gte=datefrom, date__lt=dateto)
+    return HotelDailyStats.objects.filter(hotel_id__in=hotel_ids).aggregate(
+        bookings_total=Coalesce(Sum('bookings'), 0),
+        period_bookings=Coalesce(Sum('bookings', filter=in_period), 0),
+        period_nights=Coalesce(Sum('nights_sold', filter=in_period), 0),
+        period_revenue=Coalesce(Sum('revenue', filter=in_period), 0),
+        booked_today=Coalesce(Sum('nights_sold', filter=Q(date=today)), 0),
+    )
@@ -0,0 +1,186 @@
+import hashlib
+
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_safe
+
+from main import search_cache
+from main.loaders import hotel_photos, room_photos
+from main.models import Hotel, Hotel_Comfort, Hotel_Room
+from main.views import SearchHotel, filter_hotels, search_keyset
+
+# JSON API только для чтения: сериализаторы ручные, из БД берутся только нужные колонки
+API_VERSION = 'v1'
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+HOTEL_LIST_FIELDS = ('id', 'name', 'stars', 'city', 'to_center', 'rating', 'review_count', 'rating_score',
+                     'latitude', 'longitude')
+HOTEL_DETAIL_FIELDS = HOTEL_LIST_FIELDS + ('location', 'phone', 'email', 'about')
+ROOM_FIELDS = ('id', 'hotel_id', 'name', 'description', 'max_people', 'rooms', 'price', 'free_count')
+
+
+def hotel_queryset(request):
+    keyset = search_keyset(request.GET)
+    return (filter_hotels(Hotel.objects.only(*HOTEL_LIST_FIELDS).with_room_stats(), request.GET)
+            .order_by(*keyset.order_by()))
+
+
+def search_ids(request):
+    # Упорядоченные id из кэша выдачи (тот же, что у HTML-выдачи). Запоминаются на запросе, чтобы ETag
+    # и тело ответа строились по одному и тому же списку; None - запрос кэшем не обслуживается
+    if not hasattr(request, '_search_ids'):
+        key = search_cache.make_key(request.GET, SearchHotel.sorts)
+        request._search_ids = None if key is None else (key, search_cache.get_or_set_ids(
+            key, lambda: list(hotel_queryset(request).values_list('pk', flat=True))))
+    return request._search_ids
+
+
+def hotels_stamp(request):
+    # Ключ кэша уже содержит версию выдачи, которую двигает любое изменение отелей, номеров, фото,
+    # удобств и отзывов (см. signals); без кэша (гео-запрос, даты) ETag не отдаем
+    cached = search_ids(request)
+    if cached is None:
+        return None
+    key, ids = cached
+    return f"{key}:{hashlib.md5(','.join(map(str, ids)).encode()).hexdigest()}"
+
+
+def hotel_stamp(request, pk):
+    return Hotel.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+
+
+def room_stamp(request, pk):
+    # В ответе по номеру есть и название отеля
+    return Hotel_Room.objects.filter(pk=pk).values_list('updated_at', 'hotel__updated_at').first()
+
+
+def etag_func(stamp):
+    # Выдача по датам зависит от броней - ее не кэшируем
+    def etag(request, *args, **kwargs):
+        if request.GET.get('check_in') or request.GET.get('check_out'):
+            return None
+        value = stamp(request, **kwargs)
+        if value is None:
+            return None
+        raw = f'{API_VERSION}:{value}:{request.get_full_path()}'
+        return hashlib.md5(raw.encode()).hexdigest()
+    return etag
+
+
+def api_view(stamp):
+    def decorator(view):
+        return require_safe(condition(etag_func=etag_func(stamp))(view))
+    return decorator
+
+
+def photo_data(photo):
+    if photo is None:
+        return None
+    return {'url': photo.display_url, 'srcset': photo.srcset or None}
+
+
+def hotel_data(hotel):
+    data = {
+        'id': hotel.pk,
+        'name': hotel.name,
+        'stars': hotel.stars,
+        'city': hotel.city,
+        'to_center': hotel.to_center,
+        'latitude': hotel.latitude,
+        'longitude': hotel.longitude,
+        'rating': float(hotel.rating),
+        'review_count': hotel.review_count,
+        'min_price': hotel.min_price,
+        'max_price': hotel.max_price,
+        'photo': photo_data(hotel.primary_photo),
+    }
+    if hasattr(hotel, 'distance'):
+        data['distance_km'] = round(hotel.distance, 2)
+    return data
+
+
+def room_data(room):
+    return {
+        'id': room.pk,
+        'hotel_id': room.hotel_id,
+        'name': room.name,
+        'description': room.description,
+        'max_people': room.max_people,
+        'rooms': room.rooms,
+        'price': room.price,
+        'free_count': room.free_count,
+        'photo': photo_data(room.primary_photo),
+    }
+
+
+def page_size(request):
+    try:
+        return min(max(int(request.GET.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return PAGE_SIZE
+
+
+@api_view(hotels_stamp)
+def hotels(request):
+    keyset = search_keyset(request.GET)
+    cursor, per_page = request.GET.get('cursor'), page_size(request)
+
+    def load(ids):
+        rows = (Hotel.objects.only(*HOTEL_LIST_FIELDS).with_room_stats()
+                .prefetch_related(hotel_photos(primary_only=True)).in_bulk(ids))
+        return [rows[pk] for pk in ids if pk in rows]
+
+    cached = search_ids(request)
+    if cached is not None:
+        page = keyset.paginate_ids(cached[1], cursor, per_page, load)
+    else:
+        page = keyset.paginate(hotel_queryset(request).prefetch_related(hotel_photos(primary_only=True)),
+                               cursor, per_page)
+
+    return JsonResponse({
+        'results': [hotel_data(hotel) for hotel in page],
+        'next_cursor': page.next_cursor,
+    })
+
+
+@api_view(hotel_stamp)
+def hotel_detail(request, pk):
+    hotel = get_object_or_404(
+        Hotel.objects.only(*HOTEL_DETAIL_FIELDS).with_room_stats().prefetch_related(hotel_photos()),
+        pk=pk,
+    )
+    data = hotel_data(hotel)
+    data.update({
+        'location': hotel.location,
+        'phone': hotel.phone,
+        'email': hotel.email,
+        'about': hotel.about,
+        'photos': [photo_data(photo) for photo in hotel.files_set.all()],
+        'comforts': list(Hotel_Comfort.objects.filter(hotel=hotel).order_by('comfort__name')
+                         .values_list('comfort__name', flat=True)),
+    })
+    return JsonResponse(data)
+
+
+@api_view(hotel_stamp)
+def hotel_rooms(request, pk):
+    rooms = list(Hotel_Room.objects.filter(hotel_id=pk).only(*ROOM_FIELDS)
+                 .prefetch_related(room_photos(primary_only=True)).order_by('price', 'pk'))
+    if not rooms and not Hotel.objects.filter(pk=pk).exists():
+        raise Http404
+    return JsonResponse({'results': [room_data(room) for room in rooms]})
+
+
+@api_view(room_stamp)
+def room_detail(request, pk):
+    room = get_object_or_404(
+        Hotel_Room.objects.only(*ROOM_FIELDS, 'hotel__name').select_related('hotel').prefetch_related(room_photos()),
+        pk=pk,
+    )
+    data = room_data(room)
+    data.update({
+        'hotel_name': room.hotel.name,
+        'photos': [photo_data(photo) for photo in room.files_set.all()],
+    })
+    return JsonResponse(data)
@@ -0,0 +1,70 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db.models import F, Max
+
+from main.models import Bookings, RoomNight
+
+
+def nights(datefrom, dateto):
+    # Ночи проживания: день выезда не занимает номер
+    return [datefrom + timedelta(days=i) for i in range((dateto - datefrom).days)]
+
+
+def reserve_nights(room_id, datefrom, dateto, count=1):
+    # Два запроса на любую длину брони: создать недостающие ночи и увеличить счетчик
+    RoomNight.objects.bulk_create(
+        [RoomNight(room_id=room_id, date=night) for night in nights(datefrom, dateto)],
+        ignore_conflicts=True,
+    )
+    RoomNight.objects.filter(room_id=room_id, date__gte=datefrom, date__lt=dateto).update(
+        booked=F('booked') + count
+    )
+
+
+def release_nights(room_id, datefrom, dateto, count=1):
+    RoomNight.objects.filter(room_id=room_id, date__gte=datefrom, date__lt=dateto).update(
+        booked=F('booked') - count
+    )
+
+
+def peak_booked(room_ids, datefrom, dateto):
+    # Одним запросом по диапазону: {room_id: максимум занятых номеров за ночи периода}
+    rows = (RoomNight.objects
+            .filter(room_id__in=room_ids, date__gte=datefrom, date__lt=dateto)
+            .values('room_id')
+            .annotate(peak=Max('booked')))
+    peaks = {room_id: 0 for room_id in room_ids}
+    peaks.update({row['room_id']: row['peak'] for row in rows})
+    return peaks
+
+
+def locked_peak_booked(room_id, datefrom, dateto):
+    # Для проверки внутри транзакции брони: строки ночей блокируются, агрегат считается в Python
+    # (FOR UPDATE несовместим с GROUP BY)
+    booked = (RoomNight.objects.select_for_update()
+              .filter(room_id=room_id, date__gte=datefrom, date__lt=dateto)
+              .values_list('booked', flat=True))
+    return max(booked, default=0)
+
+
+def free_rooms(rooms, datefrom, dateto):
+    # {room_id: сколько номеров свободно на весь период}
+    peaks = peak_booked([room.pk for room in rooms], datefrom, dateto)
+    return {room.pk: max(room.free_count - peaks[room.pk], 0) for room in rooms}
+
+
+def rebuild_room_nights(batch_size=1000):
+    # Полный пересчет таблицы занятости по действующим (не отмененным) бронированиям
+    counter = Counter()
+    bookings = Bookings.objects.filter(cancelled_at__isnull=True).values_list('room_id', 'datefrom', 'dateto')
+    for room_id, datefrom, dateto in bookings.iterator():
+        for night in nights(datefrom, dateto):
+            counter[room_id, night] += 1
+
+    RoomNight.objects.all().delete()
+    RoomNight.objects.bulk_create(
+        [RoomNight(room_id=room_id, date=night, booked=booked) for (room_id, night), booked in counter.items()],
+        batch_size=batch_size,
+    )
+    return len(counter)
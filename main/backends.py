@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+# Сколько пользователей с одним email проверять: email не уникален на уровне БД
+MAX_EMAIL_MATCHES = 5
+
+
+class EmailBackend(ModelBackend):
+    # Вход по email и паролю одним запросом по индексу auth_user_email_idx, без второго поиска по username
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if not email or password is None:
+            return None
+        UserModel = get_user_model()
+        users = list(UserModel._default_manager.filter(email=email.strip()).order_by('pk')[:MAX_EMAIL_MATCHES])
+        if not users:
+            # Хэшируем впустую, чтобы по времени ответа нельзя было узнать, есть ли такой email
+            UserModel().set_password(password)
+            return None
+        for user in users:
+            if user.check_password(password) and self.user_can_authenticate(user):
+                return user
+        return None
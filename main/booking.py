@@ -0,0 +1,104 @@
+import random
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.utils import timezone
+
+from main.availability import locked_peak_booked, nights
+from main.jobs import enqueue
+from main.models import BookingHistory, Bookings, Hotel_Room
+
+# Сколько раз повторять транзакцию при конфликте блокировок (deadlock в MySQL, locked в SQLite)
+LOCK_RETRIES = 30
+LOCK_BACKOFF = 0.005
+
+
+class BookingError(Exception):
+    pass
+
+
+def book_room(user, room_id, datefrom, dateto, people, name, surname, idoc_series, idoc_number,
+              idempotency_key=None):
+    if datefrom >= dateto:
+        raise BookingError('Дата выезда должна быть позже даты заезда')
+
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return _book_room(user, room_id, datefrom, dateto, people, name, surname, idoc_series, idoc_number,
+                              idempotency_key)
+        except IntegrityError:
+            # Параллельный запрос с тем же ключом успел создать бронь раньше
+            if idempotency_key:
+                booking = Bookings.objects.filter(idempotency_key=idempotency_key).first()
+                if booking:
+                    return booking
+            raise
+        except OperationalError:
+            time.sleep(LOCK_BACKOFF * (2 ** min(attempt, 6)) * random.random())
+
+    raise BookingError('Сервис бронирования перегружен, попробуйте еще раз')
+
+
+def _book_room(user, room_id, datefrom, dateto, people, name, surname, idoc_series, idoc_number,
+               idempotency_key):
+    with transaction.atomic():
+        # Блокировка строки номера - первый запрос транзакции: параллельные брони этого номера идут по очереди,
+        # а снимок REPEATABLE READ (InnoDB) открывается только после нее и видит брони предыдущего владельца
+        room = Hotel_Room.objects.select_for_update().get(pk=room_id)
+        if idempotency_key:
+            booking = Bookings.objects.filter(idempotency_key=idempotency_key).first()
+            if booking:
+                return booking
+
+        if people > room.max_people:
+            raise BookingError(f'Номер рассчитан максимум на {room.max_people} гостей')
+        # Занятость читается с блокировкой (SELECT ... FOR UPDATE) - последние закоммиченные значения, не снимок
+        if room.free_count - locked_peak_booked(room.pk, datefrom, dateto) <= 0:
+            raise BookingError('На выбранные даты свободных номеров нет')
+
+        # Занятость по ночам (RoomNight) обновляется сигналом на создание брони
+        booking = Bookings.objects.create(
+            user=user,
+            name=name,
+            surname=surname,
+            idoc_series=idoc_series,
+            idoc_number=idoc_number,
+            people=people,
+            hotel_id=room.hotel_id,
+            room=room,
+            datefrom=datefrom,
+            dateto=dateto,
+            idempotency_key=idempotency_key,
+        )
+        BookingHistory.objects.create(
+            booking=booking,
+            user=user,
+            hotel_id=room.hotel_id,
+            room=room,
+            datefrom=datefrom,
+            dateto=dateto,
+            price=room.price * len(nights(datefrom, dateto)),
+            people=people,
+        )
+        # Письмо уходит из воркера и только для новой брони, не для повтора по ключу
+        enqueue('booking_email', booking_id=booking.pk)
+        return booking
+
+
+def cancel_booking(booking_id, user=None):
+    # Единственный путь отмены: ночи освобождаются сигналом на сохранение брони, строки истории
+    # помечаются отмененными и выходят из сводок. Повторная отмена ничего не меняет
+    with transaction.atomic():
+        bookings = Bookings.objects.select_for_update()
+        if user is not None:
+            bookings = bookings.filter(user=user)
+        booking = bookings.get(pk=booking_id)
+        if booking.cancelled_at:
+            return False
+        booking.cancelled_at = timezone.now()
+        booking.save(update_fields=['cancelled_at'])
+        for history in BookingHistory.objects.filter(booking=booking, is_cancelled=False):
+            history.is_cancelled = True
+            history.is_active = False
+            history.save(update_fields=['is_cancelled', 'is_active'])
+    return True
@@ -0,0 +1,12 @@
+from django.db.backends.mysql.base import DatabaseWrapper as MySQLDatabaseWrapper
+
+from main.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, MySQLDatabaseWrapper):
+    # ENGINE 'main.db.mysql': бэкенд MySQL с пулом соединений (DATABASES['default']['POOL'])
+
+    @staticmethod
+    def check_pooled_connection(conn):
+        # Как MySQL DatabaseWrapper.is_usable: ping без запроса
+        conn.ping()
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+logger = logging.getLogger('main.dbpool')
+
+# Пулы процесса: ключ - алиас БД и параметры подключения (у тестовой БД другое имя - другой пул)
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+DEFAULTS = {
+    'SIZE': 10,
+    # Сколько секунд поток ждет свободное соединение, прежде чем получить ошибку
+    'TIMEOUT': 5.0,
+    # Соединение старше RECYCLE секунд закрывается вместо повторной выдачи (MySQL wait_timeout, балансировщики)
+    'RECYCLE': 1800,
+    # Простоявшее дольше CHECK_AFTER секунд соединение проверяется перед выдачей; 0 - проверять всегда
+    'CHECK_AFTER': 30,
+}
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    # Ограниченный пул DB-API соединений для многопоточного сервера: каждый поток берет соединение
+    # на время запроса и возвращает его вместо закрытия. Новые соединения создает вызывающий (connect)
+    def __init__(self, size=DEFAULTS['SIZE'], timeout=DEFAULTS['TIMEOUT'], recycle=DEFAULTS['RECYCLE'],
+                 check_after=DEFAULTS['CHECK_AFTER'], check=None, reset=None):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.check_after = check_after
+        self.check = check
+        self.reset = reset
+        self._idle = deque()
+        self._born = {}
+        self._lock = threading.Condition()
+        self.in_use = 0
+        self.created = 0
+        self.closed = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, connect):
+        started = time.monotonic()
+        waited = False
+        while True:
+            conn = idle_since = None
+            with self._lock:
+                while conn is None:
+                    if self._idle:
+                        # Последнее возвращенное соединение - самое "теплое"
+                        conn, idle_since = self._idle.pop()
+                    elif self.in_use + len(self._idle) < self.size:
+                        break
+                    else:
+                        remaining = started + self.timeout - time.monotonic()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            logger.warning('Нет свободных соединений за %.1f с: %s', self.timeout, self.stats())
+                            raise PoolTimeout(f'Пул соединений исчерпан: {self.size} занято')
+                        waited = True
+                        self._lock.wait(remaining)
+                self.in_use += 1
+            if conn is None:
+                conn = self._create(connect)
+            elif not self._usable(conn, idle_since):
+                self.discard(conn)
+                continue
+            if waited:
+                self._record_wait(time.monotonic() - started)
+            return conn
+
+    def release(self, conn):
+        # Незавершенная транзакция откатывается; соединение, которое не удалось сбросить, закрывается
+        try:
+            if self.reset is not None:
+                self.reset(conn)
+        except Exception:
+            self.discard(conn)
+            return
+        with self._lock:
+            self.in_use -= 1
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def discard(self, conn):
+        with self._lock:
+            self.in_use -= 1
+            self.closed += 1
+            self._born.pop(id(conn), None)
+            self._lock.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self.closed += len(idle)
+            for conn, _ in idle:
+                self._born.pop(id(conn), None)
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'in_use': self.in_use,
+            'idle': len(self._idle),
+            'created': self.created,
+            'closed': self.closed,
+            'waits': self.waits,
+            'timeouts': self.timeouts,
+            'wait_ms': round(self.wait_time * 1000, 2),
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+        }
+
+    def _create(self, connect):
+        try:
+            conn = connect()
+        except Exception:
+            with self._lock:
+                self.in_use -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self.created += 1
+            self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _usable(self, conn, idle_since):
+        now = time.monotonic()
+        if self.recycle and now - self._born.get(id(conn), now) > self.recycle:
+            return False
+        if self.check is None or now - idle_since < self.check_after:
+            return True
+        try:
+            self.check(conn)
+        except Exception:
+            return False
+        return True
+
+    def _record_wait(self, wait):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+
+
+def get_pool(key, options, check=None, reset=None):
+    with POOLS_LOCK:
+        pool = POOLS.get(key)
+        if pool is None:
+            options = {**DEFAULTS, **options}
+            pool = POOLS[key] = ConnectionPool(size=options['SIZE'], timeout=options['TIMEOUT'],
+                                               recycle=options['RECYCLE'], check_after=options['CHECK_AFTER'],
+                                               check=check, reset=reset)
+        return pool
+
+
+def stats():
+    with POOLS_LOCK:
+        return {f'{alias}:{name}': pool.stats() for (alias, name, *_), pool in POOLS.items()}
+
+
+class PooledDatabaseWrapperMixin:
+    # Подмешивается к DatabaseWrapper бэкенда: get_new_connection берет соединение из пула, _close возвращает.
+    # Пул работает при CONN_MAX_AGE = 0: Django "закрывает" соединение в конце каждого запроса
+    pool_wait = 0.0
+    connection_pool = None
+
+    @property
+    def pool(self):
+        settings_dict = self.settings_dict
+        key = (self.alias, settings_dict['NAME'], settings_dict['HOST'], settings_dict['PORT'], settings_dict['USER'])
+        return get_pool(key, settings_dict.get('POOL', {}), self.check_pooled_connection, self.reset_pooled_connection)
+
+    @staticmethod
+    def check_pooled_connection(conn):
+        conn.cursor().execute('SELECT 1')
+
+    @staticmethod
+    def reset_pooled_connection(conn):
+        conn.rollback()
+
+    def get_new_connection(self, conn_params):
+        connect = super().get_new_connection
+        started = time.monotonic()
+        # Пул запоминается: к закрытию соединения NAME может смениться (создание тестовой БД)
+        self.connection_pool = self.pool
+        conn = self.connection_pool.acquire(lambda: connect(conn_params))
+        # Ожидание (и создание) соединения этим запросом - для лога main.querystats
+        self.pool_wait += time.monotonic() - started
+        return conn
+
+    def _close(self):
+        if self.connection_pool is None:
+            # Соединение открыто в обход пула
+            return super()._close()
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # Обертка продолжит ссылаться на соединение до отката: отдавать его другому потоку нельзя
+                self.connection_pool.discard(self.connection)
+            else:
+                self.connection_pool.release(self.connection)
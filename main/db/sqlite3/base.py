@@ -0,0 +1,14 @@
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+
+from main.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+    # ENGINE 'main.db.sqlite3': пул для локального запуска и тестов без MySQL
+
+    def get_new_connection(self, conn_params):
+        # БД в памяти Django никогда не закрывает: соединения не вернулись бы в пул
+        if self.is_in_memory_db():
+            self.connection_pool = None
+            return SQLiteDatabaseWrapper.get_new_connection(self, conn_params)
+        return super().get_new_connection(conn_params)
@@ -0,0 +1,97 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from main import search_cache
+from main.models import ComfortBitmap, Hotel_Comfort
+
+# Фасеты по удобствам: для каждого удобства хранится битовая карта id отелей (ComfortBitmap).
+# Число отелей с удобством среди текущей выдачи - AND двух карт и подсчет единичных бит, без GROUP BY
+VERSION_KEY = 'facets:version'
+
+
+def to_bitmap(ids):
+    ids = list(ids)
+    if not ids:
+        return b''
+    bits = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        bits[pk >> 3] |= 1 << (pk & 7)
+    return bytes(bits)
+
+
+def to_int(bitmap):
+    return int.from_bytes(bitmap, 'little')
+
+
+def version():
+    return search_cache.cache().get_or_set(VERSION_KEY, 1, None)
+
+
+def bump_version():
+    return search_cache.incr(VERSION_KEY)
+
+
+def set_hotel(comfort_id, hotel_id, present):
+    # Инкрементальное обновление одного бита; строка карты блокируется на время чтения-записи
+    with transaction.atomic():
+        if present:
+            row, _ = ComfortBitmap.objects.select_for_update().get_or_create(comfort_id=comfort_id)
+        else:
+            row = ComfortBitmap.objects.select_for_update().filter(comfort_id=comfort_id).first()
+            if row is None:
+                return
+        bits = bytearray(row.bitmap)
+        byte, mask = hotel_id >> 3, 1 << (hotel_id & 7)
+        if present:
+            bits.extend(bytes(max(byte + 1 - len(bits), 0)))
+            bits[byte] |= mask
+        elif byte < len(bits):
+            bits[byte] &= ~mask
+        row.bitmap = bytes(bits).rstrip(b'\0')
+        row.hotels = to_int(row.bitmap).bit_count()
+        row.save()
+    bump_version()
+
+
+def rebuild_bitmaps(batch_size=10000):
+    hotels = defaultdict(set)
+    links = Hotel_Comfort.objects.order_by().values_list('comfort_id', 'hotel_id')
+    for comfort_id, hotel_id in links.iterator(chunk_size=batch_size):
+        hotels[comfort_id].add(hotel_id)
+    with transaction.atomic():
+        ComfortBitmap.objects.all().delete()
+        ComfortBitmap.objects.bulk_create([
+            ComfortBitmap(comfort_id=comfort_id, bitmap=to_bitmap(ids), hotels=len(ids))
+            for comfort_id, ids in hotels.items()
+        ])
+    bump_version()
+    return len(hotels)
+
+
+def bitmaps():
+    # Все карты с названиями удобств - одним запросом, дальше из кэша до следующего изменения удобств.
+    # С локальным кэшем процесса (locmem) другие воркеры не видят bump_version: срок жизни,
+    # как у id выдачи, ограничивает устаревание
+    def load():
+        rows = ComfortBitmap.objects.select_related('comfort').order_by('comfort__name', 'comfort_id')
+        return [(row.comfort_id, row.comfort.name, to_int(row.bitmap)) for row in rows]
+    return search_cache.cache().get_or_set(f'facets:bitmaps:{version()}', load, search_cache.TIMEOUT)
+
+
+def counts(hotel_ids):
+    # [(id удобства, название, сколько отелей выдачи с ним)]
+    found = to_int(to_bitmap(hotel_ids))
+    return [(comfort_id, name, (bitmap & found).bit_count()) for comfort_id, name, bitmap in bitmaps()]
+
+
+def selected(params):
+    # ?comfort=1&comfort=5 - отели, где есть все выбранные удобства
+    return sorted({int(value) for value in params.getlist('comfort') if value.isdigit()})
+
+
+def filter_comforts(queryset, comfort_ids):
+    for comfort_id in comfort_ids:
+        queryset = queryset.filter(pk__in=Hotel_Comfort.objects.filter(comfort_id=comfort_id).values('hotel_id'))
+    return queryset
+
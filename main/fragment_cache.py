@@ -0,0 +1,62 @@
+import hashlib
+
+from django.core.cache import caches
+
+# Кэш HTML-фрагментов карточек: ключ - тип, id объекта и его updated_at, так что
+# изменение строки само делает старый фрагмент недостижимым (см. FRAGMENT_CACHE в settings)
+CACHE_ALIAS = 'fragments'
+TIMEOUT = 60 * 60 * 24
+TYPES = ('hotel_card', 'hotel_gallery', 'hotel_room_card', 'owner_room_card', 'room_gallery')
+
+
+def cache():
+    return caches[CACHE_ALIAS]
+
+
+def incr(key):
+    fragments = cache()
+    fragments.add(key, 0, None)
+    try:
+        return fragments.incr(key)
+    except ValueError:
+        fragments.set(key, 1, None)
+        return 1
+
+
+def make_key(fragment_type, obj, vary_on=()):
+    # vary_on - значения, которых нет в строке объекта (например, счетчики из сводок)
+    stamp = obj.updated_at.timestamp()
+    extra = hashlib.md5(repr(list(vary_on)).encode()).hexdigest() if vary_on else ''
+    return f'fragment:{fragment_type}:{obj.pk}:{stamp}:{extra}'
+
+
+def get_or_render(fragment_type, key, render):
+    html = cache().get(key)
+    if html is not None:
+        incr(f'fragment:hits:{fragment_type}')
+        return html
+    incr(f'fragment:misses:{fragment_type}')
+    html = render()
+    cache().set(key, html, TIMEOUT)
+    return html
+
+
+def stats():
+    counters = cache().get_many([f'fragment:{kind}:{fragment_type}'
+                                 for fragment_type in TYPES for kind in ('hits', 'misses')])
+    result = {}
+    for fragment_type in TYPES:
+        hits = counters.get(f'fragment:hits:{fragment_type}', 0)
+        misses = counters.get(f'fragment:misses:{fragment_type}', 0)
+        total = hits + misses
+        result[fragment_type] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+        }
+    return result
+
+
+def reset_stats():
+    cache().set_many({f'fragment:{kind}:{fragment_type}': 0
+                      for fragment_type in TYPES for kind in ('hits', 'misses')}, None)
@@ -0,0 +1,171 @@
+import math
+import re
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from main import search_cache
+from main.models import Hotel, Hotel_Comfort, Hotel_Room, SearchPosting, normalize_search
+
+# Полнотекстовый поиск по своему инвертированному индексу (таблица SearchPosting): основа слова -> отель и вес.
+# Документ - отель целиком: название, город, описание, удобства, названия и описания номеров
+WORD_RE = re.compile(r'[0-9a-zа-я]+')
+MAX_TERM_LENGTH = 64
+MIN_STEM_LENGTH = 3
+
+# Вес слова в документе - сумма весов полей, где оно встретилось
+FIELD_WEIGHTS = {
+    'name': 8,
+    'city': 4,
+    'comfort': 3,
+    'room_name': 2,
+    'about': 1,
+    'room_description': 1,
+}
+
+# Насыщение веса (как k1 в BM25): десятое упоминание слова в описании почти ничего не добавляет
+SATURATION = 4.0
+
+STOP_WORDS = frozenset((
+    'и в во не на с со к ко о об от по за из у для до без а но или же что как это при под над '
+    'the a an and or of in on at to for with by is are from'
+).split())
+
+# Окончания проверяются от длинных к коротким; основа не короче MIN_STEM_LENGTH
+RU_ENDINGS = sorted((
+    'иями ями ами ого его ому ему ыми ими ией иях ях ах ов ев ей ой ий ый ая яя ое ее ые ие ую юю ом ем '
+    'ам ям ия ья ье ью а я о е ы и у ю ь й'
+).split(), key=len, reverse=True)
+EN_ENDINGS = ('ing', 'ies', 'es', 'ed', 's')
+
+
+def stem(word):
+    endings = RU_ENDINGS if word[0] >= 'а' else EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    # Нижний регистр и ё -> е как у поиска по префиксу, затем основы слов без стоп-слов
+    return [stem(word)[:MAX_TERM_LENGTH] for word in WORD_RE.findall(normalize_search(text))
+            if word not in STOP_WORDS]
+
+
+def document_terms(fields):
+    # fields: пары (текст, имя поля) -> {основа: вес}
+    weights = Counter()
+    for text, field in fields:
+        for term in tokenize(text):
+            weights[term] += FIELD_WEIGHTS[field]
+    return weights
+
+
+def hotel_fields(hotel):
+    yield hotel.name, 'name'
+    yield hotel.city, 'city'
+    yield hotel.about, 'about'
+    for hotel_comfort in hotel.hotel_comfort_set.all():
+        yield hotel_comfort.comfort.name, 'comfort'
+    for room in hotel.hotel_room_set.all():
+        yield room.name, 'room_name'
+        yield room.description, 'room_description'
+
+
+def index_hotels(hotel_ids):
+    # Переиндексация отелей по разнице со старыми строками: неизменившийся текст не дает записей в БД
+    hotel_ids = list(hotel_ids)
+    hotels = (Hotel.objects
+              .filter(pk__in=hotel_ids)
+              .only('id', 'name', 'city', 'about')
+              .prefetch_related(
+                  Prefetch('hotel_room_set',
+                           queryset=Hotel_Room.objects.only('id', 'hotel_id', 'name', 'description')),
+                  Prefetch('hotel_comfort_set', queryset=Hotel_Comfort.objects.select_related('comfort')),
+              ))
+    wanted = {(hotel.pk, term): weight
+              for hotel in hotels for term, weight in document_terms(hotel_fields(hotel)).items()}
+    existing = {(hotel_id, term): weight for hotel_id, term, weight in
+                SearchPosting.objects.filter(hotel_id__in=hotel_ids).values_list('hotel_id', 'term', 'weight')}
+
+    stale = [key for key, weight in existing.items() if wanted.get(key) != weight]
+    fresh = [key for key, weight in wanted.items() if existing.get(key) != weight]
+    with transaction.atomic():
+        if stale:
+            stale_terms = Q()
+            for hotel_id in {hotel_id for hotel_id, _ in stale}:
+                stale_terms |= Q(hotel_id=hotel_id, term__in=[term for key_id, term in stale if key_id == hotel_id])
+            SearchPosting.objects.filter(stale_terms).delete()
+        SearchPosting.objects.bulk_create(
+            [SearchPosting(hotel_id=hotel_id, term=term, weight=wanted[hotel_id, term]) for hotel_id, term in fresh],
+            batch_size=1000,
+        )
+    return len(stale), len(fresh)
+
+
+def rebuild_index(batch_size=500):
+    removed = added = 0
+    ids = Hotel.objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for hotel_id in ids.iterator(chunk_size=batch_size):
+        batch.append(hotel_id)
+        if len(batch) == batch_size:
+            stale, fresh = index_hotels(batch)
+            removed, added, batch = removed + stale, added + fresh, []
+    if batch:
+        stale, fresh = index_hotels(batch)
+        removed, added = removed + stale, added + fresh
+    return removed, added
+
+
+def parse_query(text):
+    # Последнее слово ищется по началу основы - запрос вводится по мере набора ("гранд от")
+    terms = tokenize(text)
+    return [(term, index == len(terms) - 1) for index, term in enumerate(terms)]
+
+
+def term_condition(term, prefix):
+    if not prefix:
+        return Q(term=term)
+    # LIKE 'основа%' идет по индексу (term, hotel), как в HotelQuerySet.prefix_search
+    return Q(term__startswith=term)
+
+
+def search(queryset, text):
+    # Отели, где есть все слова запроса, с оценкой relevance (больше - лучше). Остальные фильтры выдачи
+    # (звезды, город, цена, даты) ложатся на тот же queryset: ранжирование и фильтры - один SQL-запрос
+    terms = parse_query(text)
+    if not terms:
+        return queryset
+    conditions = [term_condition(term, prefix) for term, prefix in terms]
+    postings = SearchPosting.objects.order_by()
+
+    # Редкие слова весят больше (idf); число отелей со словом - одним запросом по индексу
+    frequencies = postings.filter(reduce(or_, conditions)).aggregate(
+        **{f'df{i}': Count('hotel', distinct=True, filter=condition) for i, condition in enumerate(conditions)})
+    if not all(frequencies.values()):
+        # Какого-то слова нет ни в одном отеле; relevance нужна для сортировки выдачи
+        return queryset.annotate(relevance=Value(0.0, output_field=FloatField())).none()
+    # Число отелей для idf не обязано быть точным: берется из кэша выдачи, сбрасывается вместе с ним
+    total = search_cache.cache().get_or_set(f'search:hotels:{search_cache.version()}', Hotel.objects.count,
+                                            search_cache.TIMEOUT)
+    idf = [math.log(1 + (total - df + 0.5) / (df + 0.5)) for df in frequencies.values()]
+
+    # Все слова запроса обязательны: по полусоединению с индексом на каждое
+    for condition in conditions:
+        queryset = queryset.filter(pk__in=postings.filter(condition).values('hotel_id'))
+
+    weight = Cast(F('weight'), FloatField())
+    score = Case(*[When(condition, then=Value(value)) for condition, value in zip(conditions, idf)],
+                 default=Value(0.0), output_field=FloatField())
+    scores = (postings
+              .filter(reduce(or_, conditions), hotel=OuterRef('pk'))
+              .values('hotel')
+              .annotate(score=Sum(score * weight * (SATURATION + 1) / (weight + SATURATION)))
+              .values('score'))
+    return queryset.annotate(relevance=Coalesce(Subquery(scores), Value(0.0), output_field=FloatField()))
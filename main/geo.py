@@ -0,0 +1,72 @@
+import math
+
+# Геохеш: строка, у которой общий префикс означает общую ячейку сетки. Обычный индекс по строке
+# позволяет выбрать ячейку условием LIKE 'префикс%' - и в MySQL, и в SQLite
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9
+KM_PER_DEGREE = 111.32
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Биты долготы и широты чередуются, начиная с долготы
+        target, current = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (target[0] + target[1]) / 2
+        value <<= 1
+        if current >= middle:
+            value |= 1
+            target[0] = middle
+        else:
+            target[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    # Размер ячейки в градусах: (высота по широте, ширина по долготе)
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def precision_for(radius_km, latitude):
+    # Самая мелкая сетка, в которой ячейка не меньше радиуса: тогда круг целиком лежит
+    # в ячейке центра и восьми соседних
+    lon_scale = max(math.cos(math.radians(latitude)), 0.01)
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if min(height * KM_PER_DEGREE, width * KM_PER_DEGREE * lon_scale) >= radius_km:
+            return precision
+    return 1
+
+
+def cells_around(latitude, longitude, radius_km):
+    precision = precision_for(radius_km, latitude)
+    height, width = cell_size(precision)
+    cells = set()
+    for dlat in (-height, 0, height):
+        for dlon in (-width, 0, width):
+            lat = min(max(latitude + dlat, -90.0), 90.0)
+            lon = (longitude + dlon + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return latitude - dlat, latitude + dlat, longitude - dlon, longitude + dlon
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # Гаверсинус - для проверки и вывода; в SQL используется плоское приближение (см. HotelQuerySet.near)
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ProfilePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # Тот же алгоритм pbkdf2_sha256, число итераций - из профиля (PASSWORD_HASHER_PROFILE в settings).
+    # Итерации записаны в самом хэше, поэтому старые пароли проверяются как раньше и пересчитываются
+    # под текущий профиль при следующем входе (must_update)
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
@@ -0,0 +1,93 @@
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import Job
+
+# Зарегистрированные обработчики: имя задачи -> функция(**payload)
+HANDLERS = {}
+
+BACKOFF_SECONDS = 10
+STALE_AFTER = timedelta(minutes=15)
+
+
+def job(name):
+    def register(func):
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, max_attempts=5, delay=0, **payload):
+    # Задача пишется в ту же транзакцию, что и данные: если запрос откатится, задачи тоже не будет
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def enqueue_many(name, payloads, max_attempts=5):
+    now = timezone.now()
+    return Job.objects.bulk_create([
+        Job(name=name, payload=payload, max_attempts=max_attempts, run_at=now) for payload in payloads
+    ])
+
+
+def backoff(attempts):
+    return timedelta(seconds=BACKOFF_SECONDS * 2 ** (attempts - 1))
+
+
+def requeue_stale():
+    # Задачи упавшего воркера возвращаются в очередь
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - STALE_AFTER).update(
+        status=Job.PENDING, locked_at=None
+    )
+
+
+def claim_next():
+    # Захват условным UPDATE: работает и в MySQL, и в SQLite, два воркера не возьмут одну задачу
+    now = timezone.now()
+    candidates = (Job.objects.filter(status=Job.PENDING, run_at__lte=now)
+                  .order_by('run_at', 'pk')
+                  .values_list('pk', flat=True)[:10])
+    for pk in candidates:
+        if Job.objects.filter(pk=pk, status=Job.PENDING).update(status=Job.RUNNING, locked_at=now):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job_obj):
+    job_obj.attempts += 1
+    try:
+        handler = HANDLERS[job_obj.name]
+        with transaction.atomic():
+            handler(**job_obj.payload)
+    except Exception:
+        job_obj.last_error = traceback.format_exc()
+        if job_obj.attempts < job_obj.max_attempts:
+            job_obj.status = Job.PENDING
+            job_obj.run_at = timezone.now() + backoff(job_obj.attempts)
+        else:
+            job_obj.status = Job.FAILED
+    else:
+        job_obj.status = Job.DONE
+        job_obj.last_error = ''
+    job_obj.locked_at = None
+    job_obj.save(update_fields=['status', 'attempts', 'run_at', 'locked_at', 'last_error'])
+    return job_obj
+
+
+def run_pending(limit=None):
+    # Выполняет готовые задачи по очереди, возвращает их количество
+    count = 0
+    while limit is None or count < limit:
+        job_obj = claim_next()
+        if job_obj is None:
+            break
+        run_job(job_obj)
+        count += 1
+    return count
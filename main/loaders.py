@@ -0,0 +1,53 @@
+from django.db.models import Min, Prefetch, prefetch_related_objects
+
+from main.models import Files, Hotel, Hotel_Comfort, Hotel_Room
+
+# Общие загрузчики страниц отеля: все запросы ограничены одним отелем (или отелями владельца),
+# поэтому их стоимость зависит от размера отеля, а не всей БД
+PHOTO_FIELDS = ('id', 'hotel_id', 'room_id', 'file', 'derivatives', 'is_primary')
+
+
+def photos(queryset):
+    return Prefetch('files_set', queryset=queryset.only(*PHOTO_FIELDS).order_by('pk'))
+
+
+def hotel_photos(primary_only=False):
+    # У фото номера тоже заполнен hotel, фото самого отеля - без номера
+    queryset = Files.objects.filter(room__isnull=True)
+    return photos(queryset.filter(is_primary=True) if primary_only else queryset)
+
+
+def room_photos(primary_only=False):
+    queryset = Files.objects.all()
+    return photos(queryset.filter(is_primary=True) if primary_only else queryset)
+
+
+def load_rooms_and_comforts(hotels):
+    # Номера (по цене) с фото и удобства отелей - по запросу на каждую связь для всех отелей сразу
+    rooms = Hotel_Room.objects.order_by('price', 'pk').prefetch_related(room_photos())
+    prefetch_related_objects(
+        hotels,
+        Prefetch('hotel_room_set', queryset=rooms),
+        Prefetch('hotel_comfort_set', queryset=Hotel_Comfort.objects.select_related('comfort')
+                 .order_by('comfort__name', 'pk')),
+    )
+    return hotels
+
+
+def similar_hotels(hotel):
+    # Готовый список соседей (main/similar.py) одним запросом с ценой "от" и основным фото
+    return list(Hotel.objects
+                .filter(neighbor_of__hotel=hotel)
+                .annotate(min_price=Min('hotel_room__price'), neighbor_rank=Min('neighbor_of__rank'))
+                .prefetch_related(hotel_photos(primary_only=True))
+                .order_by('neighbor_rank', 'pk'))
+
+
+def owner_hotels(user_id):
+    # Отели владельца для кабинета: статус через JOIN, число номеров - агрегатом, только основное фото
+    return (Hotel.objects
+            .filter(user_id=user_id)
+            .with_room_stats()
+            .select_related('status')
+            .prefetch_related(hotel_photos(primary_only=True))
+            .order_by('pk'))
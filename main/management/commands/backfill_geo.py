@@ -0,0 +1,52 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import geo, search_cache
+from main.models import Hotel
+
+
+class Command(BaseCommand):
+    help = 'Заполняет координаты отелей из CSV (id,latitude,longitude) и пересчитывает геохеши'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', help='Файл с колонками id,latitude,longitude')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def read_csv(self, path):
+        coordinates = {}
+        with open(path, newline='', encoding='utf-8') as source:
+            for line, row in enumerate(csv.DictReader(source), start=2):
+                try:
+                    latitude, longitude = float(row['latitude']), float(row['longitude'])
+                    coordinates[int(row['id'])] = (latitude, longitude)
+                except (KeyError, TypeError, ValueError):
+                    raise CommandError(f'{path}:{line}: ожидаются колонки id,latitude,longitude')
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    raise CommandError(f'{path}:{line}: координаты вне допустимого диапазона')
+        return coordinates
+
+    def handle(self, *args, **options):
+        coordinates = self.read_csv(options['csv']) if options['csv'] else None
+        hotels = Hotel.objects.only('pk', 'latitude', 'longitude', 'geohash').order_by('pk')
+        if coordinates is not None:
+            hotels = hotels.filter(pk__in=coordinates)
+        else:
+            # Без файла - только пересчет геохешей по уже сохраненным координатам
+            hotels = hotels.filter(latitude__isnull=False, longitude__isnull=False)
+
+        # bulk_update пачками: save() на каждый отель слал бы сигналы и сбрасывал кэши тысячи раз
+        batch, updated = [], 0
+        for hotel in hotels.iterator(chunk_size=options['batch_size']):
+            if coordinates is not None:
+                hotel.latitude, hotel.longitude = coordinates[hotel.pk]
+            hotel.geohash = geo.encode(hotel.latitude, hotel.longitude)
+            batch.append(hotel)
+            if len(batch) >= options['batch_size']:
+                updated += Hotel.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+                batch = []
+        if batch:
+            updated += Hotel.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+
+        search_cache.bump_version()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено отелей: {updated}'))
@@ -0,0 +1,129 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from main.models import BookingHistory, Files, Hotel, Hotel_Comfort, Hotel_Room
+
+
+def percentile(values, percent):
+    # Метод ближайшего ранга: на малых выборках не придумывает значений между замерами
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Гоняет горячие страницы через тестовый клиент и пишет p50/p95/p99, число запросов и память в JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--output', default='bench_output.json')
+        parser.add_argument('--only', nargs='*', help='Имена сценариев, например search hotel_detail')
+
+    def scenarios(self):
+        hotel = Hotel.objects.filter(hotel_room__isnull=False).order_by('pk').first()
+        if hotel is None:
+            raise CommandError('В БД нет отелей с номерами: сначала выполните manage.py seed_catalog')
+        room = Hotel_Room.objects.filter(hotel=hotel).order_by('pk').first()
+        traveller_id = (BookingHistory.objects.order_by('pk').values_list('user_id', flat=True).first()
+                        or hotel.user_id)
+        traveller = User.objects.get(pk=traveller_id)
+        city = hotel.city
+        comforts = list(Hotel_Comfort.objects.filter(hotel=hotel).values_list('comfort_id', flat=True)[:2])
+
+        return {
+            'search': (None, reverse('hotels'), {}),
+            'search_city_stars': (None, reverse('hotels'), {'city': city, 'stars': hotel.stars}),
+            'search_text': (None, reverse('hotels'), {'name': f'{hotel.city} {hotel.name.split()[0]}'}),
+            'search_comforts': (None, reverse('hotels'), {'comfort': comforts}),
+            'search_price_sort': (None, reverse('hotels'), {'sort': 'price_asc', 'max_price': 10000}),
+            'search_nearby': (None, reverse('hotels'), {'lat': hotel.latitude or 55.7558,
+                                                        'lon': hotel.longitude or 37.6173,
+                                                        'radius': 3, 'sort': 'distance'}),
+            'hotel_detail': (None, reverse('hotel', args=[hotel.pk]), {}),
+            'hotel_rooms': (hotel.user, reverse('rooms', args=[hotel.pk]), {}),
+            'room_detail': (hotel.user, reverse('room_detail', args=[room.pk]), {}),
+            'profile': (traveller, reverse('profile'), {}),
+            'clientprofile': (hotel.user, reverse('client'), {}),
+        }
+
+    def measure(self, client, url, params, iterations, warmup):
+        for _ in range(warmup):
+            client.get(url, params)
+
+        latencies, queries = [], []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url, params)
+                latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: статус {response.status_code}')
+            queries.append(len(captured))
+
+        # Память меряется отдельным проходом: tracemalloc сильно замедляет запросы
+        tracemalloc.start()
+        client.get(url, params)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'queries': max(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должно быть больше нуля')
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, (user, url, params) in self.scenarios().items():
+                if options['only'] and name not in options['only']:
+                    continue
+                client = Client()
+                if user is not None:
+                    client.force_login(user)
+                results[name] = self.measure(client, url, params, options['iterations'], options['warmup'])
+                self.stdout.write(f'{name:20} ' + ' '.join(f'{key}={value}' for key, value in results[name].items()))
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'rows': {model.__name__: model.objects.count()
+                         for model in (Hotel, Hotel_Room, Files, BookingHistory)},
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Результаты записаны в {options["output"]}'))
@@ -0,0 +1,55 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from main.db import pool
+from main.management.commands.benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = ('Имитирует многопоточный сервер: потоки открывают соединение, делают запросы и закрывают его, '
+            'как в конце запроса. Сравнение: DB_POOL_SIZE=0 (новое соединение на запрос) и DB_POOL_SIZE=N')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=50, help='Запросов на поток')
+        parser.add_argument('--queries', type=int, default=3, help='SQL-запросов на запрос')
+
+    def request(self, queries):
+        start = time.perf_counter()
+        try:
+            for _ in range(queries):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        finally:
+            # То же, что делает Django по сигналу request_finished при CONN_MAX_AGE = 0
+            connection.close()
+        return (time.perf_counter() - start) * 1000
+
+    def worker(self, requests, queries):
+        try:
+            return [self.request(queries) for _ in range(requests)]
+        finally:
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        if min(options['threads'], options['requests'], options['queries']) < 1:
+            raise CommandError('--threads, --requests и --queries должны быть больше нуля')
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError('Для SQLite в памяти соединения не закрываются: нужна БД в файле')
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['threads']) as executor:
+            futures = [executor.submit(self.worker, options['requests'], options['queries'])
+                       for _ in range(options['threads'])]
+            latencies = [latency for future in futures for latency in future.result()]
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f'ENGINE={connection.settings_dict["ENGINE"]} потоков={options["threads"]} '
+                          f'p50_ms={percentile(latencies, 50):.2f} p95_ms={percentile(latencies, 95):.2f} '
+                          f'запросов/с={len(latencies) / elapsed:.0f}')
+        for name, stats in pool.stats().items():
+            self.stdout.write(f'{name}: ' + ' '.join(f'{key}={value}' for key, value in stats.items()))
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,64 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from main.hashers import ProfilePBKDF2PasswordHasher
+from main.management.commands.benchmark import percentile
+
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = 'Меряет стоимость проверки пароля для профилей PASSWORD_HASHER_PROFILES и входов в секунду на процесс'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5, help='Проверок пароля на профиль')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Число процессов: оценка пиковой пропускной способности входа')
+
+    def measure(self, iterations, runs):
+        with override_settings(PASSWORD_HASH_ITERATIONS=iterations):
+            hasher = ProfilePBKDF2PasswordHasher()
+            encoded = hasher.encode(PASSWORD, hasher.salt())
+            latencies = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                hasher.verify(PASSWORD, encoded)
+                latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    def measure_login(self):
+        # Полный путь входа (запрос по email + проверка пароля) на временном пользователе, который откатывается
+        with transaction.atomic():
+            User.objects.create_user(username='benchmark-login', email='benchmark-login@example.com',
+                                     password=PASSWORD)
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                user = authenticate(email='benchmark-login@example.com', password=PASSWORD)
+                elapsed = (time.perf_counter() - start) * 1000
+            transaction.set_rollback(True)
+        if user is None:
+            raise CommandError('Вход временного пользователя не удался: проверьте AUTHENTICATION_BACKENDS')
+        return elapsed, len(captured)
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['workers'] < 1:
+            raise CommandError('--iterations и --workers должны быть больше нуля')
+
+        profiles = dict(settings.PASSWORD_HASHER_PROFILES)
+        if settings.PASSWORD_HASH_ITERATIONS not in profiles.values():
+            profiles['env'] = settings.PASSWORD_HASH_ITERATIONS
+        for name, iterations in profiles.items():
+            latencies = self.measure(iterations, options['iterations'])
+            p50 = percentile(latencies, 50)
+            current = ' (текущий)' if iterations == settings.PASSWORD_HASH_ITERATIONS else ''
+            self.stdout.write(f'{name:8} итераций={iterations:<9} p50_ms={p50:.1f} p95_ms={percentile(latencies, 95):.1f} '
+                              f'входов/с={options["workers"] * 1000 / p50:.1f}{current}')
+
+        elapsed, queries = self.measure_login()
+        self.stdout.write(self.style.SUCCESS(f'Вход по email с текущим профилем: {elapsed:.1f} мс, запросов: {queries}'))
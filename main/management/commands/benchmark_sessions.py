@@ -0,0 +1,112 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from main.models import Hotel, Job
+
+PASSWORD = 'benchmark-password'
+EMAIL = 'benchmark-sessions@example.com'
+
+# Связка хранилищ сессий и сообщений: before - значения Django по умолчанию, которыми проект жил раньше
+STACKS = {
+    'before': ('db', 'fallback'),
+    'db_cookie': ('db', 'cookie'),
+    'cached_db': ('cached_db', 'cookie'),
+    'write_behind': ('write_behind', 'cookie'),
+    'cache': ('cache', 'cookie'),
+}
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает запросы к БД на запрос для вариантов SESSION_STORE/MESSAGE_STORE на пути вход -> профиль -> поиск'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=20, help='Сколько раз пройти путь на каждую связку')
+        parser.add_argument('--only', nargs='*', choices=list(STACKS), help='Имена связок, например before cached_db')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def flow(self, city):
+        return [
+            ('login', 'post', reverse('logincheck'), {'email': EMAIL, 'password': PASSWORD}),
+            ('profile', 'get', reverse('profile'), {}),
+            ('search', 'get', reverse('hotels'), {}),
+            ('search_city', 'get', reverse('hotels'), {'city': city}),
+        ]
+
+    def run_flow(self, steps):
+        client = Client()
+        counts = {}
+        for name, method, url, params in steps:
+            with CaptureQueriesContext(connection) as captured:
+                response = getattr(client, method)(url, params)
+            if response.status_code not in (200, 302):
+                raise CommandError(f'{url}: статус {response.status_code}')
+            # Точки сохранения - артефакт внешней транзакции бенчмарка, в обычном запросе их нет
+            sql = [query['sql'] for query in captured
+                   if not query['sql'].lstrip().upper().startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+            counts[name] = {
+                'queries': len(sql),
+                'session': sum('django_session' in query for query in sql),
+                'writes': sum(query.lstrip().upper().startswith(WRITES) for query in sql),
+            }
+        return counts
+
+    def measure(self, steps, rounds):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        # Первый проход прогревает кэш выдачи и не учитывается
+        self.run_flow(steps)
+        jobs = Job.objects.filter(name='persist_session').count()
+        totals = {name: {'queries': 0, 'session': 0, 'writes': 0} for name, *_ in steps}
+        for _ in range(rounds):
+            for name, counts in self.run_flow(steps).items():
+                for key, value in counts.items():
+                    totals[name][key] += value
+        result = {name: {key: round(value / rounds, 2) for key, value in counts.items()}
+                  for name, counts in totals.items()}
+        result['per_request'] = {key: round(sum(step[key] for step in totals.values()) / rounds / len(steps), 2)
+                                 for key in ('queries', 'session', 'writes')}
+        result['persist_jobs'] = Job.objects.filter(name='persist_session').count() - jobs
+        return result
+
+    def handle(self, *args, **options):
+        if options['rounds'] < 1:
+            raise CommandError('--rounds должно быть больше нуля')
+        city = Hotel.objects.order_by('pk').values_list('city', flat=True).first()
+        if city is None:
+            raise CommandError('В БД нет отелей: сначала выполните manage.py seed_catalog')
+
+        results = {}
+        # Хэширование пароля удешевлено: сравнивается нагрузка на БД, а не стоимость PBKDF2.
+        # Временный пользователь, сессии и задачи откатываются вместе с транзакцией
+        with override_settings(ALLOWED_HOSTS=['*'], PASSWORD_HASH_ITERATIONS=1000), transaction.atomic():
+            User.objects.create_user(username='benchmark-sessions', email=EMAIL, password=PASSWORD)
+            steps = self.flow(city)
+            for name, (session_store, message_store) in STACKS.items():
+                if options['only'] and name not in options['only']:
+                    continue
+                with override_settings(SESSION_ENGINE=settings.SESSION_STORES[session_store],
+                                       MESSAGE_STORAGE=settings.MESSAGE_STORES[message_store]):
+                    results[name] = self.measure(steps, options['rounds'])
+                self.stdout.write(f'{name:13} ' + ' '.join(
+                    f'{step}={counts["queries"]}/{counts["session"]}/{counts["writes"]}'
+                    for step, counts in results[name].items() if step != 'persist_jobs'
+                ) + f' persist_jobs={results[name]["persist_jobs"]}')
+            transaction.set_rollback(True)
+
+        self.stdout.write('Формат: запросов/к django_session/записей в среднем за проход')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+        if 'before' in results:
+            before = results['before']['per_request']['queries']
+            for name, result in results.items():
+                after = result['per_request']['queries']
+                self.stdout.write(self.style.SUCCESS(f'{name}: {after} запросов на запрос против {before} до'))
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from main.models import BookingHistory, Files, Hotel, Hotel_Room
+
+
+class Command(BaseCommand):
+    help = 'Печатает EXPLAIN для горячих запросов поиска, профиля и фото'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--city', default='москва')
+        parser.add_argument('--name', default='отель')
+        parser.add_argument('--stars', type=int, default=4)
+        parser.add_argument('--user-id', type=int, default=1)
+        parser.add_argument('--hotel-id', type=int, default=1)
+        parser.add_argument('--room-id', type=int, default=1)
+        parser.add_argument('--email', default='guest@example.com')
+
+    def hot_queries(self, options):
+        hotels = Hotel.objects.with_room_stats()
+        return [
+            ('Поиск по городу и звездам',
+             hotels.prefix_search('city', options['city']).filter(stars=options['stars']).order_by('name')),
+            ('Поиск по названию', hotels.prefix_search('name', options['name']).order_by('name')),
+            ('Сортировка по цене', hotels.filter(min_price__lte=10000).order_by('min_price')),
+            ('Номера отеля по цене', Hotel_Room.objects.filter(hotel_id=options['hotel_id']).order_by('price')),
+            ('Активные бронирования пользователя',
+             BookingHistory.objects.filter(user_id=options['user_id'], is_active=True)),
+            ('Основное фото отеля', Files.objects.filter(hotel_id=options['hotel_id'], is_primary=True)),
+            ('Основное фото номера', Files.objects.filter(room_id=options['room_id'], is_primary=True)),
+            ('Вход по email', User.objects.filter(email=options['email']).order_by('pk')[:5]),
+        ]
+
+    def handle(self, *args, **options):
+        for title, queryset in self.hot_queries(options):
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(queryset.explain())
+            self.stdout.write('')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main import fragment_cache
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания в кэш HTML-фрагментов по типам карточек'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счетчики после вывода')
+
+    def handle(self, *args, **options):
+        for fragment_type, stats in fragment_cache.stats().items():
+            self.stdout.write(
+                f"{fragment_type}: попаданий {stats['hits']}, промахов {stats['misses']}, "
+                f"hit rate {stats['hit_rate']:.1%}"
+            )
+        if options['reset']:
+            fragment_cache.reset_stats()
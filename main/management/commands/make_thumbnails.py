@@ -0,0 +1,48 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.models import Files
+
+
+def process(pk):
+    # Выполняется в отдельном процессе: у каждого процесса свое соединение с БД
+    from main.thumbnails import make_derivatives
+
+    try:
+        make_derivatives(Files.objects.get(pk=pk))
+        return pk, None
+    except (Files.DoesNotExist, OSError) as e:
+        return pk, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Создает превью для загруженных фото, у которых их еще нет (можно перезапускать)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        # Обработанные фото имеют непустой derivatives, поэтому повторный запуск продолжает с места остановки
+        pks = list(Files.objects.filter(derivatives={}).order_by('pk').values_list('pk', flat=True)[:options['limit']])
+        self.stdout.write(f'Фото без превью: {len(pks)}')
+        done = failed = 0
+
+        for start in range(0, len(pks), options['batch_size']):
+            batch = pks[start:start + options['batch_size']]
+            # Соединение родителя нельзя разделять с дочерними процессами
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+                for future in as_completed([pool.submit(process, pk) for pk in batch]):
+                    pk, error = future.result()
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'Файл {pk}: {error}')
+                    else:
+                        done += 1
+            self.stdout.write(f'Обработано {done} из {len(pks)}, ошибок: {failed}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово: {done}, ошибок: {failed}'))
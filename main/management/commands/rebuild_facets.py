@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.facets import rebuild_bitmaps
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает битовые карты отелей по удобствам из таблицы Hotel_Comfort'
+
+    def handle(self, *args, **options):
+        count = rebuild_bitmaps()
+        self.stdout.write(self.style.SUCCESS(f'Пересобрано карт удобств: {count}'))
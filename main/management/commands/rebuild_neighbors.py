@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.similar import rebuild_neighbors
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки похожих отелей для всех городов'
+
+    def handle(self, *args, **options):
+        count = rebuild_neighbors()
+        self.stdout.write(self.style.SUCCESS(f'Записано соседей: {count}'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main import search_cache
+from main.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинг и число отзывов всех отелей из таблицы отзывов'
+
+    def handle(self, *args, **options):
+        count = rebuild_ratings()
+        search_cache.bump_version()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано отелей: {count}'))
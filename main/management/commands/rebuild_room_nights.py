@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.availability import rebuild_room_nights
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу занятости номеров по ночам из бронирований'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_room_nights(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано ночей: {count}'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main import search_cache
+from main.fulltext import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Сверяет индекс полнотекстового поиска со всеми отелями и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        removed, added = rebuild_index(batch_size=options['batch_size'])
+        search_cache.bump_version()
+        self.stdout.write(self.style.SUCCESS(f'Удалено строк индекса: {removed}, добавлено: {added}'))
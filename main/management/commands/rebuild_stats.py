@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.analytics import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневные сводки по номерам и отелям из истории бронирований'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rooms, hotels = rebuild_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Строк по номерам: {rooms}, по отелям: {hotels}'))
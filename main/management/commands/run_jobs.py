@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.jobs import requeue_stale, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновых задач: выполняет задачи из таблицы Job'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Выйти, когда очередь опустеет')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза между опросами пустой очереди')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Воркер запущен')
+        try:
+            while True:
+                requeue_stale()
+                count = run_pending(limit=100)
+                if count:
+                    self.stdout.write(f'Выполнено задач: {count}')
+                elif options['burst']:
+                    break
+                else:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Воркер остановлен')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main import search_cache
+
+
+class Command(BaseCommand):
+    help = 'Показывает счетчики попаданий в кэш выдачи поиска'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счетчики после вывода')
+
+    def handle(self, *args, **options):
+        stats = search_cache.stats()
+        self.stdout.write(
+            f"Попаданий: {stats['hits']}, промахов: {stats['misses']}, "
+            f"hit rate: {stats['hit_rate']:.1%}, версия данных: {stats['version']}"
+        )
+        if options['reset']:
+            search_cache.reset_stats()
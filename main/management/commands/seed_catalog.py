@@ -0,0 +1,151 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from main import geo, search_cache
+from main.analytics import rebuild_stats
+from main.facets import rebuild_bitmaps
+from main.fulltext import rebuild_index
+from main.similar import rebuild_neighbors
+from main.models import (BookingHistory, Comfort, Files, Hotel, Hotel_Comfort, Hotel_Room, HotelStatus,
+                         normalize_search)
+
+# Центры городов: синтетические отели ставятся вокруг них, to_center согласован с координатами
+CITIES = {
+    'Москва': (55.7558, 37.6173),
+    'Санкт-Петербург': (59.9343, 30.3351),
+    'Казань': (55.7963, 49.1088),
+    'Сочи': (43.5855, 39.7231),
+    'Екатеринбург': (56.8389, 60.6057),
+    'Новосибирск': (55.0084, 82.9357),
+    'Калининград': (54.7104, 20.4522),
+    'Владивосток': (43.1155, 131.8855),
+    'Нижний Новгород': (56.2965, 43.9361),
+    'Ярославль': (57.6261, 39.8845),
+}
+NAMES = ['Гранд', 'Престиж', 'Уют', 'Центральный', 'Парк', 'Волна', 'Северный', 'Ривьера', 'Сити', 'Лес']
+ROOM_NAMES = ['Стандарт', 'Улучшенный', 'Семейный', 'Люкс', 'Апартаменты']
+COMFORTS = ['Wi-Fi', 'Парковка', 'Бассейн', 'Завтрак', 'Спа', 'Трансфер', 'Фитнес', 'Кондиционер']
+
+
+def next_id(model):
+    # id задаем сами: MySQL не возвращает их из bulk_create, а связи нужны сразу
+    return (model.objects.aggregate(max_id=Max('pk'))['max_id'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Заполняет БД синтетическим каталогом для нагрузочных тестов (через bulk_create)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotels', type=int, default=10000)
+        parser.add_argument('--rooms-per-hotel', type=int, default=20)
+        parser.add_argument('--files-per-room', type=int, default=5)
+        parser.add_argument('--bookings', type=int, default=5000000)
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def insert(self, model, rows, batch_size):
+        # Строки создаются генератором и пишутся пачками: в памяти не больше одной пачки
+        batch, total = [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                model.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
+            total += len(batch)
+        self.stdout.write(f'{model.__name__}: {total}')
+        return total
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        hotels, rooms_per_hotel = options['hotels'], options['rooms_per_hotel']
+
+        # Каждая пачка коммитится отдельно (bulk_create сам открывает транзакцию): 5M строк
+        # одной транзакцией раздули бы undo-лог MySQL
+        status, _ = HotelStatus.objects.get_or_create(name='Одобрен')
+        comforts = [Comfort.objects.get_or_create(name=name)[0].pk for name in COMFORTS]
+
+        user_start = next_id(User)
+        self.insert(User, (
+            User(pk=user_start + i, username=f'seed_{user_start + i}', email=f'seed_{user_start + i}@example.com',
+                 first_name='Гость', last_name=str(i), password='!')
+            for i in range(options['users'])
+        ), batch_size)
+        user_ids = range(user_start, user_start + options['users'])
+
+        hotel_start = next_id(Hotel)
+
+        def hotel_rows():
+            for i in range(hotels):
+                name = f'{rnd.choice(NAMES)} {hotel_start + i}'
+                city = rnd.choice(list(CITIES))
+                center_lat, center_lon = CITIES[city]
+                latitude = center_lat + rnd.uniform(-0.15, 0.15)
+                longitude = center_lon + rnd.uniform(-0.25, 0.25)
+                yield Hotel(pk=hotel_start + i, name=name, stars=rnd.randint(1, 5), location='ул. Тестовая',
+                            phone='+7 000 000-00-00', email='hotel@example.com', city=city,
+                            to_center=round(geo.distance_km(center_lat, center_lon, latitude, longitude), 1),
+                            about='Синтетический отель', status=status, user_id=rnd.choice(user_ids),
+                            name_search=normalize_search(name), city_search=normalize_search(city),
+                            latitude=latitude, longitude=longitude, geohash=geo.encode(latitude, longitude))
+
+        self.insert(Hotel, hotel_rows(), batch_size)
+        self.insert(Hotel_Comfort, (
+            Hotel_Comfort(hotel_id=hotel_start + i, comfort_id=comfort)
+            for i in range(hotels) for comfort in rnd.sample(comforts, rnd.randint(1, len(comforts)))
+        ), batch_size)
+
+        room_start = next_id(Hotel_Room)
+        self.insert(Hotel_Room, (
+            Hotel_Room(pk=room_start + i * rooms_per_hotel + r, hotel_id=hotel_start + i,
+                       name=rnd.choice(ROOM_NAMES), description='Синтетический номер',
+                       max_people=rnd.randint(1, 5), rooms=rnd.randint(1, 3),
+                       price=rnd.randrange(1500, 30000, 100), free_count=rnd.randint(0, 10))
+            for i in range(hotels) for r in range(rooms_per_hotel)
+        ), batch_size)
+
+        def file_rows():
+            owner = user_start
+            for i in range(hotels):
+                yield Files(hotel_id=hotel_start + i, user_id=owner, file=f'files/seed/h{hotel_start + i}.jpg',
+                            is_primary=True)
+                for r in range(rooms_per_hotel):
+                    room_id = room_start + i * rooms_per_hotel + r
+                    for n in range(options['files_per_room']):
+                        yield Files(hotel_id=hotel_start + i, room_id=room_id, user_id=owner,
+                                    file=f'files/seed/r{room_id}_{n}.jpg', is_primary=(n == 0))
+
+        self.insert(Files, file_rows(), batch_size)
+
+        def booking_rows():
+            first_day = date.today() - timedelta(days=365)
+            for _ in range(options['bookings']):
+                i = rnd.randrange(hotels)
+                datefrom = first_day + timedelta(days=rnd.randrange(730))
+                nights = rnd.randint(1, 14)
+                yield BookingHistory(user_id=rnd.choice(user_ids), hotel_id=hotel_start + i,
+                                     room_id=room_start + i * rooms_per_hotel + rnd.randrange(rooms_per_hotel),
+                                     datefrom=datefrom, dateto=datefrom + timedelta(days=nights),
+                                     price=rnd.randrange(1500, 30000, 100) * nights,
+                                     people=rnd.randint(1, 4), is_active=datefrom >= date.today())
+
+        if rooms_per_hotel:
+            self.insert(BookingHistory, booking_rows(), batch_size)
+            # Сводки для страниц владельца строятся одним пересчетом, а не сигналами на каждую строку
+            rebuild_stats(batch_size=batch_size)
+
+        # bulk_create не шлет сигналы: индекс поиска, карты удобств и похожие отели строятся одним проходом,
+        # кэш выдачи сбрасывается вручную
+        rebuild_index(batch_size=batch_size)
+        rebuild_bitmaps()
+        rebuild_neighbors()
+        search_cache.bump_version()
+        self.stdout.write(self.style.SUCCESS('Каталог создан'))
@@ -0,0 +1,121 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('main.querystats')
+
+# Счетчик текущего запроса - для времени рендеринга шаблонов (main/templating.py)
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryRecorder:
+    # Подключается через connection.execute_wrapper и запоминает каждый запрос с его временем
+    def __init__(self):
+        self.queries = []
+        self.render_time = 0.0
+        self.render_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def sql_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    @contextmanager
+    def rendering(self):
+        # Время рендеринга без SQL, выполненного из шаблона; вложенные рендеры не считаются повторно
+        start, sql_time = time.perf_counter(), self.sql_time
+        self.render_depth += 1
+        try:
+            yield
+        finally:
+            self.render_depth -= 1
+            if not self.render_depth:
+                self.render_time += time.perf_counter() - start - (self.sql_time - sql_time)
+
+    def duplicates(self):
+        # Одинаковый SQL с разными параметрами - типичный признак N+1
+        return {sql: count for sql, count in Counter(sql for sql, _ in self.queries).items() if count > 1}
+
+
+def render_timer():
+    recorder = current_recorder.get()
+    return recorder.rendering() if recorder is not None else nullcontext()
+
+
+class QueryStatsMiddleware:
+    # Считает запросы, время SQL, рендеринга шаблонов и остальное время приложения (код view) для каждой
+    # страницы: отдает их в заголовке Server-Timing и одной JSON-строкой в лог main.querystats (уровень DEBUG)
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    # Время получения соединения из пула (main.db.pool) этим запросом
+                    connection.pool_wait = 0.0
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        total = time.perf_counter() - start
+        pool_wait = sum(connection.pool_wait for connection in connections.all())
+
+        view = request.resolver_match.url_name if request.resolver_match else None
+        duplicates = recorder.duplicates()
+        stats = {
+            'view': view,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'duplicates': sum(duplicates.values()) - len(duplicates),
+            'sql_ms': round(recorder.sql_time * 1000, 2),
+            'pool_wait_ms': round(pool_wait * 1000, 2),
+            # Шаблоны - и TemplateResponse, и render() в функциях-view
+            'render_ms': round(recorder.render_time * 1000, 2),
+            # Все остальное: код view и middleware
+            'app_ms': round(max(total - recorder.sql_time - pool_wait - recorder.render_time, 0) * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+        response['Server-Timing'] = ', '.join([
+            f'sql;dur={stats["sql_ms"]};desc="{recorder.count} queries"',
+            f'pool;dur={stats["pool_wait_ms"]}',
+            f'render;dur={stats["render_ms"]}',
+            f'app;dur={stats["app_ms"]}',
+            f'total;dur={stats["total_ms"]}',
+        ])
+        logger.debug(json.dumps(stats, ensure_ascii=False))
+
+        # Бюджет можно задать отдельно для метода: 'bookroom_detail:POST'
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        budget = budgets.get(f'{view}:{request.method}', budgets.get(view))
+        if budget is not None and recorder.count > budget:
+            message = f'{view}: {recorder.count} запросов при бюджете {budget}'
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message + '\n' + '\n'.join(
+                    f'{count}x {sql}' for sql, count in duplicates.items()))
+            logger.warning(message)
+        return response
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_search_columns(apps, schema_editor):
+    Hotel = apps.get_model('main', 'Hotel')
+
+    def normalize(value):
+        return ' '.join((value or '').lower().replace('ё', 'е').split())
+
+    for hotel in Hotel.objects.only('id', 'name', 'city').iterator():
+        hotel.name_search = normalize(hotel.name)
+        hotel.city_search = normalize(hotel.city)
+        hotel.save(update_fields=['name_search', 'city_search'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_bookings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotel',
+            name='city_search',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='name_search',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_search_columns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bookinghistory',
+            index=models.Index(fields=['user', 'is_active'], name='history_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='files',
+            index=models.Index(fields=['hotel', 'is_primary'], name='files_hotel_primary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='files',
+            index=models.Index(fields=['room', 'is_primary'], name='files_room_primary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['city_search', 'stars'], name='hotel_city_stars_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['name_search'], name='hotel_name_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['stars', 'name'], name='hotel_stars_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['name'], name='hotel_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotel_room',
+            index=models.Index(fields=['hotel', 'price'], name='room_hotel_price_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:33
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_ratings(apps, schema_editor):
+    Hotel = apps.get_model('main', 'Hotel')
+    Review = apps.get_model('main', 'Review')
+
+    stats = Review.objects.values('hotel_id').annotate(count=Count('id'), total=Sum('stars'))
+    for row in stats.iterator():
+        count, total = row['count'], row['total']
+        Hotel.objects.filter(pk=row['hotel_id']).update(
+            review_count=count,
+            rating_sum=total,
+            rating=round(total / count, 1),
+            rating_score=(total + 3.5 * 10) / (count + 10),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotel',
+            name='rating',
+            field=models.DecimalField(decimal_places=1, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='rating_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['rating_score'], name='hotel_rating_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotel',
+            index=models.Index(fields=['rating'], name='hotel_rating_idx'),
+        ),
+    ]
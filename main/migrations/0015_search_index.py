@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_index(apps, schema_editor):
+    # Токенизатор общий с приложением, данные - из исторических моделей
+    from main.fulltext import document_terms
+
+    Hotel = apps.get_model('main', 'Hotel')
+    Hotel_Room = apps.get_model('main', 'Hotel_Room')
+    Hotel_Comfort = apps.get_model('main', 'Hotel_Comfort')
+    SearchPosting = apps.get_model('main', 'SearchPosting')
+
+    fields = {}
+    for pk, name, city, about in Hotel.objects.values_list('pk', 'name', 'city', 'about').iterator():
+        fields[pk] = [(name, 'name'), (city, 'city'), (about, 'about')]
+    for hotel_id, name in Hotel_Comfort.objects.values_list('hotel_id', 'comfort__name').iterator():
+        fields[hotel_id].append((name, 'comfort'))
+    for hotel_id, name, description in Hotel_Room.objects.values_list('hotel_id', 'name', 'description').iterator():
+        fields[hotel_id] += [(name, 'room_name'), (description, 'room_description')]
+
+    SearchPosting.objects.bulk_create(
+        (SearchPosting(hotel_id=hotel_id, term=term, weight=weight)
+         for hotel_id, texts in fields.items() for term, weight in document_terms(texts).items()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_hotel_geo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.hotel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('term', 'hotel'), name='posting_term_hotel_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
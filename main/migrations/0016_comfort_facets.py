@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:55
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def fill_bitmaps(apps, schema_editor):
+    from main.facets import to_bitmap
+
+    Hotel_Comfort = apps.get_model('main', 'Hotel_Comfort')
+    ComfortBitmap = apps.get_model('main', 'ComfortBitmap')
+
+    hotels = defaultdict(set)
+    for comfort_id, hotel_id in Hotel_Comfort.objects.values_list('comfort_id', 'hotel_id').iterator():
+        hotels[comfort_id].add(hotel_id)
+    ComfortBitmap.objects.bulk_create([
+        ComfortBitmap(comfort_id=comfort_id, bitmap=to_bitmap(ids), hotels=len(ids))
+        for comfort_id, ids in hotels.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComfortBitmap',
+            fields=[
+                ('comfort', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='main.comfort')),
+                ('bitmap', models.BinaryField(default=b'')),
+                ('hotels', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='hotel_comfort',
+            index=models.Index(fields=['comfort', 'hotel'], name='hotelcomfort_comfort_hotel_idx'),
+        ),
+        migrations.RunPython(fill_bitmaps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:58
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def fill_neighbors(apps, schema_editor):
+    from main.similar import rank_neighbors
+
+    Hotel = apps.get_model('main', 'Hotel')
+    Hotel_Comfort = apps.get_model('main', 'Hotel_Comfort')
+    HotelNeighbor = apps.get_model('main', 'HotelNeighbor')
+
+    comforts = defaultdict(set)
+    for hotel_id, comfort_id in Hotel_Comfort.objects.values_list('hotel_id', 'comfort_id').iterator():
+        comforts[hotel_id].add(comfort_id)
+    cities = defaultdict(list)
+    hotels = (Hotel.objects.annotate(price=Min('hotel_room__price'))
+              .values('id', 'city_search', 'stars', 'price', 'latitude', 'longitude'))
+    for hotel in hotels.iterator():
+        hotel['comforts'] = comforts[hotel['id']]
+        cities[hotel.pop('city_search')].append(hotel)
+
+    rows = []
+    for hotels in cities.values():
+        hotels.sort(key=lambda hotel: (hotel['price'] or 0, hotel['id']))
+        rows += [HotelNeighbor(hotel_id=hotel_id, neighbor_id=neighbor_id, rank=rank, score=score)
+                 for hotel_id, scored in rank_neighbors(hotels)
+                 for rank, (score, neighbor_id) in enumerate(scored)]
+    HotelNeighbor.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_comfort_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='main.hotel')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='main.hotel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('hotel', 'rank'), name='neighbor_hotel_rank_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_neighbors, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,121 @@
+import math
+
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
 from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Sqrt
+from django.utils import timezone
+
+from main import geo
 
 # Create your models here.
 
+def normalize_search(value):
+    # Нормализованная строка для поиска по префиксу: нижний регистр, ё -> е, одиночные пробелы
+    return ' '.join((value or '').lower().replace('ё', 'е').split())
+
+
+class PhotoQuerySet(models.QuerySet):
+    # Одним запросом подгружает фото для всей страницы отелей/номеров
+    def with_photos(self):
+        return self.prefetch_related(
+            Prefetch('files_set', queryset=Files.objects.filter(**self.model.PHOTO_FILTER).order_by('pk'))
+        )
+
+
+class HotelQuerySet(PhotoQuerySet):
+    # Цены и свободные номера считаются по каждому отелю в том же запросе, что и страница
+    def with_room_stats(self):
+        return self.annotate(
+            min_price=Min('hotel_room__price'),
+            max_price=Max('hotel_room__price'),
+            rooms_total=Count('hotel_room'),
+            free_total=Sum('hotel_room__free_count'),
+        )
+
+    # Поиск по началу нормализованной строки: LIKE 'префикс%' идет по индексу, в отличие от LIKE '%...%'
+    def prefix_search(self, field, value):
+        prefix = normalize_search(value)
+        if not prefix:
+            return self
+        return self.filter(**{f'{field}_search__startswith': prefix})
+
+    # Отели в радиусе radius_km от точки: ячейки геохеша по индексу, затем рамка и точное расстояние
+    # только для попавших в ячейки строк. distance (км) - для сортировки по удаленности
+    def near(self, latitude, longitude, radius_km):
+        cells = Q()
+        for cell in geo.cells_around(latitude, longitude, radius_km):
+            cells |= Q(geohash__startswith=cell)
+        south, north, west, east = geo.bounding_box(latitude, longitude, radius_km)
+        lon_scale = geo.KM_PER_DEGREE * math.cos(math.radians(latitude))
+        dx = (F('longitude') - longitude) * lon_scale
+        dy = (F('latitude') - latitude) * geo.KM_PER_DEGREE
+        return (self.filter(cells, latitude__range=(south, north), longitude__range=(west, east))
+                .annotate(distance=ExpressionWrapper(Sqrt(dx * dx + dy * dy), output_field=models.FloatField()))
+                .filter(distance__lte=radius_km))
+
+    def within_box(self, south, west, north, east):
+        # Рамка карты: круг вокруг ее центра, дальше точное попадание в рамку
+        latitude, longitude = (south + north) / 2, (west + east) / 2
+        radius_km = geo.distance_km(latitude, longitude, north, east) * 1.01
+        return self.near(latitude, longitude, radius_km).filter(
+            latitude__range=(south, north), longitude__range=(west, east))
+
+    # Отели, в которых есть свободный номер на даты [datefrom, dateto) для guests гостей
+    def available_between(self, datefrom, dateto, guests=1):
+        rooms = Hotel_Room.objects.available_between(datefrom, dateto, guests)
+        return self.filter(pk__in=rooms.values('hotel_id'))
+
+
+class RoomQuerySet(PhotoQuerySet):
+    # Максимальная занятость номера за ночи диапазона считается одним подзапросом по RoomNight
+    def with_peak_booked(self, datefrom, dateto):
+        peak = (RoomNight.objects
+                .filter(room_id=OuterRef('pk'), date__gte=datefrom, date__lt=dateto)
+                .values('room_id')
+                .annotate(peak=Max('booked'))
+                .values('peak'))
+        return self.annotate(peak_booked=Coalesce(Subquery(peak), 0))
+
+    def available_between(self, datefrom, dateto, guests=1):
+        return (self.filter(max_people__gte=guests)
+                .with_peak_booked(datefrom, dateto)
+                .filter(free_count__gt=models.F('peak_booked')))
+
+
+class PhotoMixin:
+    # Если фото подгружены через with_photos(), берем их из кэша без запросов к БД.
+    # PHOTO_FILTER - какие строки Files относятся к самому объекту
+    PHOTO_FILTER = {}
+
+    def _photos_prefetched(self):
+        return 'files_set' in getattr(self, '_prefetched_objects_cache', {})
+
+    @property
+    def primary_photo(self):
+        if self._photos_prefetched():
+            return next((f for f in self.files_set.all() if f.is_primary), None)
+        return self.files_set.filter(is_primary=True, **self.PHOTO_FILTER).first()
+
+    def not_primary_photo(self):
+        if self._photos_prefetched():
+            return next((f for f in self.files_set.all() if not f.is_primary), None)
+        return self.files_set.filter(is_primary=False, **self.PHOTO_FILTER).first()
+
+    @property
+    def gallery_photos(self):
+        if self._photos_prefetched():
+            return [f for f in self.files_set.all() if not f.is_primary]
+        return list(self.files_set.filter(is_primary=False, **self.PHOTO_FILTER).order_by('pk'))
+
 class HotelStatus(models.Model):
     name = models.CharField(max_length=200)
 
     def __str__(self):
         return self.name
 
-class Hotel(models.Model):
+class Hotel(PhotoMixin, models.Model):
     name = models.CharField(max_length=200)
     stars = models.IntegerField()
     location = models.CharField(max_length=200)
@@ -20,12 +126,53 @@ class Hotel(models.Model):
     about = models.TextField()
     status = models.ForeignKey(HotelStatus,on_delete=models.CASCADE)
     user = models.ForeignKey(User,on_delete=models.CASCADE)
+    name_search = models.CharField(max_length=200, default='', editable=False)
+    city_search = models.CharField(max_length=200, default='', editable=False)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # Геохеш координат (main/geo.py), пересчитывается в save(); пустой - координат нет
+    geohash = models.CharField(max_length=12, default='', editable=False)
+    # Агрегаты отзывов пересчитываются инкрементально (main/ratings.py), а не GROUP BY на каждый запрос
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating = models.DecimalField(max_digits=3, decimal_places=1, default=0, editable=False)
+    rating_score = models.FloatField(default=0, editable=False)
+    # Меняется при любом изменении отеля, его номеров, фото и отзывов - по нему версионируется кэш карточек
+    updated_at = models.DateTimeField(auto_now=True)
 
-    @property
-    def primary_photo(self):
-        return self.files_set.filter(is_primary=True).first()
-    def not_primary_photo(self):
-        return self.files_set.filter(is_primary=False).first()
+    objects = HotelQuerySet.as_manager()
+
+    RATING_FIELDS = ('review_count', 'rating_sum', 'rating', 'rating_score')
+    # У фото номера тоже заполнен hotel: фото самого отеля - без номера
+    PHOTO_FILTER = {'room__isnull': True}
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city_search', 'stars'], name='hotel_city_stars_idx'),
+            models.Index(fields=['name_search'], name='hotel_name_search_idx'),
+            models.Index(fields=['stars', 'name'], name='hotel_stars_name_idx'),
+            models.Index(fields=['name'], name='hotel_name_idx'),
+            models.Index(fields=['rating_score'], name='hotel_rating_score_idx'),
+            models.Index(fields=['rating'], name='hotel_rating_idx'),
+            models.Index(fields=['geohash'], name='hotel_geohash_idx'),
+            models.Index(fields=['to_center'], name='hotel_to_center_idx'),
+            # MAX(updated_at) для ETag выдачи в API
+            models.Index(fields=['updated_at'], name='hotel_updated_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.name_search = normalize_search(self.name)
+        self.city_search = normalize_search(self.city)
+        has_point = self.latitude is not None and self.longitude is not None
+        self.geohash = geo.encode(self.latitude, self.longitude) if has_point else ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # Агрегаты отзывов в памяти могут быть устаревшими - обычное сохранение их не перезаписывает
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name not in self.RATING_FIELDS]
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'name_search', 'city_search', 'geohash', 'updated_at'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -41,10 +188,23 @@ class Hotel_Comfort(models.Model):
     hotel = models.ForeignKey(Hotel,on_delete=models.CASCADE)
     comfort = models.ForeignKey(Comfort,on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Фильтр по удобствам: полусоединение "есть ли у отеля удобство" только по индексу
+            models.Index(fields=['comfort', 'hotel'], name='hotelcomfort_comfort_hotel_idx'),
+        ]
+
     def __str__(self):
         return self.hotel.name
 
-class Hotel_Room(models.Model):
+
+class ComfortBitmap(models.Model):
+    # Битовая карта отелей с удобством: бит N установлен - у отеля с pk=N оно есть (main/facets.py)
+    comfort = models.OneToOneField(Comfort,on_delete=models.CASCADE, primary_key=True)
+    bitmap = models.BinaryField(default=b'')
+    hotels = models.PositiveIntegerField(default=0)
+
+class Hotel_Room(PhotoMixin, models.Model):
     hotel = models.ForeignKey(Hotel,on_delete=models.CASCADE)
     description = models.TextField()
     name = models.CharField(max_length=200)
@@ -52,12 +212,14 @@ class Hotel_Room(models.Model):
     rooms= models.IntegerField()
     price = models.IntegerField()
     free_count = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
 
-    @property
-    def primary_photo(self):
-        return self.files_set.filter(is_primary=True).first()
-    def not_primary_photo(self):
-        return self.files_set.filter(is_primary=False).first()
+    objects = RoomQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hotel', 'price'], name='room_hotel_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -79,7 +241,20 @@ class BookingHistory(models.Model):
     dateto = models.DateField()
     price = models.IntegerField()
     people = models.IntegerField()
+    # is_active=False - проживание завершено; отмена - отдельный флаг, отмененная бронь не входит в сводки
     is_active = models.BooleanField(default=True)
+    is_cancelled = models.BooleanField(default=False)
+    booking = models.ForeignKey('Bookings', null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            # Страницы профиля: брони пользователя по статусу, свежие первыми
+            models.Index(fields=['user', 'is_active', '-datefrom'], name='history_user_active_date_idx'),
+        ]
+
+    @property
+    def nights(self):
+        return (self.dateto - self.datefrom).days
 
     def __str__(self):
         return self.hotel.name
@@ -100,6 +275,37 @@ class Files(models.Model):
     file = models.FileField(upload_to='files')
     is_primary = models.BooleanField(default=False)  # Для установки основного фото
     description = models.CharField(max_length=255, blank=True, null=True)
+    # Уменьшенные копии: {'card': {'webp': {'name': ..., 'width': ..., 'height': ...}, 'jpeg': {...}}, ...}
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hotel', 'is_primary'], name='files_hotel_primary_idx'),
+            models.Index(fields=['room', 'is_primary'], name='files_room_primary_idx'),
+        ]
+
+    def derivative_url(self, size, fmt='webp'):
+        derivative = self.derivatives.get(size, {}).get(fmt)
+        return default_storage.url(derivative['name']) if derivative else None
+
+    def srcset_for(self, fmt):
+        return ', '.join(
+            f"{default_storage.url(sizes[fmt]['name'])} {sizes[fmt]['width']}w"
+            for sizes in self.derivatives.values() if fmt in sizes
+        )
+
+    @property
+    def srcset(self):
+        return self.srcset_for('webp')
+
+    @property
+    def jpeg_srcset(self):
+        return self.srcset_for('jpeg')
+
+    @property
+    def display_url(self):
+        # JPEG полного размера как запасной src; до нарезки - оригинал
+        return self.derivative_url('full', 'jpeg') or self.file.url
 
 class Bookings(models.Model):
     user = models.ForeignKey(User,on_delete=models.CASCADE)
@@ -111,4 +317,104 @@ class Bookings(models.Model):
     hotel = models.ForeignKey(Hotel,on_delete=models.CASCADE)
     room = models.ForeignKey(Hotel_Room,on_delete=models.CASCADE)
     datefrom = models.DateField()
-    dateto = models.DateField()
\ No newline at end of file
+    dateto = models.DateField()
+    # Ключ идемпотентности: повторная отправка формы не создает вторую бронь
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Отмененная бронь (main.booking.cancel_booking) не занимает ночи в RoomNight
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+
+class RoomNight(models.Model):
+    # Сколько номеров данного типа занято в конкретную ночь; ведется инкрементально при бронировании
+    room = models.ForeignKey(Hotel_Room,on_delete=models.CASCADE)
+    date = models.DateField()
+    booked = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'date'], name='roomnight_room_date_uniq'),
+        ]
+
+
+class RoomDailyStats(models.Model):
+    # Дневная сводка по номеру из истории бронирований; ведется инкрементально (main/analytics.py)
+    room = models.ForeignKey(Hotel_Room,on_delete=models.CASCADE)
+    hotel = models.ForeignKey(Hotel,on_delete=models.CASCADE)
+    date = models.DateField()
+    bookings = models.IntegerField(default=0)
+    nights_sold = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'date'], name='roomstats_room_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['hotel', 'date'], name='roomstats_hotel_date_idx'),
+        ]
+
+
+class HotelDailyStats(models.Model):
+    # Та же сводка, свернутая до отеля: страницы владельца читают по строке на день
+    hotel = models.ForeignKey(Hotel,on_delete=models.CASCADE)
+    date = models.DateField()
+    bookings = models.IntegerField(default=0)
+    nights_sold = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hotel', 'date'], name='hotelstats_hotel_date_uniq'),
+        ]
+
+
+class HotelNeighbor(models.Model):
+    # Готовый список похожих отелей для страницы отеля; пересчитывается по городам (main/similar.py)
+    hotel = models.ForeignKey(Hotel,on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Hotel,on_delete=models.CASCADE, related_name='neighbor_of')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hotel', 'rank'], name='neighbor_hotel_rank_uniq'),
+        ]
+
+
+class SearchPosting(models.Model):
+    # Строка инвертированного индекса полнотекстового поиска (main/fulltext.py): основа слова -> отель
+    term = models.CharField(max_length=64)
+    hotel = models.ForeignKey(Hotel,on_delete=models.CASCADE)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            # Уникальный индекс (term, hotel) обслуживает и точные слова, и поиск по началу основы
+            models.UniqueConstraint(fields=['term', 'hotel'], name='posting_term_hotel_uniq'),
+        ]
+
+
+class Job(models.Model):
+    # Фоновая задача: выполняется воркером manage.py run_jobs вне запроса
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'В очереди'), (RUNNING, 'Выполняется'), (DONE, 'Выполнена'), (FAILED, 'Ошибка')]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
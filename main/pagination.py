@@ -0,0 +1,120 @@
+import base64
+import json
+import math
+
+from django.core.exceptions import FieldError, ValidationError
+from django.db.models import F, Q
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Испорченный курсор - просто первая страница. Курсор приходит из строки запроса:
+    # ожидаем ровно [скаляр или null, целый pk]
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, list) or len(payload) != 2:
+        return None
+    value, pk = payload
+    if isinstance(pk, bool) or not isinstance(pk, int):
+        return None
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int, float))):
+        return None
+    return value, pk
+
+
+class KeysetPage:
+    # Страница без OFFSET: следующая начинается сразу после последней строки текущей
+    is_keyset = True
+
+    def __init__(self, object_list, cursor, next_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    # Сортировка по field с pk как вторым ключом, чтобы порядок был однозначным.
+    # nullable - для агрегатов (например, min_price у отеля без номеров): NULL всегда в конце
+    def __init__(self, field, descending=False, nullable=False):
+        self.field = field
+        self.descending = descending
+        self.nullable = nullable
+
+    def order_by(self):
+        options = {'nulls_last': True} if self.nullable else {}
+        expression = F(self.field).desc(**options) if self.descending else F(self.field).asc(**options)
+        return [expression, 'pk']
+
+    def decode(self, queryset, cursor):
+        # Значение курсора приводится к типу поля сортировки (колонки или аннотации) - как при разборе формы
+        decoded = decode_cursor(cursor) if cursor else None
+        if decoded is None or decoded[0] is None:
+            return decoded
+        value, pk = decoded
+        try:
+            value = queryset.query.resolve_ref(self.field).output_field.to_python(value)
+        except (ValidationError, FieldError, ValueError, TypeError):
+            return None
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        return value, pk
+
+    def after(self, value, pk):
+        if value is None:
+            return Q(**{f'{self.field}__isnull': True, 'pk__gt': pk})
+        lookup = 'lt' if self.descending else 'gt'
+        condition = Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, 'pk__gt': pk})
+        if self.nullable:
+            condition |= Q(**{f'{self.field}__isnull': True})
+        return condition
+
+    def paginate(self, queryset, cursor, per_page):
+        decoded = self.decode(queryset, cursor)
+        if decoded:
+            queryset = queryset.filter(self.after(*decoded))
+        rows = list(queryset.order_by(*self.order_by())[:per_page + 1])
+
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            last = rows[-1]
+            next_cursor = encode_cursor(getattr(last, self.field), last.pk)
+        return KeysetPage(rows, cursor if decoded else None, next_cursor)
+
+    def paginate_ids(self, ids, cursor, per_page, load):
+        # То же по готовому списку id (из кэша выдачи): курсор указывает на pk последней строки
+        decoded = decode_cursor(cursor) if cursor else None
+        start = 0
+        if decoded:
+            try:
+                start = ids.index(decoded[1]) + 1
+            except ValueError:
+                decoded = None
+        rows = load(ids[start:start + per_page])
+
+        next_cursor = None
+        if rows and start + per_page < len(ids):
+            last = rows[-1]
+            # Вычисляемых полей (relevance, distance) у строк, загруженных по id, нет - здесь курсору нужен только pk
+            next_cursor = encode_cursor(getattr(last, self.field, None), last.pk)
+        return KeysetPage(rows, cursor if decoded else None, next_cursor)
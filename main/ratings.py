@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+from django.utils import timezone
+
+from main.models import Hotel, Review
+
+# Байесовская оценка: у отеля с парой отзывов рейтинг тянется к средней оценке PRIOR_MEAN
+PRIOR_MEAN = 3.5
+PRIOR_WEIGHT = 10
+
+
+def derived_ratings():
+    # Средняя и байесовская оценки считаются из уже сохраненных счетчиков review_count и rating_sum
+    total = Cast(F('rating_sum'), FloatField())
+    count = F('review_count')
+    return {
+        'rating': Case(
+            When(review_count=0, then=Value(0.0)),
+            default=Round(total / count, 1),
+            output_field=FloatField(),
+        ),
+        'rating_score': Case(
+            When(review_count=0, then=Value(0.0)),
+            default=(total + PRIOR_MEAN * PRIOR_WEIGHT) / (count + PRIOR_WEIGHT),
+            output_field=FloatField(),
+        ),
+    }
+
+
+def apply_review(hotel_id, count_delta, stars_delta):
+    # Два UPDATE вместо одного: MySQL в SET видит уже измененные значения колонок, SQLite и PostgreSQL - старые
+    with transaction.atomic():
+        Hotel.objects.filter(pk=hotel_id).update(
+            review_count=F('review_count') + count_delta,
+            rating_sum=F('rating_sum') + stars_delta,
+        )
+        Hotel.objects.filter(pk=hotel_id).update(updated_at=timezone.now(), **derived_ratings())
+
+
+def rebuild_ratings():
+    # Полный пересчет агрегатов всех отелей двумя UPDATE на стороне БД
+    reviews = Review.objects.filter(hotel=OuterRef('pk')).order_by().values('hotel')
+    with transaction.atomic():
+        updated = Hotel.objects.update(
+            review_count=Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')), 0,
+                                  output_field=IntegerField()),
+            rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('stars')).values('total')), 0,
+                                output_field=IntegerField()),
+        )
+        Hotel.objects.update(updated_at=timezone.now(), **derived_ratings())
+    return updated
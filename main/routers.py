@@ -0,0 +1,77 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY = 'default'
+# Cookie с временем (unix), до которого запросы пользователя читают из основной БД
+STICKY_COOKIE = 'db_primary_until'
+# Таблицы, которые всегда читаются и пишутся в основной БД, а запись в них не закрепляет пользователя:
+# кэш в БД (SEARCH_CACHE=db) пишется и на страницах только для чтения
+PRIMARY_APPS = {'django_cache'}
+
+_state = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaRouter:
+    # Чтение уходит в реплику только внутри запроса, который ReplicaRoutingMiddleware отметил как
+    # читающий; команды, задачи и страницы с записью работают с основной БД
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or state.wrote or model._meta.app_label in PRIMARY_APPS:
+            return PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label not in PRIMARY_APPS:
+            # После записи запрос дочитывает из основной БД: в реплике изменений еще может не быть
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии основной БД: связи между объектами из разных алиасов допустимы
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    # Страницы из REPLICA_VIEWS (GET/HEAD) читают из случайной реплики, одной на весь запрос.
+    # Пользователь, который что-то записал, следующие REPLICA_STICKY_SECONDS читает из основной БД
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote:
+            window = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, str(int(time.time() + window)), max_age=window,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (replicas() and request.method in ('GET', 'HEAD')
+                and request.resolver_match.url_name in settings.REPLICA_VIEWS
+                and not self.sticky(request)):
+            _state.get().replica = random.choice(replicas())
+
+    def sticky(self, request):
+        try:
+            return int(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
@@ -0,0 +1,94 @@
+import hashlib
+import json
+
+from django.core.cache import caches
+
+from main.models import normalize_search
+
+# Отдельный алиас кэша: locmem, файловый или в таблице БД (см. SEARCH_CACHE в settings)
+CACHE_ALIAS = 'search'
+TIMEOUT = 300
+VERSION_KEY = 'search:version'
+HITS_KEY = 'search:hits'
+MISSES_KEY = 'search:misses'
+
+
+def cache():
+    return caches[CACHE_ALIAS]
+
+
+def incr(key):
+    # incr в кэше Django падает на отсутствующем ключе
+    search_cache = cache()
+    search_cache.add(key, 0, None)
+    try:
+        return search_cache.incr(key)
+    except ValueError:
+        search_cache.set(key, 1, None)
+        return 1
+
+
+def version():
+    return cache().get_or_set(VERSION_KEY, 1, None)
+
+
+def bump_version():
+    # Любое изменение отелей, номеров или фото делает все закэшированные выдачи устаревшими
+    return incr(VERSION_KEY)
+
+
+def normalize_params(params, sorts):
+    # Разные написания одного запроса ("Москва", " москва ") дают один ключ
+    name = normalize_search(params.get('name'))
+    # Без явной сортировки текстовый запрос упорядочен по релевантности - это другой ключ, чем sort=name
+    default_sort = 'relevance' if name and 'relevance' in sorts else 'name'
+    normalized = {
+        'name': name,
+        'city': normalize_search(params.get('city')),
+        'sort': params.get('sort') if params.get('sort') in sorts else default_sort,
+    }
+    for field in ('stars', 'min_price', 'max_price', 'min_rating', 'max_to_center'):
+        value = (params.get(field) or '').strip()
+        if value:
+            normalized[field] = int(value) if value.isdigit() else value
+    # Удобства - множество: порядок и повторы в строке запроса не важны
+    comforts = sorted({int(value) for value in params.getlist('comfort') if value.isdigit()})
+    if comforts:
+        normalized['comfort'] = comforts
+    return {key: value for key, value in normalized.items() if value != ''}
+
+
+def make_key(params, sorts):
+    # Выдача по датам меняется с каждой бронью, ее не кэшируем; гео-запросы почти не повторяются
+    # (у каждого своя точка) и несут расстояние, которого нет в закэшированных id
+    if any(params.get(field) for field in ('check_in', 'check_out', 'lat', 'lon', 'bbox')):
+        return None
+    normalized = json.dumps(normalize_params(params, sorts), sort_keys=True, ensure_ascii=False)
+    return f'search:ids:{version()}:' + hashlib.md5(normalized.encode()).hexdigest()
+
+
+def get_or_set_ids(key, compute):
+    ids = cache().get(key)
+    if ids is not None:
+        incr(HITS_KEY)
+        return ids
+    incr(MISSES_KEY)
+    ids = compute()
+    cache().set(key, ids, TIMEOUT)
+    return ids
+
+
+def stats():
+    hits = cache().get(HITS_KEY, 0)
+    misses = cache().get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+        'version': version(),
+    }
+
+
+def reset_stats():
+    cache().set_many({HITS_KEY: 0, MISSES_KEY: 0}, None)
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+
+from main.jobs import enqueue
+
+# Сессии с отложенной записью в БД (SESSION_STORE=write_behind): кэш - основное хранилище,
+# таблица django_session догоняет его задачей persist_session не чаще раза в SESSION_WRITE_BEHIND_DELAY секунд.
+# Создание (вход) и удаление (выход) сессии пишутся в БД сразу, как у cached_db
+KEY_PREFIX = 'main.sessions'
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = KEY_PREFIX
+
+    @property
+    def pending_key(self):
+        return self.cache_key + ':pending'
+
+    def save(self, must_create=False):
+        if must_create or self.session_key is None:
+            return super().save(must_create)
+        self._cache.set(self.cache_key, self._get_session(), self.get_expiry_age())
+        # Пока запись уже запланирована, изменения копятся в кэше: одна задача на сессию за интервал
+        delay = settings.SESSION_WRITE_BEHIND_DELAY
+        if self._cache.add(self.pending_key, 1, delay * 2 + 60):
+            enqueue('persist_session', delay=delay, session_key=self.session_key)
+
+    def delete(self, session_key=None):
+        key = session_key or self.session_key
+        if key is not None:
+            self._cache.delete(self.cache_key_prefix + key + ':pending')
+        super().delete(session_key)
+
+    def persist(self):
+        # Перенос кэша в БД; флаг снимается до чтения, чтобы следующее изменение запланировало новую запись
+        self._cache.delete(self.pending_key)
+        data = self._cache.get(self.cache_key)
+        if data is None:
+            # Сессия истекла или вытеснена из кэша - в БД остается последняя сохраненная версия
+            return False
+        self._session_cache = data
+        try:
+            DBStore.save(self)
+        except UpdateError:
+            # Сессию удалили (выход) раньше, чем дошла очередь
+            return False
+        return True
@@ -0,0 +1,219 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from main import facets, fulltext, search_cache, similar
+from main.analytics import apply_booking
+from main.availability import release_nights, reserve_nights
+from main.models import BookingHistory, Bookings, Comfort, Files, Hotel, Hotel_Comfort, Hotel_Room, Review
+from main.ratings import apply_review
+
+
+def held_nights(room_id, datefrom, dateto, cancelled_at):
+    # Ночи, которые бронь занимает в RoomNight; отмененная бронь не занимает ничего
+    return None if cancelled_at else (room_id, datefrom, dateto)
+
+
+@receiver(pre_save, sender=Bookings)
+def remember_booking_nights(sender, instance, **kwargs):
+    # При изменении или отмене брони нужно освободить старые ночи
+    instance._old_nights = None
+    if instance.pk:
+        row = (Bookings.objects
+               .filter(pk=instance.pk)
+               .values_list('room_id', 'datefrom', 'dateto', 'cancelled_at')
+               .first())
+        if row:
+            instance._old_nights = held_nights(*row)
+
+
+@receiver(post_save, sender=Bookings)
+def reserve_booking_nights(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new_nights = held_nights(instance.room_id, instance.datefrom, instance.dateto, instance.cancelled_at)
+    old_nights = getattr(instance, '_old_nights', None)
+    if old_nights == new_nights:
+        return
+    if old_nights:
+        release_nights(*old_nights)
+    if new_nights:
+        reserve_nights(*new_nights)
+
+
+@receiver(post_delete, sender=Bookings)
+def release_booking_nights(sender, instance, **kwargs):
+    nights = held_nights(instance.room_id, instance.datefrom, instance.dateto, instance.cancelled_at)
+    if nights:
+        release_nights(*nights)
+
+
+def history_stats(room_id, hotel_id, datefrom, dateto, price, is_cancelled):
+    # Вклад строки истории в сводки; отмененная бронь не приносит ни ночей, ни выручки
+    return None if is_cancelled else (room_id, hotel_id, datefrom, dateto, price)
+
+
+@receiver(pre_save, sender=BookingHistory)
+def remember_history_stats(sender, instance, **kwargs):
+    # Изменение строки истории переносит ее вклад в сводки: старые значения вычитаются
+    instance._old_stats = None
+    if instance.pk:
+        row = (BookingHistory.objects
+               .filter(pk=instance.pk)
+               .values_list('room_id', 'hotel_id', 'datefrom', 'dateto', 'price', 'is_cancelled')
+               .first())
+        if row:
+            instance._old_stats = history_stats(*row)
+
+
+@receiver(post_save, sender=BookingHistory)
+def add_history_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new_stats = history_stats(instance.room_id, instance.hotel_id, instance.datefrom, instance.dateto,
+                              instance.price, instance.is_cancelled)
+    old_stats = getattr(instance, '_old_stats', None)
+    if old_stats == new_stats:
+        return
+    if old_stats:
+        apply_booking(*old_stats, sign=-1)
+    if new_stats:
+        apply_booking(*new_stats)
+
+
+@receiver(post_delete, sender=BookingHistory)
+def remove_history_stats(sender, instance, **kwargs):
+    if not instance.is_cancelled:
+        apply_booking(instance.room_id, instance.hotel_id, instance.datefrom, instance.dateto, instance.price,
+                      sign=-1)
+
+
+@receiver([post_save, post_delete], sender=Hotel)
+@receiver([post_save, post_delete], sender=Hotel_Room)
+@receiver([post_save, post_delete], sender=Files)
+@receiver([post_save, post_delete], sender=Hotel_Comfort)
+def invalidate_search_cache(sender, **kwargs):
+    search_cache.bump_version()
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_stars(sender, instance, **kwargs):
+    # При изменении отзыва старая оценка вычитается из агрегатов прежнего отеля
+    instance._old_rating = None
+    if instance.pk:
+        instance._old_rating = Review.objects.filter(pk=instance.pk).values_list('hotel_id', 'stars').first()
+
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_rating = getattr(instance, '_old_rating', None)
+    if old_rating == (instance.hotel_id, instance.stars):
+        return
+    if old_rating:
+        apply_review(old_rating[0], -1, -old_rating[1])
+    apply_review(instance.hotel_id, 1, instance.stars)
+    search_cache.bump_version()
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    apply_review(instance.hotel_id, -1, -instance.stars)
+    search_cache.bump_version()
+
+
+@receiver([post_save, post_delete], sender=Hotel_Room)
+@receiver([post_save, post_delete], sender=Hotel_Comfort)
+def touch_hotel(sender, instance, **kwargs):
+    # Цена "от", удобства и фото отеля выводятся в его карточке - карточку нужно перестроить
+    Hotel.objects.filter(pk=instance.hotel_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Files)
+def touch_photo_owner(sender, instance, **kwargs):
+    now = timezone.now()
+    Hotel.objects.filter(pk=instance.hotel_id).update(updated_at=now)
+    if instance.room_id:
+        Hotel_Room.objects.filter(pk=instance.room_id).update(updated_at=now)
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_save, sender=Hotel_Room)
+@receiver(post_save, sender=Hotel_Comfort)
+def reindex_hotel(sender, instance, raw=False, **kwargs):
+    # Документ поиска - отель вместе с номерами и удобствами, переиндексируется только он
+    if raw:
+        return
+    fulltext.index_hotels([instance.pk if sender is Hotel else instance.hotel_id])
+
+
+@receiver(post_delete, sender=Hotel_Room)
+@receiver(post_delete, sender=Hotel_Comfort)
+def reindex_hotel_after_delete(sender, instance, origin=None, **kwargs):
+    # При удалении самого отеля (или его владельца) строки индекса удаляются каскадом; переиндексация
+    # посреди каскада вставила бы их обратно для отеля, который вот-вот будет удален
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if model in (Hotel_Room, Hotel_Comfort, Comfort):
+        fulltext.index_hotels([instance.hotel_id])
+
+
+@receiver(pre_save, sender=Hotel_Comfort)
+def remember_comfort_link(sender, instance, **kwargs):
+    # Перенос связи на другой отель или удобство снимает бит со старой пары
+    instance._old_link = None
+    if instance.pk:
+        instance._old_link = (Hotel_Comfort.objects
+                              .filter(pk=instance.pk)
+                              .values_list('comfort_id', 'hotel_id')
+                              .first())
+
+
+@receiver(post_save, sender=Hotel_Comfort)
+def add_comfort_bit(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old_link = getattr(instance, '_old_link', None)
+    if old_link == (instance.comfort_id, instance.hotel_id):
+        return
+    if old_link:
+        clear_comfort_bit(*old_link)
+    facets.set_hotel(instance.comfort_id, instance.hotel_id, True)
+
+
+@receiver(post_delete, sender=Hotel_Comfort)
+def remove_comfort_bit(sender, instance, origin=None, **kwargs):
+    # Карта удаляемого удобства уходит вместе с ним каскадом
+    if isinstance(origin, Comfort) or isinstance(origin, QuerySet) and origin.model is Comfort:
+        return
+    clear_comfort_bit(instance.comfort_id, instance.hotel_id)
+
+
+def clear_comfort_bit(comfort_id, hotel_id):
+    # Связь могла быть продублирована - бит снимается, только когда у отеля не осталось ни одной
+    if not Hotel_Comfort.objects.filter(comfort_id=comfort_id, hotel_id=hotel_id).exists():
+        facets.set_hotel(comfort_id, hotel_id, False)
+
+
+@receiver([post_save, post_delete], sender=Comfort)
+def invalidate_facets(sender, **kwargs):
+    # Названия удобств лежат в кэше вместе с картами
+    facets.bump_version()
+
+
+@receiver(post_save, sender=Comfort)
+def reindex_comfort_hotels(sender, instance, created, raw=False, **kwargs):
+    # Переименованное удобство меняет документы всех отелей, где оно есть
+    if raw or created:
+        return
+    fulltext.index_hotels(Hotel_Comfort.objects.filter(comfort=instance).values_list('hotel_id', flat=True))
+    search_cache.bump_version()
+
+
+@receiver([post_save, post_delete], sender=Hotel)
+def refresh_hotel_neighbors(sender, instance, raw=False, **kwargs):
+    # Списки похожих отелей города пересчитываются фоновой задачей, а не в запросе владельца
+    if raw:
+        return
+    similar.schedule_refresh(instance.city_search)
@@ -0,0 +1,77 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Min
+
+from main import geo
+from main.jobs import enqueue
+from main.models import Hotel, Hotel_Comfort, HotelNeighbor, Job
+
+# Похожие отели считаются заранее, по городу за раз: страница отеля читает готовый список
+NEIGHBORS = 4
+# Сравниваются только ближайшие по цене отели того же города, а не все пары
+CANDIDATES = 40
+NEAR_KM = 10
+REFRESH_DELAY = 60
+
+
+def similarity(a, b):
+    # Каждая составляющая от 0 до 1: звезды, цена "от", общие удобства, расстояние между отелями
+    score = 1 - abs(a['stars'] - b['stars']) / 4
+    if a['price'] and b['price']:
+        score += 1 - min(abs(a['price'] - b['price']) / max(a['price'], b['price']), 1)
+    if a['comforts'] or b['comforts']:
+        score += len(a['comforts'] & b['comforts']) / len(a['comforts'] | b['comforts'])
+    if a['latitude'] is not None and b['latitude'] is not None:
+        distance = geo.distance_km(a['latitude'], a['longitude'], b['latitude'], b['longitude'])
+        score += max(1 - distance / NEAR_KM, 0)
+    return score
+
+
+def city_hotels(city_search):
+    hotels = list(Hotel.objects
+                  .filter(city_search=city_search)
+                  .annotate(price=Min('hotel_room__price'))
+                  .values('id', 'stars', 'price', 'latitude', 'longitude')
+                  .order_by())
+    comforts = defaultdict(set)
+    links = Hotel_Comfort.objects.filter(hotel__city_search=city_search).values_list('hotel_id', 'comfort_id')
+    for hotel_id, comfort_id in links:
+        comforts[hotel_id].add(comfort_id)
+    for hotel in hotels:
+        hotel['comforts'] = comforts[hotel['id']]
+    # Порядок по цене: отели без номеров - в начале
+    return sorted(hotels, key=lambda hotel: (hotel['price'] or 0, hotel['id']))
+
+
+def rank_neighbors(hotels):
+    # hotels отсортированы по цене: кандидаты - окно из CANDIDATES соседей по цене вокруг отеля
+    for index, hotel in enumerate(hotels):
+        start = max(index - CANDIDATES // 2, 0)
+        candidates = [other for other in hotels[start:start + CANDIDATES + 1] if other['id'] != hotel['id']]
+        scored = sorted(((similarity(hotel, other), other['id']) for other in candidates),
+                        key=lambda pair: (-pair[0], pair[1]))
+        yield hotel['id'], scored[:NEIGHBORS]
+
+
+def rebuild_city(city_search):
+    hotels = city_hotels(city_search)
+    rows = [HotelNeighbor(hotel_id=hotel_id, neighbor_id=neighbor_id, rank=rank, score=score)
+            for hotel_id, scored in rank_neighbors(hotels)
+            for rank, (score, neighbor_id) in enumerate(scored)]
+    with transaction.atomic():
+        HotelNeighbor.objects.filter(hotel_id__in=[hotel['id'] for hotel in hotels]).delete()
+        HotelNeighbor.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_neighbors():
+    cities = Hotel.objects.order_by('city_search').values_list('city_search', flat=True).distinct()
+    return sum(rebuild_city(city) for city in cities)
+
+
+def schedule_refresh(city_search):
+    # Правки отелей города копятся REFRESH_DELAY секунд и пересчитываются одной задачей
+    pending = Job.objects.filter(name='refresh_neighbors', status=Job.PENDING, payload__city_search=city_search)
+    if not pending.exists():
+        enqueue('refresh_neighbors', delay=REFRESH_DELAY, city_search=city_search)
@@ -0,0 +1,39 @@
+from django.core.mail import send_mail
+
+from main.jobs import job
+from main.models import Bookings, Files
+from main.sessions import SessionStore
+from main.similar import rebuild_city
+from main.thumbnails import make_derivatives
+
+
+@job('make_derivatives')
+def make_photo_derivatives(file_id):
+    photo = Files.objects.filter(pk=file_id).first()
+    # Фото могли удалить, пока задача ждала в очереди
+    if photo is not None:
+        make_derivatives(photo)
+
+
+@job('booking_email')
+def send_booking_email(booking_id):
+    booking = Bookings.objects.select_related('user', 'hotel', 'room').get(pk=booking_id)
+    if not booking.user.email:
+        return
+    send_mail(
+        f'Бронирование в отеле "{booking.hotel.name}"',
+        f'{booking.name}, номер "{booking.room.name}" забронирован '
+        f'с {booking.datefrom:%d.%m.%Y} по {booking.dateto:%d.%m.%Y}.',
+        None,
+        [booking.user.email],
+    )
+
+
+@job('refresh_neighbors')
+def refresh_neighbors(city_search):
+    rebuild_city(city_search)
+
+
+@job('persist_session')
+def persist_session(session_key):
+    SessionStore(session_key).persist()
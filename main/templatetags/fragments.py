@@ -0,0 +1,34 @@
+from django import template
+
+from main import fragment_cache
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, fragment_type, obj, vary_on):
+        self.nodelist = nodelist
+        self.fragment_type = fragment_type
+        self.obj = obj
+        self.vary_on = vary_on
+
+    def render(self, context):
+        obj = self.obj.resolve(context)
+        vary_on = [value.resolve(context) for value in self.vary_on]
+        key = fragment_cache.make_key(self.fragment_type, obj, vary_on)
+        return fragment_cache.get_or_render(self.fragment_type, key, lambda: self.nodelist.render(context))
+
+
+@register.tag
+def fragment(parser, token):
+    # {% fragment 'hotel_card' hotel [доп. значения] %}...{% endfragment %}
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' ожидает тип фрагмента и объект")
+    fragment_type = bits[1].strip('\'"')
+    if fragment_type not in fragment_cache.TYPES:
+        raise template.TemplateSyntaxError(f"Неизвестный тип фрагмента: {fragment_type}")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, fragment_type, parser.compile_filter(bits[2]),
+                        [parser.compile_filter(bit) for bit in bits[3:]])
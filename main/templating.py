@@ -0,0 +1,20 @@
+from django.template.backends.django import DjangoTemplates, Template
+
+from main.middleware import render_timer
+
+# Шаблонный движок Django, который отдает время рендеринга в main.querystats (render_ms).
+# Через него идут и TemplateResponse, и render() в функциях-view; {% include %} рендерится внутри
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with render_timer():
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
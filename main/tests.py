@@ -1,3 +1,1754 @@
-from django.test import TestCase
+import base64
+import json
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.cache import cache, caches
+from django.db import IntegrityError, connection, connections
+from django.db.models import F
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from main.accounts import allocate_username, create_account
+from main.availability import free_rooms, rebuild_room_nights
+from main import facets, fragment_cache, fulltext, geo, search_cache, similar
+from main.booking import BookingError, book_room, cancel_booking
+from main.db import pool as db_pool
+from main.db.mysql.base import DatabaseWrapper as PooledMySQLWrapper
+from main.db.sqlite3.base import DatabaseWrapper as PooledSQLiteWrapper
+from main.jobs import backoff, enqueue, job, run_pending
+from main.middleware import QueryBudgetExceeded
+from main.ratings import rebuild_ratings
+from main.routers import STICKY_COOKIE, ReplicaRouter, RoutingState, _state as routing_state
+from main.sessions import SessionStore
+from main.models import (BookingFavorites, BookingHistory, Bookings, Comfort, ComfortBitmap, Hotel, HotelDailyStats, HotelStatus,
+                         Hotel_Comfort, Hotel_Room, Files, Job, Review, RoomDailyStats, RoomNight, SearchPosting,
+                         normalize_search)
+from main.thumbnails import make_derivatives
+from main.uploads import save_photos
+from main.views import SearchHotel
 
 # Create your tests here.
+
+
+def make_catalog(count, owner, status):
+    hotels = Hotel.objects.bulk_create([
+        Hotel(name=f'Отель {i}', stars=i % 5 + 1, location='ул. Ленина', phone='+7', email='h@h.ru',
+              city='Москва', to_center=1.5, about='', status=status, user=owner,
+              name_search=normalize_search(f'Отель {i}'), city_search='москва')
+        for i in range(count)
+    ])
+    rooms = Hotel_Room.objects.bulk_create([
+        Hotel_Room(hotel=hotel, description='', name='Стандарт', max_people=2, rooms=1,
+                   price=1000 + hotel.pk, free_count=3)
+        for hotel in hotels
+    ])
+    files = []
+    for hotel, room in zip(hotels, rooms):
+        files += [
+            Files(user=owner, hotel=hotel, file=f'files/h{hotel.pk}.png', is_primary=True),
+            Files(user=owner, hotel=hotel, file=f'files/h{hotel.pk}_1.png'),
+            Files(user=owner, hotel=hotel, room=room, file=f'files/r{room.pk}.png', is_primary=True),
+        ]
+    Files.objects.bulk_create(files)
+    # bulk_create не шлет сигналы, кэш выдачи сбрасываем сами
+    search_cache.bump_version()
+    return hotels
+
+
+class PrimaryPhotoQueriesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.status = HotelStatus.objects.create(name='Активен')
+
+    def test_primary_photo_without_prefetch(self):
+        hotel = make_catalog(1, self.owner, self.status)[0]
+        self.assertEqual(hotel.primary_photo.file.name, f'files/h{hotel.pk}.png')
+        self.assertEqual(hotel.not_primary_photo().file.name, f'files/h{hotel.pk}_1.png')
+
+    def test_fixed_query_count_for_hotel_list(self):
+        for count in (5, 50, 500):
+            Hotel.objects.all().delete()
+            make_catalog(count, self.owner, self.status)
+            with self.subTest(count=count), self.assertNumQueries(2):
+                hotels = list(Hotel.objects.with_photos())
+                self.assertEqual(len(hotels), count)
+                for hotel in hotels:
+                    self.assertTrue(hotel.primary_photo.is_primary)
+                    self.assertEqual(len(hotel.gallery_photos), 1)
+
+    def test_fixed_query_count_for_room_list(self):
+        for count in (5, 50, 500):
+            Hotel.objects.all().delete()
+            make_catalog(count, self.owner, self.status)
+            with self.subTest(count=count), self.assertNumQueries(2):
+                for room in Hotel_Room.objects.with_photos():
+                    self.assertEqual(room.primary_photo.file.name, f'files/r{room.pk}.png')
+                    self.assertEqual(room.gallery_photos, [])
+
+    def test_hotel_photos_exclude_room_photos(self):
+        hotel = make_catalog(1, self.owner, self.status)[0]
+        room = hotel.hotel_room_set.get()
+        # У отеля нет основного фото, у номера есть - и основное, и обычное
+        Files.objects.filter(hotel=hotel, room__isnull=True, is_primary=True).delete()
+        Files.objects.create(user=self.owner, hotel=hotel, room=room, file=f'files/r{room.pk}_1.png')
+        prefetched = Hotel.objects.with_photos().get()
+        for loaded in (prefetched, Hotel.objects.get()):
+            with self.subTest(prefetched=loaded is prefetched):
+                self.assertIsNone(loaded.primary_photo)
+                self.assertEqual([photo.file.name for photo in loaded.gallery_photos], [f'files/h{hotel.pk}_1.png'])
+
+    def test_search_card_ignores_room_photos(self):
+        hotel = make_catalog(1, self.owner, self.status)[0]
+        room = hotel.hotel_room_set.get()
+        Files.objects.filter(hotel=hotel, room__isnull=True).delete()
+        response = self.client.get(reverse('hotels'))
+        self.assertContains(response, 'Нет фото')
+        self.assertNotContains(response, f'r{room.pk}.png')
+
+    def test_search_page_query_count_does_not_grow(self):
+        counts = []
+        for count in (5, 50, 500):
+            Hotel.objects.all().delete()
+            make_catalog(count, self.owner, self.status)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('hotels'))
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, counts)
+
+
+class HotelRoomStatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        status = HotelStatus.objects.create(name='Активен')
+        cls.cheap, cls.expensive = make_catalog(2, owner, status)
+        Hotel_Room.objects.create(hotel=cls.expensive, description='', name='Люкс', max_people=2, rooms=2,
+                                  price=9000, free_count=1)
+        Hotel_Room.objects.filter(hotel=cls.expensive, name='Стандарт').update(price=5000)
+
+    def setUp(self):
+        search_cache.cache().clear()
+
+    def test_each_hotel_gets_its_own_min_price(self):
+        hotels = {h.pk: h for h in Hotel.objects.with_room_stats()}
+        self.assertEqual(hotels[self.cheap.pk].min_price, 1000 + self.cheap.pk)
+        self.assertEqual(hotels[self.expensive.pk].min_price, 5000)
+        self.assertEqual(hotels[self.expensive.pk].rooms_total, 2)
+        self.assertEqual(hotels[self.expensive.pk].free_total, 4)
+
+    def test_price_filters_and_sort_use_annotation(self):
+        response = self.client.get(reverse('hotels'), {'min_price': 8000, 'sort': 'price_desc'})
+        self.assertEqual([h.pk for h in response.context['hotels']], [self.expensive.pk])
+        response = self.client.get(reverse('hotels'), {'max_price': 6000, 'sort': 'price_desc'})
+        self.assertEqual([h.pk for h in response.context['hotels']], [self.expensive.pk, self.cheap.pk])
+        self.assertContains(response, 'от 5000 руб.')
+
+
+class PrefixSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        status = HotelStatus.objects.create(name='Активен')
+        hotel = dict(stars=3, location='', phone='', email='', to_center=1, about='', status=status, user=owner)
+        cls.moscow = Hotel.objects.create(name='Ёлка  Парк', city='Москва', **hotel)
+        cls.mozhaysk = Hotel.objects.create(name='Елки', city='Можайск', **hotel)
+
+    def test_search_columns_are_normalized_on_save(self):
+        self.assertEqual(self.moscow.name_search, 'елка парк')
+        self.assertEqual(self.moscow.city_search, 'москва')
+
+    def test_prefix_search(self):
+        self.assertQuerySetEqual(Hotel.objects.prefix_search('city', ' МОСК'), [self.moscow])
+        self.assertQuerySetEqual(Hotel.objects.prefix_search('city', 'мо').order_by('pk'),
+                                 [self.moscow, self.mozhaysk])
+        self.assertQuerySetEqual(Hotel.objects.prefix_search('name', 'ёлка п'), [self.moscow])
+        self.assertEqual(Hotel.objects.prefix_search('name', '').count(), 2)
+        # Ищется начало строки, а не подстрока
+        self.assertFalse(Hotel.objects.prefix_search('city', 'сква').exists())
+
+    def search_city(self, city):
+        return sorted(hotel.pk for hotel in self.client.get(reverse('hotels'), {'city': city}).context['hotels'])
+
+    def test_search_page_matches_city_prefix_only(self):
+        # Намеренное поведение: город ищется по началу слова (индекс), а не по любой подстроке
+        search_cache.cache().clear()
+        self.assertEqual(self.search_city('моск'), [self.moscow.pk])
+        self.assertEqual(self.search_city('МО'), sorted([self.moscow.pk, self.mozhaysk.pk]))
+        self.assertEqual(self.search_city('сква'), [])
+        self.assertEqual(self.search_city('айск'), [])
+
+    def test_prefix_search_uses_like_not_range(self):
+        # Граница диапазона chr(ord(last) + 1) не работает в MySQL-сортировке utf8mb4_0900_ai_ci
+        # ('я' -> 'ѐ', 'z' -> '{'), поэтому префикс передается в LIKE
+        sql = str(Hotel.objects.prefix_search('city', 'москвя').query)
+        self.assertIn('LIKE', sql)
+        self.assertNotIn('<', sql)
+
+
+class AvailabilityTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        status = HotelStatus.objects.create(name='Активен')
+        cls.hotel, cls.other = make_catalog(2, cls.owner, status)
+        cls.room = cls.hotel.hotel_room_set.get()
+        Hotel_Room.objects.filter(pk=cls.room.pk).update(free_count=1)
+        cls.room.refresh_from_db()
+
+    def book(self, datefrom, dateto, room=None):
+        return Bookings.objects.create(user=self.owner, name='Иван', surname='Иванов', idoc_series=1, idoc_number=1,
+                                       people=2, hotel=self.hotel, room=room or self.room,
+                                       datefrom=datefrom, dateto=dateto)
+
+    def test_nights_are_maintained_on_create_update_and_delete(self):
+        booking = self.book(date(2025, 6, 12), date(2025, 6, 15))
+        self.assertEqual(list(RoomNight.objects.filter(booked=1).values_list('date', flat=True).order_by('date')),
+                         [date(2025, 6, 12), date(2025, 6, 13), date(2025, 6, 14)])
+        booking.dateto = date(2025, 6, 13)
+        booking.save()
+        self.assertEqual(RoomNight.objects.filter(booked=1).count(), 1)
+        booking.delete()
+        self.assertFalse(RoomNight.objects.filter(booked__gt=0).exists())
+
+    def test_range_availability_for_many_rooms(self):
+        self.book(date(2025, 6, 14), date(2025, 6, 16))
+        rooms = list(Hotel_Room.objects.all())
+        with self.assertNumQueries(1):
+            free = free_rooms(rooms, date(2025, 6, 12), date(2025, 6, 15))
+        self.assertEqual(free[self.room.pk], 0)
+        self.assertEqual(free[self.other.hotel_room_set.get().pk], 3)
+        self.assertEqual(free_rooms(rooms, date(2025, 6, 12), date(2025, 6, 14))[self.room.pk], 1)
+
+    def test_search_filters_by_dates_and_guests(self):
+        self.book(date(2025, 6, 12), date(2025, 6, 13))
+        params = {'check_in': '2025-06-12', 'check_out': '2025-06-15', 'guests': 2}
+        response = self.client.get(reverse('hotels'), params)
+        self.assertEqual([h.pk for h in response.context['hotels']], [self.other.pk])
+        response = self.client.get(reverse('hotels'), dict(params, guests=3))
+        self.assertEqual(list(response.context['hotels']), [])
+        response = self.client.get(reverse('hotels'), dict(params, check_in='2025-06-13'))
+        self.assertEqual(len(response.context['hotels']), 2)
+
+    def test_rebuild_matches_incremental_state(self):
+        self.book(date(2025, 6, 12), date(2025, 6, 14))
+        self.book(date(2025, 6, 13), date(2025, 6, 15))
+        expected = set(RoomNight.objects.values_list('room_id', 'date', 'booked'))
+        self.assertEqual(rebuild_room_nights(), 3)
+        self.assertEqual(set(RoomNight.objects.values_list('room_id', 'date', 'booked')), expected)
+
+    def test_cancellation_releases_nights_once(self):
+        booking = book_room(**booking_args(self.owner, self.room))
+        with self.assertRaises(BookingError):
+            book_room(**booking_args(self.owner, self.room))
+        # Завершенная бронь (is_active=False) - не отмена: ночи остаются занятыми
+        BookingHistory.objects.filter(booking=booking).update(is_active=False)
+        self.assertEqual(set(RoomNight.objects.values_list('booked', flat=True)), {1})
+
+        self.assertTrue(cancel_booking(booking.pk))
+        self.assertFalse(cancel_booking(booking.pk))
+        self.assertFalse(RoomNight.objects.filter(booked__gt=0).exists())
+        history = BookingHistory.objects.get(booking=booking)
+        self.assertEqual((history.is_cancelled, history.is_active), (True, False))
+        self.assertFalse(RoomDailyStats.objects.exclude(revenue=0).exists())
+
+        # Удаление отмененной брони не освобождает ночи второй раз, пересчет с нуля ее не учитывает
+        Bookings.objects.get(pk=booking.pk).delete()
+        self.assertFalse(RoomNight.objects.filter(booked__lt=0).exists())
+        rebuild_room_nights()
+        self.assertFalse(RoomNight.objects.exists())
+        book_room(**booking_args(self.owner, self.room, people=1))
+        self.assertEqual(set(RoomNight.objects.values_list('booked', flat=True)), {1})
+
+    def test_cancel_view(self):
+        booking = book_room(**booking_args(self.owner, self.room))
+        history = BookingHistory.objects.get(booking=booking)
+        url = reverse('cancel_booking', args=[history.pk])
+        other = User.objects.create_user(username='other', email='other@test.ru', password='pass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(url).status_code, 404)
+        self.client.force_login(self.owner)
+        self.assertRedirects(self.client.post(url), reverse('profile'), fetch_redirect_response=False)
+        self.assertIsNotNone(Bookings.objects.get(pk=booking.pk).cancelled_at)
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, 'Отменено')
+        self.assertEqual(response.context['stats']['spent'], 0)
+
+
+def booking_args(user, room, **kwargs):
+    return dict(dict(user=user, room_id=room.pk, datefrom=date(2025, 6, 12), dateto=date(2025, 6, 15), people=2,
+                     name='Иван', surname='Иванов', idoc_series=4510, idoc_number=123456), **kwargs)
+
+
+class BookRoomTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='guest', email='guest@test.ru', password='pass')
+        cls.hotel = make_catalog(1, cls.user, HotelStatus.objects.create(name='Активен'))[0]
+        cls.room = cls.hotel.hotel_room_set.get()
+
+    def test_booking_writes_history_and_nights(self):
+        booking = book_room(**booking_args(self.user, self.room))
+        history = BookingHistory.objects.get()
+        self.assertEqual((history.room_id, history.price), (self.room.pk, self.room.price * 3))
+        self.assertEqual(booking.hotel_id, self.hotel.pk)
+        self.assertEqual(RoomNight.objects.filter(room=self.room, booked=1).count(), 3)
+
+    def test_idempotency_key_prevents_duplicates(self):
+        first = book_room(**booking_args(self.user, self.room, idempotency_key='abc'))
+        second = book_room(**booking_args(self.user, self.room, idempotency_key='abc'))
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(BookingHistory.objects.count(), 1)
+
+    def test_room_lock_is_taken_before_any_read(self):
+        # В InnoDB снимок REPEATABLE READ открывает первое обычное чтение: до блокировки номера читать нельзя
+        with CaptureQueriesContext(connection) as queries:
+            book_room(**booking_args(self.user, self.room, idempotency_key='order'))
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertIn('"main_hotel_room"', selects[0])
+        self.assertIn('"idempotency_key"', selects[1])
+        self.assertIn('"main_roomnight"', selects[2])
+
+    def test_no_overbooking(self):
+        for _ in range(self.room.free_count):
+            book_room(**booking_args(self.user, self.room))
+        with self.assertRaises(BookingError):
+            book_room(**booking_args(self.user, self.room, datefrom=date(2025, 6, 14), dateto=date(2025, 6, 20)))
+        book_room(**booking_args(self.user, self.room, datefrom=date(2025, 6, 15), dateto=date(2025, 6, 20)))
+
+    def test_booking_form_post(self):
+        self.client.force_login(self.user)
+        data = {'check_in': '2025-06-12', 'check_out': '2025-06-15', 'guests': 2, 'name': 'Иван',
+                'surname': 'Иванов', 'idoc_series': 4510, 'idoc_number': 123456, 'idempotency_key': 'form-1'}
+        url = reverse('bookroom_detail', args=[self.room.pk])
+        self.assertRedirects(self.client.post(url, data), reverse('profile'), fetch_redirect_response=False)
+        self.client.post(url, data)
+        self.assertEqual(Bookings.objects.count(), 1)
+        self.assertRedirects(self.client.post(url, dict(data, guests=5, idempotency_key='form-2')), url, fetch_redirect_response=False)
+
+    def test_rendered_form_posted_twice_books_once(self):
+        self.client.force_login(self.user)
+        url = reverse('bookroom_detail', args=[self.room.pk])
+        # Ключ берется из отрисованной формы, как его отправит браузер; у каждого показа - свой
+        html = self.client.get(url).content.decode()
+        key = re.search(r'name="idempotency_key" value="([0-9a-f]{32})"', html).group(1)
+        self.assertNotEqual(self.client.get(url).context['idempotency_key'], key)
+        data = {'check_in': '2025-06-12', 'check_out': '2025-06-15', 'guests': 2, 'name': 'Иван',
+                'surname': 'Иванов', 'idoc_series': 4510, 'idoc_number': 123456, 'idempotency_key': key}
+        self.client.post(url, data)
+        self.client.post(url, data)
+        self.assertEqual(Bookings.objects.count(), 1)
+
+    def test_integrity_error_is_reported_not_raised(self):
+        self.client.force_login(self.user)
+        url = reverse('bookroom_detail', args=[self.room.pk])
+        data = {'check_in': '2025-06-12', 'check_out': '2025-06-15', 'guests': 2, 'idoc_series': 4510,
+                'idoc_number': 123456}
+        with mock.patch('main.views.book_room', side_effect=IntegrityError):
+            response = self.client.post(url, data)
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+    attempts = 300
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='guest', email='guest@test.ru', password='pass')
+        hotel = make_catalog(1, self.user, HotelStatus.objects.create(name='Активен'))[0]
+        self.room = hotel.hotel_room_set.get()
+        Hotel_Room.objects.filter(pk=self.room.pk).update(free_count=5)
+
+    def attempt(self, index, key=None):
+        try:
+            return book_room(**booking_args(self.user, self.room, idempotency_key=key)).pk
+        except BookingError:
+            return None
+        finally:
+            connection.close()
+
+    def run_parallel(self, keys):
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            return list(pool.map(self.attempt, range(len(keys)), keys))
+
+    def test_parallel_bookings_do_not_overbook(self):
+        results = self.run_parallel([None] * self.attempts)
+        self.assertEqual(len([pk for pk in results if pk]), 5)
+        self.assertEqual(Bookings.objects.count(), 5)
+        self.assertEqual(BookingHistory.objects.count(), 5)
+        self.assertEqual(set(RoomNight.objects.values_list('booked', flat=True)), {5})
+
+    def test_parallel_retries_with_same_key_create_one_booking(self):
+        results = self.run_parallel(['retry'] * 50)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(Bookings.objects.count(), 1)
+
+
+def png_upload(name='photo.png', size=(2400, 1600)):
+    buffer = BytesIO()
+    Image.new('RGBA', size, (200, 120, 40, 255)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotel = make_catalog(1, cls.owner, HotelStatus.objects.create(name='Активен'))[0]
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_derivatives_sizes_and_srcset(self):
+        photo = Files.objects.create(user=self.owner, hotel=self.hotel, file=png_upload())
+        derivatives = make_derivatives(photo)
+        self.assertEqual(derivatives['card']['webp']['width'], 480)
+        self.assertEqual(derivatives['gallery']['jpeg']['height'], 640)
+        self.assertEqual(derivatives['full']['jpeg']['width'], 1920)
+        self.assertIn('/card.webp 480w', photo.srcset)
+        self.assertIn('/full.jpeg 1920w', photo.jpeg_srcset)
+        self.assertTrue(photo.display_url.endswith('/full.jpeg'))
+
+    def test_upload_creates_derivatives(self):
+        self.client.force_login(self.owner)
+        self.client.post(reverse('client_add_photo'), {'image': png_upload(), 'hotel_id': self.hotel.pk,
+                                                       'is_primary': 'on'})
+        photo = Files.objects.filter(room=None).latest('pk')
+        self.assertEqual(photo.derivatives, {})
+        self.assertEqual(run_pending(), 1)
+        photo.refresh_from_db()
+        self.assertEqual(set(photo.derivatives), {'card', 'gallery', 'full'})
+        self.assertContains(self.client.get(reverse('hotel', args=[self.hotel.pk])), photo.srcset)
+
+
+calls = []
+
+
+@job('test_flaky')
+def flaky(fail_times):
+    calls.append(fail_times)
+    if len(calls) <= fail_times:
+        raise RuntimeError('временная ошибка')
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_retry_with_backoff_then_success(self):
+        queued = enqueue('test_flaky', fail_times=1)
+        self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Job.PENDING, 1))
+        self.assertIn('временная ошибка', queued.last_error)
+        self.assertGreater(queued.run_at, timezone.now() + backoff(1) / 2)
+        # Пока не наступило время повтора, задача не выполняется
+        self.assertEqual(run_pending(), 0)
+        Job.objects.filter(pk=queued.pk).update(run_at=queued.created_at)
+        self.assertEqual(run_pending(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.last_error), (Job.DONE, 2, ''))
+
+    def test_gives_up_after_max_attempts(self):
+        queued = enqueue('test_flaky', max_attempts=1, fail_times=5)
+        run_pending()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.FAILED)
+
+    def test_booking_email_is_sent_from_worker(self):
+        user = User.objects.create_user(username='guest', email='guest@test.ru', password='pass')
+        room = make_catalog(1, user, HotelStatus.objects.create(name='Активен'))[0].hotel_room_set.get()
+        book_room(**booking_args(user, room, idempotency_key='k'))
+        book_room(**booking_args(user, room, idempotency_key='k'))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(mail.outbox[0].to, ['guest@test.ru'])
+
+
+@override_settings(FILE_UPLOAD_HANDLERS=['django.core.files.uploadhandler.TemporaryFileUploadHandler'])
+class BulkUploadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotel = make_catalog(1, cls.owner, HotelStatus.objects.create(name='Активен'))[0]
+        cls.room = cls.hotel.hotel_room_set.get()
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.owner)
+
+    def test_room_batch_upload_uses_constant_queries(self):
+        photos = [png_upload(f'upload{i}.png', size=(40, 30)) for i in range(60)]
+        url = reverse('room_add_photo', args=[self.room.pk])
+        # сессия, пользователь, отель, номер, savepoint, UPDATE основного фото, INSERT Files, INSERT Job,
+        # UPDATE updated_at отеля и номера, release
+        with self.assertNumQueries(11):
+            self.client.post(url, {'photos': photos, 'hotel_id': self.hotel.pk, 'room_id': self.room.pk,
+                                   'primary_photo_index': 3})
+        uploaded = Files.objects.filter(room=self.room, file__startswith='files/upload').order_by('pk')
+        self.assertEqual(uploaded.count(), 60)
+        self.assertEqual([photo.pk for photo in uploaded.filter(is_primary=True)], [uploaded[3].pk])
+        self.assertFalse(Files.objects.filter(file=f'files/r{self.room.pk}.png', is_primary=True).exists())
+        self.assertEqual(Job.objects.filter(name='make_derivatives').count(), 60)
+
+    def test_hotel_upload_keeps_room_primary_photo(self):
+        save_photos(self.owner, self.hotel, None, [png_upload('hotel.png')], primary_index=0)
+        self.assertTrue(Files.objects.filter(room=self.room, is_primary=True).exists())
+        self.assertEqual(Files.objects.filter(hotel=self.hotel, room__isnull=True, is_primary=True).count(), 1)
+
+    def test_upload_refreshes_cards_and_etags(self):
+        Files.objects.filter(hotel=self.hotel, room__isnull=True).delete()
+        search_cache.cache().clear()
+        fragment_cache.cache().clear()
+        self.assertContains(self.client.get(reverse('hotels')), 'Нет фото')
+        room_url = reverse('api_room', args=[self.room.pk])
+        etag = self.client.get(room_url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            save_photos(self.owner, self.hotel, None, [png_upload('hotel.png')], primary_index=0)
+            save_photos(self.owner, self.hotel, self.room, [png_upload('room.png')], primary_index=0)
+        self.assertNotContains(self.client.get(reverse('hotels')), 'Нет фото')
+        self.assertEqual(self.client.get(room_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_hotel_upload_accepts_several_files(self):
+        self.client.post(reverse('client_add_photo'), {'image': [png_upload('a.png'), png_upload('b.png')],
+                                                       'hotel_id': self.hotel.pk, 'is_primary': '1'})
+        uploaded = Files.objects.filter(room=None, file__contains='files/a')
+        self.assertTrue(uploaded.get().is_primary)
+        self.assertEqual(Files.objects.filter(hotel=self.hotel, room=None, is_primary=True).count(), 1)
+        self.assertTrue(Files.objects.filter(room=self.room, is_primary=True).exists())
+
+
+class KeysetPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        status = HotelStatus.objects.create(name='Активен')
+        hotels = make_catalog(23, owner, status)
+        # Одинаковые цены и звезды проверяют второй ключ сортировки, отель без номеров - NULL в min_price
+        Hotel_Room.objects.filter(hotel__in=hotels[:10]).update(price=3000)
+        Hotel_Room.objects.filter(hotel=hotels[-1]).delete()
+
+    def setUp(self):
+        cache.clear()
+        search_cache.cache().clear()
+
+    def walk(self, sort):
+        seen, cursor = [], None
+        while True:
+            params = {'sort': sort, **({'cursor': cursor} if cursor else {})}
+            with CaptureQueriesContext(connection) as queries:
+                page = self.client.get(reverse('hotels'), params).context['page_obj']
+            seen += [hotel.pk for hotel in page]
+            self.assertFalse([q for q in queries if 'OFFSET' in q['sql'].upper()])
+            if not page.has_next():
+                return seen
+            cursor = page.next_cursor
+
+    def test_cursor_walk_matches_full_ordering(self):
+        orderings = {
+            'name': ['name', 'pk'],
+            'stars': ['-stars', 'pk'],
+            'price_asc': [F('min_price').asc(nulls_last=True), 'pk'],
+            'price_desc': [F('min_price').desc(nulls_last=True), 'pk'],
+        }
+        for sort, ordering in orderings.items():
+            with self.subTest(sort=sort):
+                expected = list(Hotel.objects.with_room_stats().order_by(*ordering).values_list('pk', flat=True))
+                self.assertEqual(self.walk(sort), expected)
+                with mock.patch('main.search_cache.make_key', return_value=None):
+                    self.assertEqual(self.walk(sort), expected)
+
+    def test_offset_mode_and_cached_count(self):
+        response = self.client.get(reverse('hotels'), {'page': 2})
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertContains(response, 'найдено: 23')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(reverse('hotels')), 'найдено: 23')
+        self.assertFalse([q for q in queries if 'COUNT(*)' in q['sql'].upper()])
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.client.get(reverse('hotels'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['hotels']), 5)
+
+    def test_tampered_cursor_values_show_first_page(self):
+        first = list(Hotel.objects.with_room_stats().order_by('-stars', 'pk').values_list('pk', flat=True)[:5])
+        tampered = [base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+                    for payload in (['abc', 1], [[1], 1], [{}, 1], [3, 'x'], [3, True], {'a': 1}, [1, 2, 3],
+                                    ['nan', 1], ['Infinity', 1])]
+        # Даты и гео обходят кэш выдачи: курсор разбирается в SQL-условие
+        for params in ({'sort': 'stars', 'lat': 55.75, 'lon': 37.62, 'radius': 50000},
+                       {'sort': 'price_asc', 'check_in': '2030-01-01', 'check_out': '2030-01-02'},
+                       {'sort': 'stars', 'check_in': '2030-01-01', 'check_out': '2030-01-02'}):
+            for cursor in tampered:
+                with self.subTest(params=params, cursor=cursor):
+                    response = self.client.get(reverse('hotels'), dict(params, cursor=cursor))
+                    self.assertEqual(response.status_code, 200)
+                    self.assertIsNone(response.context['page_obj'].cursor)
+                    self.assertEqual(self.client.get(reverse('api_hotels'), dict(params, cursor=cursor)).status_code,
+                                     200)
+        response = self.client.get(reverse('hotels'), {'sort': 'stars', 'check_in': '2030-01-01',
+                                                       'check_out': '2030-01-02', 'cursor': tampered[0]})
+        self.assertEqual([hotel.pk for hotel in response.context['hotels']], first)
+
+
+class SearchCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.status = HotelStatus.objects.create(name='Активен')
+        cls.hotels = make_catalog(7, cls.owner, cls.status)
+
+    def setUp(self):
+        search_cache.cache().clear()
+
+    def search(self, **params):
+        return [hotel.pk for hotel in self.client.get(reverse('hotels'), params).context['hotels']]
+
+    def test_normalized_params_share_one_entry(self):
+        self.search(city='Москва', sort='stars')
+        with self.assertNumQueries(2):
+            self.search(city='  москва ', sort='stars', cursor='')
+        self.assertEqual(search_cache.stats()['hits'], 1)
+        self.assertEqual(search_cache.stats()['misses'], 1)
+        self.assertEqual(search_cache.stats()['hit_rate'], 0.5)
+
+    def test_writes_invalidate_cached_ids(self):
+        self.assertEqual(len(self.search(city='Москва', stars=1)), 2)
+        Hotel.objects.create(name='Новый', stars=1, location='', phone='', email='', city='Москва', to_center=1,
+                             about='', status=self.status, user=self.owner)
+        self.assertEqual(len(self.search(city='Москва', stars=1)), 3)
+        self.assertEqual(self.search(sort='price_asc')[0], self.hotels[0].pk)
+        Hotel_Room.objects.filter(hotel=self.hotels[0]).get().delete()
+        self.assertNotIn(self.hotels[0].pk, self.search(sort='price_asc'))
+
+    # Бюджеты рассчитаны на кэш вне БД: в таблице каждая операция кэша выдачи - свои запросы
+    @override_settings(CACHES=dict(settings.CACHES, search={'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                                            'LOCATION': 'search_cache'}),
+                       QUERY_BUDGET_STRICT=False)
+    def test_database_backend(self):
+        call_command('createcachetable', 'search_cache')
+        first = self.search(sort='name')
+        self.assertEqual(self.search(sort='name'), first)
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotels = make_catalog(30, cls.owner, HotelStatus.objects.create(name='Активен'))
+        cls.hotel = cls.hotels[0]
+        cls.room = cls.hotel.hotel_room_set.get()
+        for extra in range(10):
+            Hotel_Room.objects.create(hotel=cls.hotel, description='', name=f'Номер {extra}', max_people=2,
+                                      rooms=1, price=2000 + extra, free_count=1)
+        for _ in range(3):
+            book_room(**booking_args(cls.owner, cls.room))
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def test_pages_stay_within_budget(self):
+        pages = {
+            'hotels': reverse('hotels'),
+            'hotel': reverse('hotel', args=[self.hotel.pk]),
+            'rooms': reverse('rooms', args=[self.hotel.pk]),
+            'room_detail': reverse('room_detail', args=[self.room.pk]),
+            'bookroom_detail': reverse('bookroom_detail', args=[self.room.pk]),
+            'profile': reverse('profile'),
+            'client': reverse('client'),
+            'api_hotels': reverse('api_hotels'),
+            'api_hotel': reverse('api_hotel', args=[self.hotel.pk]),
+            'api_hotel_rooms': reverse('api_hotel_rooms', args=[self.hotel.pk]),
+            'api_room': reverse('api_room', args=[self.room.pk]),
+        }
+        for name, url in pages.items():
+            with self.subTest(page=name):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('sql;dur=', response['Server-Timing'])
+
+    def test_booking_post_within_budget(self):
+        url = reverse('bookroom_detail', args=[self.room.pk])
+        data = dict(check_in='2030-03-01', check_out='2030-03-08', guests=1, name='Иван', surname='Иванов',
+                    idoc_series=4510, idoc_number=123456)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, dict(data, idempotency_key='budget-1'))
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.assertLessEqual(len(queries), settings.QUERY_BUDGETS['bookroom_detail:POST'])
+        # Неделя стоит столько же, сколько одна ночь
+        with CaptureQueriesContext(connection) as one_night:
+            self.client.post(url, dict(data, check_out='2030-03-02', idempotency_key='budget-2'))
+        self.assertEqual(len(one_night), len(queries))
+
+    def test_stats_log_line(self):
+        with self.assertLogs('main.querystats', 'DEBUG') as logs:
+            self.client.get(reverse('hotel', args=[self.hotel.pk]))
+        stats = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(logs.records[-1].levelname, 'DEBUG')
+        self.assertEqual(stats['view'], 'hotel')
+        self.assertGreater(stats['queries'], 0)
+        self.assertGreater(stats['render_ms'], 0)
+        self.assertGreater(stats['app_ms'], 0)
+        self.assertEqual(stats['pool_wait_ms'], 0)
+        self.assertLessEqual(stats['sql_ms'] + stats['render_ms'] + stats['app_ms'], stats['total_ms'] + 0.05)
+        # Функция-view с render() тоже получает время рендеринга
+        with self.assertLogs('main.querystats', 'DEBUG') as logs:
+            response = self.client.get(reverse('profile'))
+        self.assertGreater(json.loads(logs.records[-1].getMessage())['render_ms'], 0)
+        self.assertIn('render;dur=', response['Server-Timing'])
+        # В JSON API шаблонов нет
+        with self.assertLogs('main.querystats', 'DEBUG') as logs:
+            self.client.get(reverse('api_hotel', args=[self.hotel.pk]))
+        self.assertEqual(json.loads(logs.records[-1].getMessage())['render_ms'], 0)
+
+    def test_budgets_are_strict_in_tests(self):
+        # Превышение бюджета в любом тесте - ошибка, а не строка в логе
+        self.assertTrue(settings.QUERY_BUDGET_STRICT)
+
+    @override_settings(QUERY_BUDGETS={'hotel': 1})
+    def test_exceeded_budget_fails(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('hotel', args=[self.hotel.pk]))
+
+
+class RatingAggregatesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.status = HotelStatus.objects.create(name='Активен')
+        cls.hotels = make_catalog(3, cls.owner, cls.status)
+
+    def setUp(self):
+        search_cache.cache().clear()
+
+    def review(self, hotel, stars):
+        return Review.objects.create(text='', hotel=hotel, room=hotel.hotel_room_set.first(), stars=stars)
+
+    def stats(self, hotel):
+        return Hotel.objects.values_list('review_count', 'rating_sum', 'rating').get(pk=hotel.pk)
+
+    def test_reviews_update_aggregates_incrementally(self):
+        hotel, other = self.hotels[0], self.hotels[1]
+        first = self.review(hotel, 5)
+        second = self.review(hotel, 4)
+        self.assertEqual(self.stats(hotel), (2, 9, Decimal('4.5')))
+
+        second.stars = 2
+        second.save()
+        self.assertEqual(self.stats(hotel), (2, 7, Decimal('3.5')))
+
+        second.hotel = other
+        second.save()
+        self.assertEqual(self.stats(hotel), (1, 5, Decimal('5.0')))
+        self.assertEqual(self.stats(other), (1, 2, Decimal('2.0')))
+
+        first.delete()
+        self.assertEqual(self.stats(hotel), (0, 0, Decimal('0.0')))
+        self.assertEqual(Hotel.objects.get(pk=hotel.pk).rating_score, 0)
+
+    def test_hotel_save_keeps_fresh_aggregates(self):
+        hotel = Hotel.objects.get(pk=self.hotels[0].pk)
+        self.review(hotel, 5)
+        hotel.about = 'Новое описание'
+        hotel.save()
+        self.assertEqual(self.stats(hotel), (1, 5, Decimal('5.0')))
+
+    def test_rebuild_matches_incremental(self):
+        for stars in (5, 5, 3):
+            self.review(self.hotels[0], stars)
+        self.review(self.hotels[1], 1)
+        expected = list(Hotel.objects.order_by('pk').values_list(*Hotel.RATING_FIELDS))
+        Hotel.objects.update(review_count=0, rating_sum=0, rating=0, rating_score=0)
+
+        self.assertEqual(rebuild_ratings(), 3)
+        self.assertEqual(list(Hotel.objects.order_by('pk').values_list(*Hotel.RATING_FIELDS)), expected)
+
+    def test_rating_sort_and_filter_use_columns(self):
+        # Один отзыв на 5 весит меньше десятка отзывов на 4.6 - байесовская оценка
+        self.review(self.hotels[0], 5)
+        for stars in (5, 5, 5, 5, 5, 5, 4, 4, 4, 4):
+            self.review(self.hotels[1], stars)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('hotels'), {'sort': 'rating'})
+        self.assertEqual([hotel.pk for hotel in response.context['hotels']],
+                         [self.hotels[1].pk, self.hotels[0].pk, self.hotels[2].pk])
+        self.assertFalse(any('main_review' in query['sql'] for query in queries))
+
+        response = self.client.get(reverse('hotels'), {'sort': 'rating', 'min_rating': '4.7'})
+        self.assertEqual([hotel.pk for hotel in response.context['hotels']], [self.hotels[0].pk])
+
+    def test_min_rating_ignores_garbage_and_clamps(self):
+        self.review(self.hotels[0], 5)
+        self.review(self.hotels[1], 4)
+        self.review(self.hotels[1], 5)
+        everything = sorted(hotel.pk for hotel in self.hotels)
+
+        def found(min_rating):
+            response = self.client.get(reverse('hotels'), {'min_rating': min_rating})
+            self.assertEqual(response.status_code, 200)
+            return sorted(hotel.pk for hotel in response.context['hotels'])
+
+        for value in ('nan', 'NaN', 'sNaN', 'inf', '-Infinity', 'abc', '-3'):
+            with self.subTest(value=value):
+                self.assertEqual(found(value), everything)
+                response = self.client.get(reverse('api_hotels'), {'min_rating': value})
+                self.assertEqual(len(response.json()['results']), len(everything))
+        # Выше шкалы - как 5.0; дробная граница округляется вверх: 4.51 не захватывает 4.5
+        self.assertEqual(found('7'), [self.hotels[0].pk])
+        self.assertEqual(found('1e999999999'), [self.hotels[0].pk])
+        self.assertEqual(found('4.5'), sorted([self.hotels[0].pk, self.hotels[1].pk]))
+        self.assertEqual(found('4.51'), [self.hotels[0].pk])
+
+
+class ProfileDashboardTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='guest', email='guest@test.ru', password='pass')
+        cls.hotels = make_catalog(4, cls.user, HotelStatus.objects.create(name='Активен'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def add_history(self, count, is_active):
+        BookingHistory.objects.bulk_create([
+            BookingHistory(user=self.user, hotel=hotel, room=hotel.hotel_room_set.first(), datefrom=date(2025, 1, 1),
+                           dateto=date(2025, 1, 3), price=1000, people=2, is_active=is_active)
+            for hotel in self.hotels * count
+        ])
+
+    def profile_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'), params)
+        return response, len(queries)
+
+    def test_counters_come_from_one_query(self):
+        self.add_history(1, True)
+        self.add_history(2, False)
+        BookingFavorites.objects.create(user=self.user, hotel=self.hotels[0], room=self.hotels[0].hotel_room_set.first())
+
+        response, _ = self.profile_queries()
+        self.assertEqual(response.context['stats'], {'active': 4, 'inactive': 8, 'favorites': 1, 'spent': 12000})
+        self.assertContains(response, '12000 руб.')
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_history(1, True)
+        self.add_history(1, False)
+        BookingFavorites.objects.create(user=self.user, hotel=self.hotels[0], room=self.hotels[0].hotel_room_set.first())
+        _, few = self.profile_queries()
+
+        self.add_history(10, True)
+        self.add_history(50, False)
+        response, many = self.profile_queries(history_page=3)
+        self.assertEqual(many, few)
+        self.assertLessEqual(many, settings.QUERY_BUDGETS['profile'])
+        self.assertEqual(response.context['inactive_bookings'].number, 3)
+        self.assertEqual(len(response.context['active_bookings']), 10)
+
+    def test_hotel_card_skips_room_photos(self):
+        self.add_history(1, True)
+        hotel = self.hotels[0]
+        # У отеля нет своего основного фото - основное фото номера не должно попасть в карточку
+        Files.objects.filter(hotel=hotel, room__isnull=True).delete()
+        response, _ = self.profile_queries()
+        self.assertNotContains(response, f'r{hotel.hotel_room_set.get().pk}.png')
+        self.assertContains(response, f'h{self.hotels[1].pk}.png')
+
+
+class OwnerStatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotels = make_catalog(2, cls.owner, HotelStatus.objects.create(name='Активен'))
+        cls.room = cls.hotels[0].hotel_room_set.get()
+
+    def history(self, datefrom, dateto, price, room=None):
+        room = room or self.room
+        return BookingHistory.objects.create(user=self.owner, hotel_id=room.hotel_id, room=room, datefrom=datefrom,
+                                             dateto=dateto, price=price, people=1)
+
+    def room_rows(self):
+        return list(RoomDailyStats.objects.order_by('room_id', 'date')
+                    .values_list('room_id', 'date', 'bookings', 'nights_sold', 'revenue'))
+
+    def hotel_rows(self):
+        return list(HotelDailyStats.objects.order_by('hotel_id', 'date')
+                    .values_list('hotel_id', 'date', 'bookings', 'nights_sold', 'revenue'))
+
+    def test_history_writes_update_rollups(self):
+        booking = self.history(date(2025, 3, 1), date(2025, 3, 4), 1000)
+        self.assertEqual(self.room_rows(), [
+            (self.room.pk, date(2025, 3, 1), 1, 1, 334),
+            (self.room.pk, date(2025, 3, 2), 0, 1, 333),
+            (self.room.pk, date(2025, 3, 3), 0, 1, 333),
+        ])
+        self.history(date(2025, 3, 2), date(2025, 3, 3), 500)
+        self.assertEqual(self.hotel_rows()[1], (self.room.hotel_id, date(2025, 3, 2), 1, 2, 833))
+
+        booking.dateto = date(2025, 3, 2)
+        booking.save()
+        self.assertEqual(self.room_rows(), [
+            (self.room.pk, date(2025, 3, 1), 1, 1, 1000),
+            (self.room.pk, date(2025, 3, 2), 1, 1, 500),
+            (self.room.pk, date(2025, 3, 3), 0, 0, 0),
+        ])
+
+        booking.delete()
+        self.assertEqual(sum(row[4] for row in self.hotel_rows()), 500)
+
+    def test_rebuild_matches_incremental(self):
+        other = self.hotels[1].hotel_room_set.get()
+        self.history(date(2025, 3, 30), date(2025, 4, 2), 3100)
+        self.history(date(2025, 3, 31), date(2025, 4, 1), 700)
+        self.history(date(2025, 4, 1), date(2025, 4, 5), 999, room=other)
+        # Завершенная бронь остается в выручке, отмененная - нет, и при пересчете тоже
+        completed = self.history(date(2025, 4, 2), date(2025, 4, 3), 400, room=other)
+        completed.is_active = False
+        completed.save()
+        cancelled = self.history(date(2025, 4, 3), date(2025, 4, 4), 5000, room=other)
+        cancelled.is_cancelled = True
+        cancelled.save()
+        rooms, hotels = self.room_rows(), self.hotel_rows()
+        self.assertEqual(sum(row[4] for row in hotels), 3100 + 700 + 999 + 400)
+
+        call_command('rebuild_stats', stdout=StringIO())
+        self.assertEqual(self.room_rows(), rooms)
+        self.assertEqual(self.hotel_rows(), hotels)
+
+    def test_owner_pages_read_rollups(self):
+        today = timezone.localdate()
+        self.history(today, today + timedelta(days=2), 4000)
+        self.client.force_login(self.owner)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('rooms', args=[self.hotels[0].pk]))
+        self.assertFalse(any('main_bookinghistory' in query['sql'] for query in queries))
+        self.assertEqual(response.context['booked_rooms'], 1)
+        room = response.context['rooms'][0]
+        self.assertEqual(room.bookings_count, 1)
+        self.assertGreater(room.occupancy_rate, 0)
+        if (today + timedelta(days=1)).month == today.month:
+            self.assertEqual(response.context['total_revenue'], 4000)
+
+        response = self.client.get(reverse('client'))
+        self.assertEqual(response.context['stats']['bookings_total'], 1)
+        self.assertEqual(response.context['total_hotels'], 2)
+
+
+class JsonApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotels = make_catalog(5, cls.owner, HotelStatus.objects.create(name='Активен'))
+        cls.hotel = cls.hotels[0]
+        cls.room = cls.hotel.hotel_room_set.get()
+
+    def setUp(self):
+        search_cache.cache().clear()
+
+    def test_search_pages_with_cursor(self):
+        response = self.client.get(reverse('api_hotels'), {'sort': 'price_desc', 'limit': 3})
+        data = response.json()
+        self.assertEqual([row['id'] for row in data['results']], [hotel.pk for hotel in self.hotels[:-4:-1]])
+        self.assertEqual(data['results'][0]['photo']['url'], Files.objects.get(hotel=self.hotels[-1], room=None,
+                                                                                is_primary=True).file.url)
+
+        data = self.client.get(reverse('api_hotels'), {'sort': 'price_desc', 'limit': 3,
+                                                       'cursor': data['next_cursor']}).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.hotels[1].pk, self.hotels[0].pk])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_detail_endpoints(self):
+        data = self.client.get(reverse('api_hotel', args=[self.hotel.pk])).json()
+        self.assertEqual((data['name'], data['min_price'], len(data['photos'])), (self.hotel.name, self.room.price, 2))
+        data = self.client.get(reverse('api_hotel_rooms', args=[self.hotel.pk])).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.room.pk])
+        data = self.client.get(reverse('api_room', args=[self.room.pk])).json()
+        self.assertEqual((data['hotel_name'], len(data['photos'])), (self.hotel.name, 1))
+        self.assertEqual(self.client.get(reverse('api_hotel_rooms', args=[0])).status_code, 404)
+
+    def test_unchanged_resource_returns_304_after_one_query(self):
+        url = reverse('api_hotel', args=[self.hotel.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        # Только updated_at отеля, без выборки самого ответа
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.hotel.about = 'Обновлено'
+        self.hotel.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['about'], 'Обновлено')
+
+    def test_etag_follows_updated_at_not_process_cache(self):
+        urls = [reverse('api_hotel_rooms', args=[self.hotel.pk]), reverse('api_room', args=[self.room.pk])]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        # Версия кэша выдачи локальна для процесса: ее сброс или рост не меняет ETag отеля и номера
+        search_cache.cache().clear()
+        search_cache.bump_version()
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Изменение номера двигает updated_at отеля и номера
+        self.room.price += 100
+        self.room.save()
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_etag_follows_cached_ids(self):
+        url = reverse('api_hotels')
+        etag = self.client.get(url)['ETag']
+        # Повтор обслуживается кэшем выдачи целиком, без запросов к БД
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # ETag и тело строятся по одному списку id: подмена списка в кэше меняет оба
+        key = search_cache.make_key(QueryDict(), SearchHotel.sorts)
+        ids = search_cache.cache().get(key)
+        search_cache.cache().set(key, ids[:2], search_cache.TIMEOUT)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['results']], ids[:2])
+
+        # Изменение и удаление отеля двигают версию выдачи
+        etag = response['ETag']
+        self.room.price += 100
+        self.room.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        Hotel.objects.exclude(pk=self.hotel.pk).first().delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_geo_search_has_no_etag(self):
+        response = self.client.get(reverse('api_hotels'), {'lat': 55.75, 'lon': 37.62})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_date_search_has_no_etag(self):
+        response = self.client.get(reverse('api_hotels'), {'check_in': '2025-06-01', 'check_out': '2025-06-03'})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class FragmentCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotels = make_catalog(3, cls.owner, HotelStatus.objects.create(name='Активен'))
+        cls.hotel = cls.hotels[0]
+        cls.room = cls.hotel.hotel_room_set.get()
+
+    def setUp(self):
+        search_cache.cache().clear()
+        fragment_cache.cache().clear()
+
+    def counts(self, fragment_type):
+        stats = fragment_cache.stats()[fragment_type]
+        return stats['hits'], stats['misses']
+
+    def test_cards_are_served_from_cache_until_row_changes(self):
+        self.client.get(reverse('hotels'))
+        self.assertEqual(self.counts('hotel_card'), (0, 3))
+        response = self.client.get(reverse('hotels'))
+        self.assertEqual(self.counts('hotel_card'), (3, 3))
+        self.assertContains(response, self.hotel.name)
+
+        hotel = Hotel.objects.get(pk=self.hotel.pk)
+        hotel.name = 'Переименован'
+        hotel.save()
+        response = self.client.get(reverse('hotels'))
+        self.assertEqual(self.counts('hotel_card'), (5, 4))
+        self.assertContains(response, 'Переименован')
+
+    def test_related_writes_touch_the_card(self):
+        self.client.get(reverse('hotel', args=[self.hotel.pk]))
+        rooms = len(self.client.get(reverse('hotel', args=[self.hotel.pk])).context['hotel_rooms'])
+        self.assertEqual(self.counts('hotel_gallery'), (1, 1))
+        self.assertEqual(self.counts('hotel_room_card'), (rooms, rooms))
+
+        # Новое фото номера меняет и карточку номера, и галерею отеля; остальные карточки остаются в кэше
+        Files.objects.create(user=self.owner, hotel=self.hotel, room=self.room, file='files/new.png')
+        self.client.get(reverse('hotel', args=[self.hotel.pk]))
+        self.assertEqual(self.counts('hotel_gallery'), (1, 2))
+        self.assertEqual(self.counts('hotel_room_card'), (2 * rooms - 1, rooms + 1))
+
+        Review.objects.create(text='', hotel=self.hotel, room=self.room, stars=5)
+        self.client.get(reverse('hotels'))
+        self.client.get(reverse('hotels'))
+        self.assertEqual(self.counts('hotel_card'), (3, 3))
+
+    def test_stats_command(self):
+        self.client.get(reverse('hotels'))
+        out = StringIO()
+        call_command('fragment_cache_stats', reset=True, stdout=out)
+        self.assertIn('hotel_card: попаданий 0, промахов 3', out.getvalue())
+        self.assertEqual(self.counts('hotel_card'), (0, 0))
+
+
+class GeoSearchTest(TestCase):
+    # Точки вокруг Красной площади: ~0.5, ~1.5, ~4 и ~30 км от центра
+    CENTER = (55.7539, 37.6208)
+    POINTS = [(55.7584, 37.6208), (55.7539, 37.6446), (55.7899, 37.6208), (56.0239, 37.6208)]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotels = make_catalog(5, cls.owner, HotelStatus.objects.create(name='Активен'))
+        for hotel, (latitude, longitude) in zip(reversed(cls.hotels), cls.POINTS):
+            hotel.latitude, hotel.longitude = latitude, longitude
+            hotel.to_center = round(geo.distance_km(*cls.CENTER, latitude, longitude), 1)
+            hotel.save()
+        # Пятый отель без координат и далеко от центра
+        Hotel.objects.filter(pk=cls.hotels[0].pk).update(to_center=10)
+        cls.nearest = [hotel.pk for hotel in reversed(cls.hotels)]
+
+    def setUp(self):
+        search_cache.cache().clear()
+
+    def search(self, **params):
+        return [hotel.pk for hotel in self.client.get(reverse('hotels'), params).context['hotels']]
+
+    def test_encode_and_cells(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744), 'u4pruydqq')
+        cells = geo.cells_around(*self.CENTER, 2)
+        self.assertEqual(len(cells), 9)
+        self.assertIn(geo.encode(*self.POINTS[1])[:len(cells[0])], cells)
+
+    def test_radius_search_sorted_by_distance(self):
+        with CaptureQueriesContext(connection) as queries:
+            found = self.search(lat=self.CENTER[0], lon=self.CENTER[1], radius=5, sort='distance')
+        self.assertEqual(found, self.nearest[:3])
+        self.assertTrue(any('"geohash" LIKE' in query['sql'] for query in queries))
+
+        self.assertEqual(self.search(lat=self.CENTER[0], lon=self.CENTER[1], radius=1, sort='distance'),
+                         self.nearest[:1])
+        # Курсор следующей страницы по расстоянию
+        response = self.client.get(reverse('api_hotels'), {'lat': self.CENTER[0], 'lon': self.CENTER[1],
+                                                           'radius': 50, 'sort': 'distance', 'limit': 2})
+        data = response.json()
+        self.assertEqual([row['id'] for row in data['results']], self.nearest[:2])
+        self.assertLess(data['results'][0]['distance_km'], 1)
+        data = self.client.get(reverse('api_hotels'), {'lat': self.CENTER[0], 'lon': self.CENTER[1], 'radius': 50,
+                                                       'sort': 'distance', 'limit': 2,
+                                                       'cursor': data['next_cursor']}).json()
+        self.assertEqual([row['id'] for row in data['results']], self.nearest[2:4])
+
+    def test_bbox_and_to_center_filters(self):
+        self.assertEqual(sorted(self.search(bbox='55.75,37.60,55.76,37.65')), sorted(self.nearest[:2]))
+        self.assertEqual(self.search(max_to_center=2, sort='to_center'), self.nearest[:2])
+        # Без точки сортировка по расстоянию откатывается на сортировку по названию
+        self.assertEqual(len(self.search(sort='distance')), 5)
+
+    def test_backfill_from_csv(self):
+        hotel = self.hotels[0]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write(f'id,latitude,longitude\n{hotel.pk},59.9343,30.3351\n')
+        call_command('backfill_geo', csv=source.name, stdout=StringIO())
+        hotel.refresh_from_db()
+        self.assertEqual(hotel.geohash, geo.encode(59.9343, 30.3351))
+        self.assertEqual(self.search(lat=59.9343, lon=30.3351, radius=1), [hotel.pk])
+
+
+class FullTextSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        status = HotelStatus.objects.create(name='Активен')
+        hotel = dict(location='', phone='', email='', to_center=1, status=status, user=owner)
+        cls.sea = Hotel.objects.create(name='Морской бриз', stars=4, city='Сочи',
+                                       about='Отель у моря с собственным пляжем', **hotel)
+        cls.spa = Hotel.objects.create(name='Гранд Отель', stars=5, city='Москва',
+                                       about='Тихий отель в центре, рядом с морем магазинов', **hotel)
+        cls.forest = Hotel.objects.create(name='Лесная сказка', stars=3, city='Сочи', about='Домики в лесу', **hotel)
+        cls.pool = Comfort.objects.create(name='Бассейн')
+        Hotel_Comfort.objects.create(hotel=cls.spa, comfort=cls.pool)
+        Hotel_Comfort.objects.create(hotel=cls.forest, comfort=cls.pool)
+        cls.suite = Hotel_Room.objects.create(hotel=cls.forest, name='Семейный', description='Камин и вид на озеро',
+                                              max_people=4, rooms=2, price=7000, free_count=1)
+        Hotel_Room.objects.create(hotel=cls.sea, name='Стандарт', description='', max_people=2, rooms=1,
+                                  price=3000, free_count=1)
+
+    def setUp(self):
+        search_cache.cache().clear()
+
+    def search(self, **params):
+        return [hotel.pk for hotel in self.client.get(reverse('hotels'), params).context['hotels']]
+
+    def test_tokenize_russian_and_english(self):
+        self.assertEqual(fulltext.tokenize('Отели у МОРЯ, ёлки'), ['отел', 'мор', 'елк'])
+        self.assertEqual(fulltext.tokenize('Rooms with pools'), ['room', 'pool'])
+        self.assertEqual(fulltext.tokenize('отель'), fulltext.tokenize('отелей'))
+
+    def test_ranked_search_over_all_fields(self):
+        # Слово в названии весит больше, чем в описании
+        self.assertEqual(self.search(name='море'), [self.sea.pk, self.spa.pk])
+        self.assertEqual(self.search(name='озеро'), [self.forest.pk])
+        self.assertEqual(sorted(self.search(name='бассейн')), sorted([self.spa.pk, self.forest.pk]))
+        # Все слова обязательны, последнее - по началу слова
+        self.assertEqual(self.search(name='бассейн лес'), [self.forest.pk])
+        self.assertEqual(self.search(name='гранд от'), [self.spa.pk])
+        self.assertIn('LIKE', str(SearchPosting.objects.filter(fulltext.term_condition('я', True)).query))
+        self.assertEqual(self.search(name='бассейн пляж'), [])
+        self.assertEqual(self.search(name='море', sort='name'), [self.spa.pk, self.sea.pk])
+
+    def test_filters_apply_inside_search(self):
+        self.assertEqual(self.search(name='море', stars=5), [self.spa.pk])
+        self.assertEqual(self.search(name='море', city='соч'), [self.sea.pk])
+        self.assertEqual(self.search(name='бассейн', min_price=5000), [self.forest.pk])
+        data = self.client.get(reverse('api_hotels'), {'name': 'море', 'limit': 1}).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.sea.pk])
+        data = self.client.get(reverse('api_hotels'), {'name': 'море', 'cursor': data['next_cursor']}).json()
+        self.assertEqual([row['id'] for row in data['results']], [self.spa.pk])
+
+    def test_index_follows_changes(self):
+        self.suite.description = 'Вид на горы'
+        self.suite.save()
+        self.assertEqual(self.search(name='озеро'), [])
+        self.assertEqual(self.search(name='горы'), [self.forest.pk])
+
+        # Повторное сохранение без изменений текста ничего не пишет в индекс
+        with CaptureQueriesContext(connection) as queries:
+            self.forest.save()
+        self.assertFalse([query for query in queries if 'main_searchposting' in query['sql']
+                          and query['sql'].startswith(('INSERT', 'DELETE'))])
+
+        self.pool.name = 'Аквапарк'
+        self.pool.save()
+        self.assertEqual(self.search(name='бассейн'), [])
+        Hotel_Comfort.objects.filter(hotel=self.spa).delete()
+        self.assertEqual(self.search(name='аквапарк'), [self.forest.pk])
+
+        self.forest.delete()
+        self.assertFalse(SearchPosting.objects.filter(hotel_id=self.forest.pk).exists())
+        SearchPosting.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search(name='море'), [self.sea.pk, self.spa.pk])
+
+
+class ComfortFacetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotels = make_catalog(4, owner, HotelStatus.objects.create(name='Активен'))
+        cls.pool, cls.parking, cls.wifi = [Comfort.objects.create(name=name)
+                                           for name in ('Бассейн', 'Парковка', 'Wi-Fi')]
+        # Бассейн у 0, 1, 2; парковка у 1, 2; wi-fi у 2, 3
+        for comfort, indexes in ((cls.pool, (0, 1, 2)), (cls.parking, (1, 2)), (cls.wifi, (2, 3))):
+            for index in indexes:
+                Hotel_Comfort.objects.create(hotel=cls.hotels[index], comfort=comfort)
+
+    def setUp(self):
+        search_cache.cache().clear()
+
+    def search(self, **params):
+        response = self.client.get(reverse('hotels'), params)
+        found = sorted(hotel.pk for hotel in response.context['hotels'])
+        return found, {name: count for _, name, count in response.context['facets']}
+
+    def ids(self, *indexes):
+        return sorted(self.hotels[index].pk for index in indexes)
+
+    def test_cached_bitmaps_expire(self):
+        self.assertEqual(len(facets.bitmaps()), 3)
+        # Изменение, о котором этот процесс не знает (версия выросла в кэше другого воркера)
+        ComfortBitmap.objects.filter(comfort=self.wifi).delete()
+        self.assertEqual(len(facets.bitmaps()), 3)
+        with mock.patch('django.core.cache.backends.locmem.time.time',
+                        return_value=time.time() + search_cache.TIMEOUT + 1):
+            self.assertEqual(len(facets.bitmaps()), 2)
+
+    def test_bitmaps_follow_links(self):
+        bitmap = ComfortBitmap.objects.get(comfort=self.pool)
+        self.assertEqual(bitmap.hotels, 3)
+        self.assertEqual(facets.counts([hotel.pk for hotel in self.hotels]),
+                         [(self.wifi.pk, 'Wi-Fi', 2), (self.pool.pk, 'Бассейн', 3), (self.parking.pk, 'Парковка', 2)])
+
+        Hotel_Comfort.objects.filter(hotel=self.hotels[0], comfort=self.pool).delete()
+        self.assertEqual(ComfortBitmap.objects.get(comfort=self.pool).hotels, 2)
+        link = Hotel_Comfort.objects.get(hotel=self.hotels[3], comfort=self.wifi)
+        link.hotel = self.hotels[0]
+        link.save()
+        self.assertEqual(facets.counts([self.hotels[0].pk, self.hotels[3].pk])[0], (self.wifi.pk, 'Wi-Fi', 1))
+
+        self.hotels[2].delete()
+        self.assertEqual(ComfortBitmap.objects.get(comfort=self.parking).hotels, 1)
+        self.parking.delete()
+        self.assertEqual([name for _, name, _ in facets.bitmaps()], ['Wi-Fi', 'Бассейн'])
+
+        ComfortBitmap.objects.all().delete()
+        call_command('rebuild_facets', stdout=StringIO())
+        self.assertEqual(ComfortBitmap.objects.get(comfort=self.pool).hotels, 1)
+
+    def test_and_filter_with_live_counts(self):
+        found, counts = self.search()
+        self.assertEqual(counts, {'Wi-Fi': 2, 'Бассейн': 3, 'Парковка': 2})
+
+        found, counts = self.search(comfort=[self.pool.pk])
+        self.assertEqual(found, self.ids(0, 1, 2))
+        self.assertEqual(counts, {'Wi-Fi': 1, 'Бассейн': 3, 'Парковка': 2})
+
+        found, counts = self.search(comfort=[self.wifi.pk, self.pool.pk, self.parking.pk])
+        self.assertEqual(found, self.ids(2))
+        self.assertEqual(counts, {'Wi-Fi': 1, 'Бассейн': 1, 'Парковка': 1})
+
+        # Счетчики учитывают и остальные фильтры, в том числе некэшируемые (даты)
+        found, counts = self.search(comfort=[self.pool.pk], stars=self.hotels[1].stars)
+        self.assertEqual((found, counts['Бассейн']), (self.ids(1), 1))
+        found, counts = self.search(comfort=[self.parking.pk], check_in='2030-01-01', check_out='2030-01-03')
+        self.assertEqual((found, counts['Wi-Fi']), (self.ids(1, 2), 1))
+
+        data = self.client.get(reverse('api_hotels'), {'comfort': [self.wifi.pk, self.pool.pk]}).json()
+        self.assertEqual([row['id'] for row in data['results']], self.ids(2))
+
+    def test_facets_cached_with_search_ids(self):
+        self.search(comfort=[self.pool.pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.search(comfort=[self.pool.pk])
+        self.assertFalse([query for query in queries if 'main_comfortbitmap' in query['sql']
+                          or 'main_hotel_comfort' in query['sql']])
+
+    def test_uncached_search_selects_ids_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            found, counts = self.search(comfort=[self.pool.pk], check_in='2030-01-01', check_out='2030-01-03')
+        self.assertEqual((found, counts['Парковка']), (self.ids(0, 1, 2), 2))
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT "main_hotel"."id" AS "pk" FROM')]),
+                         1)
+
+
+class HotelPageLoaderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotels = make_catalog(6, cls.owner, HotelStatus.objects.create(name='Активен'))
+        cls.hotel = cls.hotels[0]
+        pool = Comfort.objects.create(name='Бассейн')
+        for hotel in cls.hotels[:3]:
+            Hotel_Comfort.objects.create(hotel=hotel, comfort=pool)
+        Hotel.objects.filter(pk=cls.hotels[5].pk).update(city='Казань', city_search='казань')
+        similar.rebuild_neighbors()
+
+    def page_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries)
+
+    def test_detail_loads_only_this_hotel(self):
+        url = reverse('hotel', args=[self.hotel.pk])
+        response, before = self.page_queries(url)
+        self.assertEqual([room.hotel_id for room in response.context['hotel_rooms']], [self.hotel.pk])
+        self.assertEqual([link.comfort.name for link in response.context['hotel_comforts']], ['Бассейн'])
+
+        # Номера и удобства других отелей не меняют ни выдачу, ни число запросов
+        other = self.hotels[1]
+        Hotel_Room.objects.bulk_create([
+            Hotel_Room(hotel=other, description='', name=f'Номер {i}', max_people=2, rooms=1, price=900, free_count=1)
+            for i in range(20)
+        ])
+        response, after = self.page_queries(url)
+        self.assertEqual(len(response.context['hotel_rooms']), 1)
+        self.assertEqual(after, before)
+
+    def test_similar_hotels_from_neighbor_list(self):
+        response = self.client.get(reverse('hotel', args=[self.hotel.pk]))
+        found = response.context['similar_hotels']
+        self.assertEqual(len(found), similar.NEIGHBORS)
+        # Из того же города, с общими удобствами - выше
+        self.assertNotIn(self.hotels[5].pk, [hotel.pk for hotel in found])
+        self.assertEqual({hotel.pk for hotel in found[:2]}, {self.hotels[1].pk, self.hotels[2].pk})
+        self.assertContains(response, reverse('hotel', args=[found[0].pk]))
+
+    def test_hotel_change_schedules_one_refresh(self):
+        self.hotels[5].city = 'Москва'
+        self.hotels[5].save()
+        self.hotel.save()
+        self.assertEqual(Job.objects.filter(name='refresh_neighbors').count(), 1)
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(run_pending(), 1)
+        self.assertTrue(self.hotels[5].neighbors.exists())
+
+    def test_client_profile_without_room_dump(self):
+        self.client.force_login(self.owner)
+        response, queries = self.page_queries(reverse('client'))
+        self.assertNotIn('hotel_rooms', response.context)
+        self.assertEqual([hotel.rooms_total for hotel in response.context['hotels']], [1] * 6)
+        self.assertLessEqual(queries, settings.QUERY_BUDGETS['client'])
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class EmailLoginTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='ivan', email='ivan@test.ru', password='secret-pass')
+
+    def test_authenticate_by_email_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(authenticate(email='ivan@test.ru', password='secret-pass'), self.user)
+        self.assertEqual(len(queries), 1)
+        self.assertIsNone(authenticate(email='ivan@test.ru', password='wrong'))
+        self.assertIsNone(authenticate(email='nobody@test.ru', password='secret-pass'))
+        # Вход в админку по username по-прежнему работает
+        self.assertEqual(authenticate(username='ivan', password='secret-pass'), self.user)
+
+    def test_login_view(self):
+        response = self.client.post(reverse('logincheck'), {'email': 'ivan@test.ru', 'password': 'wrong'})
+        self.assertRedirects(response, reverse('login'))
+        response = self.client.post(reverse('logincheck'), {'email': 'ivan@test.ru', 'password': 'secret-pass'})
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.user.pk)
+
+    def test_username_allocated_in_one_query(self):
+        User.objects.create_user(username='ivan2', email='other@test.ru', password='x')
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_username('ivan@mail.ru'), 'ivan1')
+        self.assertEqual(allocate_username('petr@mail.ru'), 'petr')
+
+        data = {'first_name': 'Иван', 'last_name': 'Иванов', 'email': 'ivan@mail.ru', 'password': 'pass12345',
+                'confirm_password': 'pass12345'}
+        self.client.post(reverse('createuser'), data)
+        self.assertEqual(User.objects.get(email='ivan@mail.ru').username, 'ivan1')
+
+    def test_username_allocation_ignores_case(self):
+        User.objects.create_user(username='Olga', email='other@test.ru', password='x')
+        self.assertEqual(allocate_username('olga@mail.ru'), 'olga1')
+        User.objects.create_user(username='OLGA1', email='third@test.ru', password='x')
+        self.assertEqual(allocate_username('olga@mail.ru'), 'olga2')
+        self.assertEqual(allocate_username('Petr@mail.ru'), 'Petr')
+
+    def test_create_account_retries_taken_username(self):
+        # Имя заняли между выбором и вставкой: уникальный индекс отклоняет вставку, имя выбирается заново
+        with mock.patch('main.accounts.allocate_username', side_effect=['ivan', 'ivan1']):
+            user = create_account('ivan@mail.ru', 'pass12345')
+        self.assertEqual(user.username, 'ivan1')
+
+    def test_hasher_profile(self):
+        self.assertIn('$1000$', self.user.password)
+        # Смена профиля пересчитывает хэш при следующем входе
+        with override_settings(PASSWORD_HASH_ITERATIONS=1200):
+            self.assertIsNotNone(authenticate(email='ivan@test.ru', password='secret-pass'))
+        self.user.refresh_from_db()
+        self.assertIn('$1200$', self.user.password)
+
+    @override_settings(PASSWORD_HASHER_PROFILES={'fast': 500, 'strong': 2000})
+    def test_benchmark_hashers(self):
+        out = StringIO()
+        call_command('benchmark_hashers', iterations=2, workers=4, stdout=out)
+        self.assertIn('strong', out.getvalue())
+        self.assertIn('env', out.getvalue())
+        self.assertIn('запросов: 1', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], PASSWORD_HASH_ITERATIONS=1000)
+class ReplicaRoutingTest(TestCase):
+    # Вторая SQLite-БД в файле изображает реплику: в ней свои (отстающие) данные.
+    # Алиас появляется только на время класса, поэтому databases задается здесь, а не атрибутом
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        connections.settings['replica'] = {**connection.settings_dict, 'NAME': f'{cls.directory}/replica.sqlite3'}
+        call_command('migrate', database='replica', verbosity=0)
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.directory)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', email='owner@test.ru', password='pass')
+        cls.hotel = make_catalog(1, cls.owner, HotelStatus.objects.create(name='Активен'))[0]
+
+    def setUp(self):
+        search_cache.cache().clear()
+        # Та же строка в реплике, но еще со старым названием; bulk_create - без сигналов индексации
+        owner = User.objects.db_manager('replica').create_user(username='owner', password='pass')
+        status = HotelStatus.objects.using('replica').create(name='Активен')
+        Hotel.objects.using('replica').bulk_create([Hotel(
+            pk=self.hotel.pk, name='Старое название', stars=3, location='', phone='', email='', city='Москва',
+            to_center=1, about='', status=status, user=owner)])
+
+    def hotel_name(self):
+        return self.client.get(reverse('api_hotel', args=[self.hotel.pk])).json()['name']
+
+    def test_read_views_use_replica(self):
+        with CaptureQueriesContext(connection) as primary:
+            self.assertEqual(self.hotel_name(), 'Старое название')
+        self.assertEqual(len(primary), 0)
+        # Страницы с записью и вне списка REPLICA_VIEWS - в основной БД
+        with override_settings(REPLICA_VIEWS=set()):
+            self.assertEqual(self.hotel_name(), self.hotel.name)
+
+    def test_writer_sticks_to_primary(self):
+        response = self.client.post(reverse('logincheck'), {'email': 'owner@test.ru', 'password': 'pass'})
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.hotel_name(), self.hotel.name)
+
+        self.client.cookies[STICKY_COOKIE] = '0'
+        self.assertEqual(self.hotel_name(), 'Старое название')
+
+    def test_router_state(self):
+        router = ReplicaRouter()
+        # Вне запроса (команды, задачи) - только основная БД
+        self.assertEqual(router.db_for_read(Hotel), 'default')
+
+        state = RoutingState()
+        state.replica = 'replica'
+        token = routing_state.set(state)
+        self.addCleanup(routing_state.reset, token)
+        self.assertEqual(router.db_for_read(Hotel), 'replica')
+        # Запись в кэш в БД не закрепляет запрос за основной БД
+        cache_entry = mock.Mock(**{'_meta.app_label': 'django_cache'})
+        self.assertEqual(router.db_for_write(cache_entry), 'default')
+        self.assertEqual(router.db_for_read(cache_entry), 'default')
+        self.assertEqual(router.db_for_read(Hotel), 'replica')
+        router.db_for_write(Hotel)
+        self.assertEqual(router.db_for_read(Hotel), 'default')
+
+
+class StandInConnection:
+    # Заменитель соединения pymysql/sqlite3: только методы, которые трогает пул
+    def __init__(self):
+        self.encoders = {}
+        self.closed = False
+        self.broken = False
+        self.rollbacks = 0
+
+    def ping(self):
+        if self.broken:
+            raise ConnectionError('gone away')
+
+    def rollback(self):
+        if self.broken:
+            raise ConnectionError('gone away')
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(TestCase):
+    def make_pool(self, **options):
+        return db_pool.ConnectionPool(check=StandInConnection.ping, reset=StandInConnection.rollback, **options)
+
+    def test_connections_are_reused_and_reset(self):
+        pool = self.make_pool(size=2)
+        first = pool.acquire(StandInConnection)
+        pool.release(first)
+        self.assertIs(pool.acquire(StandInConnection), first)
+        self.assertEqual(first.rollbacks, 1)
+        second = pool.acquire(StandInConnection)
+        self.assertIsNot(second, first)
+        self.assertEqual(pool.stats()['created'], 2)
+        self.assertEqual(pool.stats()['in_use'], 2)
+
+    def test_exhausted_pool_waits_then_times_out(self):
+        pool = self.make_pool(size=1, timeout=0.5)
+        conn = pool.acquire(StandInConnection)
+        with ThreadPoolExecutor(1) as executor:
+            waiting = executor.submit(pool.acquire, StandInConnection)
+            time.sleep(0.05)
+            pool.release(conn)
+            self.assertIs(waiting.result(), conn)
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertGreater(pool.stats()['max_wait_ms'], 0)
+
+        pool.timeout = 0.01
+        with self.assertLogs('main.dbpool', 'WARNING'), self.assertRaises(db_pool.PoolTimeout):
+            pool.acquire(StandInConnection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_broken_and_old_connections_are_replaced(self):
+        pool = self.make_pool(size=1, check_after=0)
+        conn = pool.acquire(StandInConnection)
+        pool.release(conn)
+        conn.broken = True
+        fresh = pool.acquire(StandInConnection)
+        self.assertIsNot(fresh, conn)
+        self.assertTrue(conn.closed)
+
+        # Сбросить не удалось - соединение закрывается, слот освобождается
+        fresh.broken = True
+        pool.release(fresh)
+        self.assertEqual(pool.stats(), {**pool.stats(), 'in_use': 0, 'idle': 0, 'closed': 2})
+
+        pool.recycle = 0.01
+        old = pool.acquire(StandInConnection)
+        pool.release(old)
+        time.sleep(0.02)
+        self.assertIsNot(pool.acquire(StandInConnection), old)
+
+    def pooled_wrapper(self, wrapper_class, alias, **settings_dict):
+        wrapper = wrapper_class({**connection.settings_dict, 'CONN_MAX_AGE': 0, **settings_dict}, alias=alias)
+
+        def close_pool():
+            for key in [key for key in db_pool.POOLS if key[0] == alias]:
+                db_pool.POOLS.pop(key).close_idle()
+        self.addCleanup(close_pool)
+        return wrapper
+
+    def test_sqlite_backend_returns_connection_to_pool(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        wrapper = self.pooled_wrapper(PooledSQLiteWrapper, 'pooled_sqlite', NAME=f'{directory}/pool.sqlite3',
+                                      POOL={'SIZE': 2})
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        raw = wrapper.connection
+        wrapper.close()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIs(wrapper.connection, raw)
+        wrapper.close()
+        self.assertEqual(wrapper.connection_pool.stats()['created'], 1)
+        self.assertEqual(wrapper.connection_pool.stats()['idle'], 1)
+        self.assertIn('pooled_sqlite:' + f'{directory}/pool.sqlite3', db_pool.stats())
+
+    def test_mysql_backend_with_stand_in_server(self):
+        wrapper = self.pooled_wrapper(PooledMySQLWrapper, 'pooled_mysql', ENGINE='main.db.mysql', NAME='booking',
+                                      HOST='127.0.0.1', PORT='3306', USER='root', PASSWORD='root', OPTIONS={},
+                                      POOL={'SIZE': 1, 'TIMEOUT': 0.01, 'CHECK_AFTER': 0})
+        with mock.patch('django.db.backends.mysql.base.Database.connect',
+                        side_effect=lambda **params: StandInConnection()) as connect:
+            params = wrapper.get_connection_params()
+            wrapper.connection = first = wrapper.get_new_connection(params)
+            wrapper._close()
+            self.assertIs(wrapper.get_new_connection(params), first)
+            with self.assertLogs('main.dbpool', 'WARNING'), self.assertRaises(db_pool.PoolTimeout):
+                wrapper.get_new_connection(params)
+            wrapper.connection_pool.release(first)
+
+            # Сервер закрыл соединение: ping перед выдачей не проходит, пул открывает новое
+            first.broken = True
+            self.assertIsNot(wrapper.get_new_connection(params), first)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(connect.call_args.kwargs['database'], 'booking')
+        self.assertGreater(wrapper.pool_wait, 0)
+
+    def test_benchmark_db_pool_needs_closable_connections(self):
+        # Тестовая SQLite в памяти не закрывает соединений - сравнивать нечего
+        with self.assertRaises(CommandError):
+            call_command('benchmark_db_pool', threads=2, requests=3, stdout=StringIO())
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+# Тесты идут в одном процессе, поэтому кэш сессий в памяти достаточен
+@override_settings(CACHES={**settings.CACHES, 'sessions': settings.SESSION_CACHE_BACKENDS['locmem']})
+class SessionStackTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='ivan', email='ivan@test.ru', password='secret-pass')
+
+    def setUp(self):
+        caches['sessions'].clear()
+
+    def session_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [query['sql'] for query in queries if 'django_session' in query['sql']]
+
+    def test_messages_in_signed_cookie(self):
+        response = self.client.post(reverse('logincheck'), {'email': 'ivan@test.ru', 'password': 'wrong'})
+        self.assertIn('messages', response.cookies)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_cached_sessions_skip_database_reads(self):
+        for store, expected in (('db', 1), ('cached_db', 0), ('write_behind', 0)):
+            with self.subTest(store=store), override_settings(SESSION_ENGINE=settings.SESSION_STORES[store]):
+                # Хранилище выбирается при загрузке middleware - нужен новый клиент
+                self.client = self.client_class()
+                self.client.post(reverse('logincheck'), {'email': 'ivan@test.ru', 'password': 'secret-pass'})
+                self.assertEqual(len(self.session_queries(reverse('profile'))), expected)
+
+    @override_settings(SESSION_WRITE_BEHIND_DELAY=0)
+    def test_write_behind_coalesces_database_writes(self):
+        session = SessionStore()
+        session['step'] = 1
+        session.create()
+        self.assertEqual(SessionStore().decode(Session.objects.get().session_data), {'step': 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            for step in (2, 3, 4):
+                session['step'] = step
+                session.save()
+        # В django_session ничего, на три изменения - одна задача
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(Job.objects.filter(name='persist_session').count(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session.session_key)['step'], 4)
+
+        run_pending()
+        self.assertEqual(SessionStore().decode(Session.objects.get().session_data), {'step': 4})
+        # Вытесненная из кэша сессия читается из БД
+        caches['sessions'].clear()
+        self.assertEqual(SessionStore(session.session_key)['step'], 4)
+
+        session['step'] = 5
+        session.save()
+        session.delete()
+        run_pending()
+        self.assertFalse(Session.objects.exists())
+
+    def test_benchmark_sessions(self):
+        call_command('seed_catalog', hotels=3, rooms_per_hotel=1, files_per_room=0, bookings=0, users=1,
+                     stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark_sessions', rounds=2, only=['before', 'cached_db'], stdout=out)
+        self.assertIn('cached_db: ', out.getvalue())
+        self.assertFalse(User.objects.filter(email='benchmark-sessions@example.com').exists())
+
+
+class SeedAndBenchmarkTest(TestCase):
+    def test_seed_then_benchmark_writes_report(self):
+        call_command('seed_catalog', hotels=6, rooms_per_hotel=2, files_per_room=2, bookings=30, users=3,
+                     batch_size=4, stdout=StringIO())
+        self.assertEqual(Hotel.objects.count(), 6)
+        self.assertEqual(Files.objects.count(), 6 + 6 * 2 * 2)
+        self.assertEqual(BookingHistory.objects.count(), 30)
+        self.assertEqual(Hotel.objects.prefix_search('city', Hotel.objects.first().city).exists(), True)
+        self.assertTrue(fulltext.search(Hotel.objects.all(), Hotel.objects.first().city).exists())
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark', iterations=2, warmup=0, output=output.name, stdout=StringIO())
+            report = json.load(output)
+        self.assertEqual(report['meta']['rows']['Hotel'], 6)
+        for name in ('search', 'search_text', 'search_comforts', 'hotel_detail', 'hotel_rooms', 'room_detail', 'profile', 'clientprofile'):
+            self.assertEqual(set(report['results'][name]),
+                             {'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'queries', 'peak_memory_kb'})
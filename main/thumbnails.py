@@ -0,0 +1,48 @@
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Размеры производных изображений: вписываются в рамку с сохранением пропорций
+SIZES = {
+    'card': (480, 320),
+    'gallery': (960, 640),
+    'full': (1920, 1280),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def render(image, size, fmt):
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    if fmt == 'jpeg' and copy.mode != 'RGB':
+        copy = copy.convert('RGB')
+    elif copy.mode not in ('RGB', 'RGBA'):
+        copy = copy.convert('RGBA')
+
+    pil_format, params = FORMATS[fmt]
+    buffer = BytesIO()
+    copy.save(buffer, pil_format, **params)
+    return buffer.getvalue(), copy.size
+
+
+def make_derivatives(photo):
+    # Нарезает card/gallery/full в WebP и JPEG, пути и размеры сохраняет в Files.derivatives
+    with photo.file.open('rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+
+    derivatives = {}
+    for size_name, size in SIZES.items():
+        for fmt in FORMATS:
+            content, (width, height) = render(image, size, fmt)
+            name = default_storage.save(f'files/derivatives/{photo.pk}/{size_name}.{fmt}', ContentFile(content))
+            derivatives.setdefault(size_name, {})[fmt] = {'name': name, 'width': width, 'height': height}
+
+    photo.derivatives = derivatives
+    photo.save(update_fields=['derivatives'])
+    return derivatives
@@ -0,0 +1,49 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from main import search_cache
+from main.jobs import enqueue_many
+from main.models import Files, Hotel, Hotel_Room
+
+
+def save_photos(user, hotel, room, uploaded_files, description=None, primary_index=None):
+    # 1. Файлы копируются в хранилище по частям из временных файлов загрузки, в память целиком не читаются
+    field = Files._meta.get_field('file')
+    names = []
+    try:
+        for uploaded_file in uploaded_files:
+            name = field.generate_filename(None, uploaded_file.name)
+            names.append(default_storage.save(name, uploaded_file, max_length=field.max_length))
+
+        # 2. Все строки Files и задачи на превью - одной транзакцией и пачкой INSERT
+        with transaction.atomic():
+            if primary_index is not None:
+                # Фото самого отеля - без номера (как в loaders.hotel_photos): основные фото номеров не трогаем
+                scope = Files.objects.filter(room=room) if room else Files.objects.filter(hotel=hotel, room__isnull=True)
+                scope.filter(is_primary=True).update(is_primary=False)
+
+            photos = Files.objects.bulk_create([
+                Files(user=user, hotel=hotel, room=room, file=name, description=description,
+                      is_primary=(index == primary_index))
+                for index, name in enumerate(names)
+            ])
+            ids = [photo.pk for photo in photos]
+            if None in ids:
+                # MySQL не возвращает id из bulk_create
+                ids = list(Files.objects.filter(file__in=names).values_list('pk', flat=True))
+            enqueue_many('make_derivatives', [{'file_id': pk} for pk in ids])
+
+            # UPDATE и bulk_create не шлют сигналы: карточки и ETag двигаем сами, как touch_photo_owner,
+            # а кэш выдачи сбрасываем после коммита, как invalidate_search_cache
+            now = timezone.now()
+            Hotel.objects.filter(pk=hotel.pk).update(updated_at=now)
+            if room:
+                Hotel_Room.objects.filter(pk=room.pk).update(updated_at=now)
+            transaction.on_commit(search_cache.bump_version)
+    except Exception:
+        # Без строк в БД файлы никому не нужны
+        for name in names:
+            default_storage.delete(name)
+        raise
+    return photos
@@ -16,7 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from . import views
+from . import api, views
 from .views import SearchHotel, HotelDetailView, HotelRoomsDetailView, RoomDetailView, BookRoomDetailView, \
     uploadroomphoto
 
@@ -31,6 +31,7 @@ urlpatterns = [
     path('logincheck/', views.logincheck, name='logincheck'),
     path('logout/', views.user_logout, name='logout'),
     path('profile/', views.profile, name='profile'),
+    path('bookings/<int:pk>/cancel/', views.cancelbooking, name='cancel_booking'),
 
     path('hotels/<int:pk>/', HotelDetailView.as_view(), name='hotel'),
 
@@ -49,4 +50,9 @@ urlpatterns = [
     path('room/rooms/<int:pk>/addphoto', views.uploadroomphoto, name='room_add_photo'),
 
     path('rooms/createroom', views.createroom, name='client_add_room'),
+
+    path('api/v1/hotels/', api.hotels, name='api_hotels'),
+    path('api/v1/hotels/<int:pk>/', api.hotel_detail, name='api_hotel'),
+    path('api/v1/hotels/<int:pk>/rooms/', api.hotel_rooms, name='api_hotel_rooms'),
+    path('api/v1/rooms/<int:pk>/', api.room_detail, name='api_room'),
 ]
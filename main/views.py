@@ -1,15 +1,28 @@
-
-from datetime import datetime
+import hashlib
+import uuid
+from datetime import date
+from decimal import ROUND_CEILING, Decimal, InvalidOperation
 
 from django.contrib.auth import authenticate, logout, login
 from django.contrib.auth.models import User
-from django.db.models import Q, Min, Sum
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import IntegrityError
+from django.db.models import Count, OuterRef, Q, Subquery, Sum, prefetch_related_objects
+from django.db.models.functions import Coalesce
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.utils import timezone
 from django.views.generic import DetailView, CreateView
 from django.views.generic.list import ListView
 
-from main.models import BookingHistory, BookingFavorites, Hotel, Hotel_Comfort, Hotel_Room, Files, Comfort
+from main import facets, fulltext, loaders, search_cache
+from main.accounts import create_account
+from main.analytics import hotel_summary, month_bounds, occupancy, with_room_stats
+from main.booking import BookingError, book_room, cancel_booking
+from main.models import BookingHistory, BookingFavorites, Hotel, Hotel_Comfort, Hotel_Room, Comfort
+from main.pagination import KeysetPaginator
+from main.uploads import save_photos
 
 
 # Create your views here.
@@ -18,16 +31,6 @@ from main.models import BookingHistory, BookingFavorites, Hotel, Hotel_Comfort,
 def home(request):
     return render(request, 'home.html')
 
-def hotels(request):
-
-    data = {
-        'hotels': Hotel.objects.all(),
-        'hotel_comfort': Hotel_Comfort.objects.all(),
-        'min_price': Hotel_Room.objects.order_by('price').first(),
-    }
-
-    return render(request, 'hotels.html', data)
-
 def help(request):
     return render(request, 'help.html')
 
@@ -53,34 +56,93 @@ def profile(request):
         messages.error(request, 'Пожалуйста, войдите в систему')
         return redirect('login')
 
-    # Передаем данные пользователя в шаблон
+    # Все счетчики одним запросом, списки - страницами с отелем и номером через JOIN
+    stats = profile_stats(request.user.id)
+    history = (BookingHistory.objects
+               .filter(user_id=request.user.id)
+               .select_related('hotel', 'room')
+               .order_by('-datefrom', '-pk'))
+    favorites = (BookingFavorites.objects
+                 .filter(user_id=request.user.id)
+                 .select_related('hotel', 'room')
+                 .order_by('-pk'))
+    active_bookings = profile_page(request, 'active_page', history.filter(is_active=True), stats['active'])
+    inactive_bookings = profile_page(request, 'history_page', history.filter(is_active=False), stats['inactive'])
+    bookingfavorites = profile_page(request, 'favorites_page', favorites, stats['favorites'])
+
+    # Основные фото отелей всех трех списков - одним запросом
+    hotels = [item.hotel for page in (active_bookings, inactive_bookings, bookingfavorites) for item in page]
+    prefetch_related_objects(hotels, loaders.hotel_photos(primary_only=True))
+
     context = {
         'user': request.user,
-        'bookinghistory': BookingHistory.objects.filter(user_id=request.user.id),
-        'active_bookings': BookingHistory.objects.filter(user_id=request.user.id, is_active=True),
-        'inactive_bookings': BookingHistory.objects.filter(user_id=request.user.id, is_active=False),
-        'bookingfavorites': BookingFavorites.objects.filter(user_id=request.user.id),
+        'stats': stats,
+        'active_bookings': active_bookings,
+        'inactive_bookings': inactive_bookings,
+        'bookingfavorites': bookingfavorites,
     }
     return render(request, 'profile.html', context)
 
+
+def cancelbooking(request, pk):
+    if not request.user.is_authenticated:
+        messages.error(request, 'Пожалуйста, войдите в систему')
+        return redirect('login')
+    if request.method != 'POST':
+        return redirect('profile')
+
+    history = get_object_or_404(BookingHistory, pk=pk, user=request.user)
+    if history.booking_id is None or not cancel_booking(history.booking_id, user=request.user):
+        messages.error(request, 'Это бронирование нельзя отменить.')
+    else:
+        messages.success(request, f'Бронирование в отеле "{history.hotel.name}" отменено.')
+    return redirect('profile')
+
+
+PROFILE_PAGE_SIZE = 10
+
+
+def profile_stats(user_id):
+    # Условная агрегация по истории броней и подзапрос по избранному - один запрос вместо четырех COUNT
+    favorites = (BookingFavorites.objects
+                 .filter(user_id=OuterRef('pk'))
+                 .order_by()
+                 .values('user_id')
+                 .annotate(count=Count('pk'))
+                 .values('count'))
+    return (User.objects
+            .filter(pk=user_id)
+            .annotate(
+                active=Count('bookinghistory', filter=Q(bookinghistory__is_active=True)),
+                inactive=Count('bookinghistory', filter=Q(bookinghistory__is_active=False)),
+                spent=Coalesce(Sum('bookinghistory__price', filter=Q(bookinghistory__is_cancelled=False)), 0),
+                favorites=Coalesce(Subquery(favorites), 0),
+            )
+            .values('active', 'inactive', 'spent', 'favorites')
+            .get())
+
+
+def profile_page(request, page_kwarg, queryset, count):
+    paginator = Paginator(queryset, PROFILE_PAGE_SIZE)
+    # Число записей уже посчитано в profile_stats, отдельный COUNT не нужен
+    paginator.count = count
+    page = paginator.get_page(request.GET.get(page_kwarg))
+    page.object_list = list(page.object_list)
+    return page
+
 def logincheck(request):
     if request.method == 'POST':
         email = request.POST.get('email', '')
         password = request.POST.get('password', '')
-        try:
-            user = User.objects.get(email=email)
-            user = authenticate(request, username=user.username, password=password)
-
-            if user is not None:
-                login(request, user)
-                messages.success(request, 'Вы успешно вошли')
-                return redirect('profile')
-            else:
-                messages.error('Неверный логин или пароль')
-                return redirect('login')
-        except User.DoesNotExist:
-            messages.error(request, 'Пользователь с таким email не найден')
-            return redirect('login')
+        # Один запрос по индексу email (main.backends.EmailBackend)
+        user = authenticate(request, email=email, password=password)
+
+        if user is not None:
+            login(request, user)
+            messages.success(request, 'Вы успешно вошли')
+            return redirect('profile')
+        messages.error(request, 'Неверный email или пароль')
+        return redirect('login')
 
     return redirect('login')
 
@@ -107,23 +169,13 @@ def createuser(request):
                 messages.error(request, 'Пользователь с таким email уже существует')
                 return redirect('register')
 
-            # Создаем username из email (убираем @ и домен)
-            username = email.split('@')[0]
-            # Если username уже существует, добавляем число
-            base_username = username
-            counter = 1
-            while User.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
-
-            # Создаем пользователя
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password,
+            # Создаем пользователя; username - из email до @, свободный вариант подбирается одним запросом
+            create_account(
+                email,
+                password,
                 first_name=first_name,
                 last_name=last_name,
-                date_joined=datetime.now(),
+                date_joined=timezone.now(),
             )
 
             messages.success(request, 'Аккаунт успешно создан! Теперь вы можете войти.')
@@ -137,62 +189,215 @@ def createuser(request):
     return redirect('register')
 
 
+def parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+DEFAULT_RADIUS_KM = 5
+MAX_RADIUS_KM = 100
+
+
+def parse_float(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+MAX_RATING = Decimal(5)
+RATING_STEP = Decimal('0.1')
+
+
+def parse_rating(value):
+    # Decimal, как и колонка rating: nan/inf и мусор отбрасываются, остальное зажимается в шкалу 0-5
+    # и округляется вверх до шага колонки, чтобы сравнение >= не захватывало лишнего
+    try:
+        rating = Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+    if rating is None or not rating.is_finite():
+        return None
+    return min(max(rating, Decimal(0)), MAX_RATING).quantize(RATING_STEP, rounding=ROUND_CEILING)
+
+
+def geo_point(params):
+    # Точка поиска ?lat=&lon= (радиус ?radius= в км) или рамка ?bbox=юг,запад,север,восток
+    latitude, longitude = parse_float(params.get('lat')), parse_float(params.get('lon'))
+    if latitude is not None and longitude is not None and -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        return latitude, longitude
+    return None
+
+
+def geo_box(params):
+    parts = [parse_float(part) for part in (params.get('bbox') or '').split(',')]
+    if len(parts) == 4 and None not in parts and parts[0] < parts[2] and parts[1] < parts[3]:
+        return parts
+    return None
+
+
+SEARCH_SORTS = {
+    'name': KeysetPaginator('name'),
+    'stars': KeysetPaginator('stars', descending=True),
+    'price_asc': KeysetPaginator('min_price', nullable=True),
+    'price_desc': KeysetPaginator('min_price', descending=True, nullable=True),
+    'rating': KeysetPaginator('rating_score', descending=True),
+    'distance': KeysetPaginator('distance'),
+    'to_center': KeysetPaginator('to_center'),
+    'relevance': KeysetPaginator('relevance', descending=True),
+}
+
+
+def search_sort(params):
+    sort = params.get('sort')
+    has_text = bool(fulltext.parse_query(params.get('name')))
+    if sort not in SEARCH_SORTS:
+        # С текстом запроса по умолчанию сначала самые подходящие отели
+        sort = 'relevance' if has_text else 'name'
+    # Расстояние считается только в гео-режиме, релевантность - только по тексту запроса
+    if (sort == 'distance' and not (geo_point(params) or geo_box(params))) or (sort == 'relevance' and not has_text):
+        sort = 'name'
+    return sort
+
+
+def search_keyset(params):
+    return SEARCH_SORTS[search_sort(params)]
+
+
+def filter_hotels(queryset, params):
+    # Фильтры поиска: общие для HTML-выдачи и JSON API
+    name = params.get('name')
+    city = params.get('city')
+    stars = params.get('stars')
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+    check_in = parse_date(params.get('check_in'))
+    check_out = parse_date(params.get('check_out'))
+    guests = params.get('guests')
+    min_rating = parse_rating(params.get('min_rating'))
+    max_to_center = parse_float(params.get('max_to_center'))
+    comforts = facets.selected(params)
+    point, box = geo_point(params), geo_box(params)
+
+    # Применяем фильтры
+    if name:
+        # Полнотекстовый поиск по названию, описанию, удобствам и номерам (main/fulltext.py)
+        queryset = fulltext.search(queryset, name)
+
+    if city:
+        queryset = queryset.prefix_search('city', city)
+
+    if stars:
+        queryset = queryset.filter(stars=stars)
+    if min_price:
+        # Ищем отели, у которых есть хотя бы один номер с ценой >= min_price
+        queryset = queryset.filter(max_price__gte=min_price)
+
+    if max_price:
+        # Ищем отели, у которых есть хотя бы один номер с ценой <= max_price
+        queryset = queryset.filter(min_price__lte=max_price)
+
+    if min_rating:
+        # Рейтинг хранится в колонке отеля, фильтр идет по индексу без GROUP BY по отзывам
+        queryset = queryset.filter(rating__gte=min_rating)
+
+    if max_to_center is not None:
+        queryset = queryset.filter(to_center__lte=max_to_center)
+
+    if comforts:
+        # Все выбранные удобства сразу (И), по индексу (comfort, hotel)
+        queryset = facets.filter_comforts(queryset, comforts)
+
+    # Гео-режим: кандидаты выбираются по индексу геохеша, расстояние считается только для них
+    if point:
+        radius = parse_float(params.get('radius')) or DEFAULT_RADIUS_KM
+        queryset = queryset.near(*point, min(max(radius, 0.1), MAX_RADIUS_KM))
+    elif box:
+        queryset = queryset.within_box(*box)
+
+    # Свободные номера на даты проверяются по таблице занятости RoomNight, без перебора броней
+    if check_in and check_out and check_in < check_out:
+        queryset = queryset.available_between(check_in, check_out, int(guests) if guests and guests.isdigit() else 1)
+
+    return queryset
+
+
 class SearchHotel(ListView):
     template_name = 'hotels.html'
     context_object_name = 'hotels'
     paginate_by = 5
+    sorts = SEARCH_SORTS
+
+    cached_ids = None
 
     def get_queryset(self):
-        queryset = Hotel.objects.all()
-
-        # Получаем все параметры из GET запроса
-        name = self.request.GET.get('name')
-        city = self.request.GET.get('city')
-        stars = self.request.GET.get('stars')
-        min_price = self.request.GET.get('min_price')
-        max_price = self.request.GET.get('max_price')
-
-        # Применяем фильтры
-        if name:
-            queryset = queryset.filter(name__icontains=name)
-
-        if city:
-            queryset = queryset.filter(city__icontains=city)
-
-        if stars:
-            queryset = queryset.filter(stars=stars)
-        if min_price:
-            # Ищем отели, у которых есть хотя бы один номер с ценой >= min_price
-            queryset = queryset.filter(hotel_room__price__gte=min_price).distinct()
-
-        if max_price:
-            # Ищем отели, у которых есть хотя бы один номер с ценой <= max_price
-            queryset = queryset.filter(hotel_room__price__lte=max_price).distinct()
-
-        # Сортировка
-        sort = self.request.GET.get('sort', 'name')
-        if sort in ['price_asc', 'price_desc']:
-            queryset = queryset.annotate(min_room_price=Min('hotel_room__price'))
-
-        if sort == 'price_asc':
-            queryset = queryset.order_by('min_room_price')
-        elif sort == 'price_desc':
-            queryset = queryset.order_by('-min_room_price')
-        elif sort == 'stars':
-            queryset = queryset.order_by('-stars')
-        elif sort == 'rating':
-            queryset = queryset.order_by('-rating')
-        else:
-            queryset = queryset.order_by('name')
-
-        return queryset
+        queryset = filter_hotels(self.card_queryset(), self.request.GET)
+        # Сортировка: всегда с pk вторым ключом, чтобы курсорная пагинация была стабильной
+        return queryset.order_by(*self.keyset().order_by())
+
+    def card_queryset(self):
+        # Карточке нужно только основное фото самого отеля: фото номеров и галерея не загружаются
+        return Hotel.objects.with_room_stats().prefetch_related(loaders.hotel_photos(primary_only=True))
+
+    def keyset(self):
+        return search_keyset(self.request.GET)
+
+    def paginate_queryset(self, queryset, page_size):
+        # Упорядоченные id выдачи берутся из кэша по нормализованным фильтрам
+        key = search_cache.make_key(self.request.GET, self.sorts)
+        if key is not None:
+            self.cached_ids = search_cache.get_or_set_ids(key, lambda: list(queryset.values_list('pk', flat=True)))
+            return self.paginate_ids(self.cached_ids, page_size)
+
+        # ?page=N - старая навигация через OFFSET, по умолчанию - курсор: страница N стоит как первая
+        if self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        page = self.keyset().paginate(queryset, self.request.GET.get('cursor'), page_size)
+        return None, page, page.object_list, page.has_other_pages()
+
+    def load_hotels(self, ids):
+        hotels = self.card_queryset().in_bulk(ids)
+        return [hotels[pk] for pk in ids if pk in hotels]
+
+    def paginate_ids(self, ids, page_size):
+        if self.page_kwarg in self.request.GET:
+            paginator = Paginator(ids, page_size)
+            page = paginator.get_page(self.request.GET.get(self.page_kwarg))
+            page.object_list = self.load_hotels(page.object_list)
+            return paginator, page, page.object_list, page.has_other_pages()
+        page = self.keyset().paginate_ids(ids, self.request.GET.get('cursor'), page_size, self.load_hotels)
+        return None, page, page.object_list, page.has_other_pages()
+
+    def total_count(self):
+        if self.cached_ids is not None:
+            return len(self.cached_ids)
+        # COUNT(*) по выборке с фильтрами дорогой, поэтому кэшируется на минуту
+        params = sorted((key, value) for key, value in self.request.GET.lists()
+                        if key not in ('cursor', 'sort', self.page_kwarg))
+        key = 'hotels_count:' + hashlib.md5(repr(params).encode()).hexdigest()
+        return cache.get_or_set(key, lambda: self.object_list.count(), 60)
+
+    def facets(self):
+        # Счетчики удобств по всей выдаче (не только странице): пересечение битовых карт с ее id.
+        # Кэшируются рядом с id выдачи по тому же ключу
+        def compute():
+            ids = self.cached_ids
+            if ids is None:
+                ids = self.object_list.values_list('pk', flat=True)
+            return facets.counts(ids)
+
+        key = search_cache.make_key(self.request.GET, self.sorts)
+        if key is None:
+            return compute()
+        return search_cache.cache().get_or_set(key + ':facets', compute, search_cache.TIMEOUT)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context['hotel_comforts'] = Hotel_Comfort.objects.all()
-        context['hotel_rooms'] = Hotel_Room.objects.all()
-        context['min_price'] = Hotel_Room.objects.order_by('price').first()
+        # Список, а не метод: шаблон обращается к нему дважды
+        context['facets'] = self.facets()
         # Сохраняем текущие значения фильтров для формы
         context['current_filters'] = {
             'name': self.request.GET.get('name', ''),
@@ -200,35 +405,55 @@ class SearchHotel(ListView):
             'stars': self.request.GET.get('stars', ''),
             'min_price': self.request.GET.get('min_price', ''),
             'max_price': self.request.GET.get('max_price', ''),
-            'sort': self.request.GET.get('sort', 'name'),
+            'check_in': self.request.GET.get('check_in', ''),
+            'check_out': self.request.GET.get('check_out', ''),
+            'guests': self.request.GET.get('guests', ''),
+            'min_rating': self.request.GET.get('min_rating', ''),
+            'max_to_center': self.request.GET.get('max_to_center', ''),
+            'sort': search_sort(self.request.GET),
+            'comforts': facets.selected(self.request.GET),
         }
+        # Считается, только если шаблон его выводит
+        context['total_count'] = self.total_count
+        query = self.request.GET.copy()
+        query.pop('cursor', None)
+        query.pop(self.page_kwarg, None)
+        context['query_string'] = query.urlencode()
+        query.pop('sort', None)
+        context['sort_query_string'] = query.urlencode()
         return context
 
 
 class HotelDetailView(DetailView):
     model = Hotel
+    queryset = Hotel.objects.with_room_stats().prefetch_related(loaders.hotel_photos())
     template_name = 'hotel.html'
     context_object_name = 'hotel'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        hotel = self.get_object()
+        # Отель уже загружен в get(); номера, фото и удобства - только этого отеля
+        hotel = loaders.load_rooms_and_comforts([self.object])[0]
 
-        context['hotel_comforts'] = Hotel_Comfort.objects.all()
-        context['hotel_rooms'] = Hotel_Room.objects.all()
-        context['hotel'] = hotel
-        context['min_price'] = Hotel_Room.objects.order_by('price').first()
-        context['files'] = Files.objects.filter(hotel_id = hotel.id, is_primary=False)
+        context['hotel_comforts'] = hotel.hotel_comfort_set.all()
+        context['hotel_rooms'] = hotel.hotel_room_set.all()
+        context['files'] = hotel.gallery_photos
+        context['similar_hotels'] = loaders.similar_hotels(hotel)
 
         return context
 
 def clientprofile(request):
-    hotels = Hotel.objects.filter(user_id=request.user.id).prefetch_related('hotel_room_set')
+    hotels = list(loaders.owner_hotels(request.user.id))
+
+    today = timezone.localdate()
+    start, end = month_bounds(today)
+    summary = hotel_summary([hotel.pk for hotel in hotels], start, end, today)
 
     data = {
         'hotels': hotels,
-        'hotel_rooms': Hotel_Room.objects.all()
+        'total_hotels': len(hotels),
+        'stats': summary,
     }
     return render(request, 'clientprofile.html', data)
 
@@ -240,23 +465,29 @@ class HotelRoomsDetailView(DetailView):  # Переименуйте класс,
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        hotel = self.object
 
-        # Главный объект теперь - это ОТЕЛЬ (self.get_object() вернет Hotel)
-        hotel = self.get_object()
-
-        # Фильтруем все остальные данные, используя этот объект Hotel
-        rooms = Hotel_Room.objects.filter(hotel=hotel)
+        # Статистика читается из дневных сводок за текущий месяц, а не из истории бронирований
+        today = timezone.localdate()
+        start, end = month_bounds(today)
+        days = (end - start).days
+        rooms = list(with_room_stats(Hotel_Room.objects.filter(hotel=hotel), start, end))
+        for room in rooms:
+            room.occupancy_rate = occupancy(room.nights_sold, room.free_count, days)
+        summary = hotel_summary([hotel.pk], start, end, today)
 
-        # Теперь переменная 'hotel' уже есть в контексте
         context['rooms'] = rooms
         context['hotel_comforts'] = Hotel_Comfort.objects.filter(hotel=hotel)
-        context['min_price'] = rooms.order_by('price').first()
-        context['active_rooms'] = rooms.aggregate(total=Sum('free_count'))['total'] or 0
+        context['min_price'] = min(rooms, key=lambda room: room.price, default=None)
+        context['active_rooms'] = sum(room.free_count for room in rooms)
+        context['booked_rooms'] = summary['booked_today']
+        context['total_revenue'] = summary['period_revenue']
 
         return context
 
 class RoomDetailView(DetailView):
     model = Hotel_Room
+    queryset = Hotel_Room.objects.with_photos()
     template_name = 'room.html'
     context_object_name = 'room'
 
@@ -268,7 +499,7 @@ class RoomDetailView(DetailView):
 
         context['hotel'] = hotel
         context['room'] = room
-        context['files'] = Files.objects.filter(room_id=room.id, is_primary=False)
+        context['files'] = room.gallery_photos
 
         return context
 
@@ -367,12 +598,12 @@ def uploadhotelphoto(request):
     if request.method == 'POST':
 
         try:
-            uploaded_file = request.FILES.get('image')
+            uploaded_files = request.FILES.getlist('image')
             hotel_id = request.POST.get('hotel_id')
-            is_primary = request.POST.get('is_primary') == 'on'
+            is_primary = request.POST.get('is_primary') in ('on', '1')
             description = request.POST.get('description')
 
-            if not uploaded_file:
+            if not uploaded_files:
                 messages.error(request, 'Файл для загрузки не найден.')
                 return redirect('client')
 
@@ -380,22 +611,14 @@ def uploadhotelphoto(request):
             # Проверка, что отель существует и принадлежит пользователю
             hotel = get_object_or_404(Hotel, id=hotel_id)
 
-            # 4. Если нужно сделать фото основным, сбросить старое основное фото
-            if is_primary:
-                Files.objects.filter(hotel=hotel, is_primary=True).update(is_primary=False)
+            # Основным становится первое фото; старое основное сбрасывается в той же транзакции.
+            # Превью нарезаются фоновым воркером, запрос не ждет обработку изображений
+            save_photos(request.user, hotel, None, uploaded_files, description, 0 if is_primary else None)
 
-
-
-            files = Files.objects.create(
-                file=uploaded_file,
-                hotel=hotel,
-                room=None,
-                user=request.user,
-                description=description,
-                is_primary=is_primary
-            )
-
-            messages.success(request, f'Фото "{uploaded_file.name}" успешно загружено к отелю "{hotel.name}".')
+            if len(uploaded_files) == 1:
+                messages.success(request, f'Фото "{uploaded_files[0].name}" успешно загружено к отелю "{hotel.name}".')
+            else:
+                messages.success(request, f'{len(uploaded_files)} фото успешно загружено к отелю "{hotel.name}".')
             return redirect('client')
 
         except Hotel.DoesNotExist:
@@ -412,6 +635,7 @@ def uploadhotelphoto(request):
 
 class BookRoomDetailView(DetailView):
     model = Hotel_Room
+    queryset = Hotel_Room.objects.with_photos()
     template_name = 'bookroom.html'
     context_object_name = 'bookroom'
 
@@ -423,9 +647,44 @@ class BookRoomDetailView(DetailView):
 
         context['hotel'] = hotel
         context['room'] = room
-        context['files'] = Files.objects.filter(room_id=room.id, is_primary=False)
+        context['files'] = room.gallery_photos
+        # Ключ на каждый показ формы: повторная отправка той же формы не создаст вторую бронь
+        context['idempotency_key'] = uuid.uuid4().hex
 
         return context
+    def post(self, request, pk):
+        if not request.user.is_authenticated:
+            messages.error(request, 'Пожалуйста, войдите в систему')
+            return redirect('login')
+
+        try:
+            booking = book_room(
+                user=request.user,
+                room_id=pk,
+                datefrom=date.fromisoformat(request.POST.get('check_in', '')),
+                dateto=date.fromisoformat(request.POST.get('check_out', '')),
+                people=int(request.POST.get('guests', 1)),
+                name=request.POST.get('name') or request.user.first_name,
+                surname=request.POST.get('surname') or request.user.last_name,
+                idoc_series=int(request.POST.get('idoc_series', '')),
+                idoc_number=int(request.POST.get('idoc_number', '')),
+                idempotency_key=request.POST.get('idempotency_key') or None,
+            )
+        except Hotel_Room.DoesNotExist:
+            messages.error(request, 'Выбранный номер не существует.')
+            return redirect('hotels')
+        except ValueError:
+            messages.error(request, 'Ошибка: проверьте даты и данные документа.')
+            return redirect('bookroom_detail', pk=pk)
+        except BookingError as e:
+            messages.error(request, str(e))
+            return redirect('bookroom_detail', pk=pk)
+        except IntegrityError:
+            messages.error(request, 'Не удалось оформить бронь, попробуйте еще раз.')
+            return redirect('bookroom_detail', pk=pk)
+
+        messages.success(request, f'Номер "{booking.room.name}" забронирован.')
+        return redirect('profile')
 
 
 def uploadroomphoto(request, pk):
@@ -445,22 +704,10 @@ def uploadroomphoto(request, pk):
             hotel = get_object_or_404(Hotel, id=hotel_id)
             room = get_object_or_404(Hotel_Room, id=room_id, hotel__user=request.user)
 
-            # Обрабатываем каждое загруженное фото
-            for index, uploaded_file in enumerate(uploaded_files):
-                is_primary = (int(primary_photo_index) == index)
-
-                # Если нужно сделать фото основным, сбросить старое основное фото для этой комнаты
-                if is_primary:
-                    Files.objects.filter(room=room, is_primary=True).update(is_primary=False)
-
-                files = Files.objects.create(
-                    file=uploaded_file,
-                    hotel=hotel,
-                    room=room,
-                    user=request.user,
-                    description=description,
-                    is_primary=is_primary
-                )
+            # Все фото сохраняются одной транзакцией: один UPDATE основного фото и один bulk INSERT
+            primary_index = int(primary_photo_index)
+            save_photos(request.user, hotel, room, uploaded_files, description,
+                        primary_index if 0 <= primary_index < len(uploaded_files) else None)
 
             messages.success(request, f'{len(uploaded_files)} фото успешно загружено для номера "{room.name}".')
             return redirect('room_detail', pk=room_id)